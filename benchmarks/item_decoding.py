@@ -0,0 +1,177 @@
+"""
+Benchmark of the decoding of a catalog page into Item objects, as done by
+Items.search for every poll of a query.
+
+A page of generated API items is decoded with json and with orjson when it is
+installed, and the time per item, the memory retained by the decoded page and
+the size of an Item object are reported. To get the numbers of another version
+of Item, run the script on a checkout of that version.
+
+Usage:
+    python benchmarks/item_decoding.py
+    python benchmarks/item_decoding.py --items 960 --runs 500
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# The modules of the application live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--items", type=int, default=96, help="items per page (default: 96)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=200, help="decodings of the page (default: 200)"
+    )
+    return parser.parse_args()
+
+
+def make_api_item(item_id):
+    # An item of the catalog endpoint, with the fields of the API
+    return {
+        "id": item_id,
+        "title": f"Chemise en lin taille M {item_id}",
+        "price": {"amount": "12.5", "currency_code": "EUR"},
+        "is_visible": True,
+        "discount": None,
+        "brand_title": "Zara",
+        "path": f"/items/{item_id}-chemise-en-lin",
+        "user": {
+            "id": 98765,
+            "login": "seller",
+            "profile_url": "https://www.vinted.fr/member/98765",
+            "photo": None,
+            "business": False,
+        },
+        "conversion": None,
+        "url": f"https://www.vinted.fr/items/{item_id}-chemise-en-lin",
+        "promoted": False,
+        "photo": {
+            "id": item_id * 10,
+            "image_no": 1,
+            "width": 600,
+            "height": 800,
+            "dominant_color": "#C5C3BD",
+            "dominant_color_opaque": "#C5C3BD",
+            "url": f"https://images1.vinted.net/t/{item_id}/f800/photo.webp",
+            "is_main": True,
+            "thumbnails": [
+                {
+                    "type": size,
+                    "url": f"https://images1.vinted.net/t/{item_id}/{size}/photo.webp",
+                    "width": 310,
+                    "height": 430,
+                }
+                for size in ("thumb70x100", "thumb150x210", "thumb310x430")
+            ],
+            "high_resolution": {
+                "id": f"{item_id}_hr",
+                "timestamp": 1700000000 + item_id,
+                "orientation": None,
+            },
+            "is_suspicious": False,
+            "full_size_url": f"https://images1.vinted.net/t/{item_id}/full/photo.webp",
+            "is_hidden": False,
+        },
+        "favourite_count": 3,
+        "is_favourite": False,
+        "view_count": 0,
+        "service_fee": {"amount": "1.33", "currency_code": "EUR"},
+        "total_item_price": {"amount": "13.83", "currency_code": "EUR"},
+        "size_title": "M",
+        "content_source": "search",
+        "status": "Très bon état",
+        "search_tracking_params": {"score": 0.42, "matched_queries": []},
+    }
+
+
+def measure(parse, response, runs):
+    # Median time of a decoding in seconds
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(response, False)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def retained_bytes(parse, response):
+    # Memory held by the decoded page, as long as its items are kept
+    gc.collect()
+    tracemalloc.start()
+    items = parse(response, False)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return retained
+
+
+def object_size(item):
+    # The object itself, plus its attributes dict when it has one
+    size = sys.getsizeof(item)
+    if hasattr(item, "__dict__"):
+        size += sys.getsizeof(item.__dict__)
+    return size
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # pyVintedVN creates its requester when imported, it needs the database
+        db.DB_PATH = os.path.join(tmp, "vinted_notifications.db")
+        db.create_or_update_sqlite_db(os.path.join(ROOT, "initial_db.sql"))
+        from pyVintedVN.items import items as items_module
+
+        page = json.dumps(
+            {"items": [make_api_item(i + 1) for i in range(args.items)]}
+        ).encode()
+        response = SimpleNamespace(content=page, json=lambda: json.loads(page))
+        parse = items_module.Items._parse_response
+
+        decoders = {"json": json.loads}
+        original = getattr(items_module, "decode_json", None)
+        try:
+            import orjson
+
+            # Versions before orjson support always decode with response.json()
+            if original is not None:
+                decoders["orjson"] = orjson.loads
+        except ImportError:
+            print("orjson is not installed, only json is measured")
+
+        print(f"Page of {args.items} items, {len(page)} bytes")
+        print(f"{'decoder':<10}{'us/item':>10}{'KiB retained per page':>24}")
+        for name, decoder in decoders.items():
+            if original is not None:
+                items_module.decode_json = decoder
+            duration = measure(parse, response, args.runs)
+            retained = retained_bytes(parse, response)
+            print(
+                f"{name:<10}{duration / args.items * 1e6:>10.2f}"
+                f"{retained / 1024:>24.0f}"
+            )
+        if original is not None:
+            items_module.decode_json = original
+
+        item = parse(response, False)[0]
+        print(f"Item object alone: {object_size(item)} bytes")
+        db.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of the batches of items sent by the scrapers to the item extractor
+through items_queue, as Item objects and as compact records (Item.to_record).
+
+A batch of generated items is pickled and unpickled as the queue does, and the
+pickled size and the time of the round trip are reported, with the cost of
+building the records and of reading them back as ItemRecord.
+
+Usage:
+    python benchmarks/item_records.py
+    python benchmarks/item_records.py --items 960 --minimal
+"""
+
+import argparse
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+
+# The modules of the application live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+# The items of the API, shared with the decoding benchmark next to this script
+from item_decoding import make_api_item  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--items", type=int, default=96, help="items per batch (default: 96)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=500, help="runs of each operation (default: 500)"
+    )
+    parser.add_argument(
+        "--minimal",
+        action="store_true",
+        help="items with only the fields the application reads, instead of a full API item",
+    )
+    return parser.parse_args()
+
+
+def make_minimal_item(item_id):
+    # Only the raw fields read by Item
+    return {
+        "id": item_id,
+        "title": f"Item {item_id}",
+        "brand_title": "Brand",
+        "price": {"amount": "10.0", "currency_code": "EUR"},
+        "photo": {
+            "url": "https://images1.vinted.net/photo.webp",
+            "high_resolution": {"timestamp": 1700000000 + item_id},
+        },
+        "url": f"https://www.vinted.fr/items/{item_id}",
+        "user": {"id": 98765},
+        "size_title": "M",
+    }
+
+
+def measure(operation, runs):
+    # Median duration of the operation in microseconds
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1e6
+
+
+def round_trip(batch):
+    return pickle.loads(pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # pyVintedVN creates its requester when imported, it needs the database
+        db.DB_PATH = os.path.join(tmp, "vinted_notifications.db")
+        db.create_or_update_sqlite_db(os.path.join(ROOT, "initial_db.sql"))
+        from pyVintedVN.items.item import Item, ItemRecord
+
+        make_item = make_minimal_item if args.minimal else make_api_item
+        items = [Item(make_item(i + 1)) for i in range(args.items)]
+        records = [item.to_record() for item in items]
+        # What is put in items_queue, with the id of the query
+        item_batch, record_batch = (items, 1), (records, 1)
+
+        print(
+            f"Batch of {args.items} {'minimal' if args.minimal else 'API'} items, "
+            "pickle + unpickle"
+        )
+        for name, batch in (("Item objects", item_batch), ("records", record_batch)):
+            size = len(pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL))
+            duration = measure(lambda: round_trip(batch), args.runs)
+            print(f"  {name:<14}{size:>9} bytes{duration:>9.0f} us")
+        to_record = measure(lambda: [item.to_record() for item in items], args.runs)
+        make = measure(lambda: [ItemRecord._make(r) for r in records], args.runs)
+        print(f"  to_record in the scraper:      +{to_record:.0f} us")
+        print(f"  ItemRecord._make in extractor: +{make:.0f} us")
+        db.close_db_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Benchmark of the items lookups and of the pagination of the items page, before and
+after the migrations adding the items indexes.
+
+A database is created from initial_db.sql and filled with generated items, the
+lookups are timed, then the migrations are applied as on an upgraded install and
+the lookups are timed again.
+
+Usage:
+    python benchmarks/keyset_pagination.py
+    python benchmarks/keyset_pagination.py --rows 10000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# The modules of the application live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+# Timestamp of the oldest generated item
+BASE_TIMESTAMP = 1_600_000_000
+# Number of rows inserted per transaction while filling the database
+FILL_BATCH_SIZE = 100_000
+# Items per page, as on the items page of the web UI
+PAGE_SIZE = 50
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1_000_000,
+        help="number of items in the database (default: 1000000, try 10000000)",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=20, help="number of queries (default: 20)"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=200,
+        help="maximum number of runs of each lookup (default: 200)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=3.0,
+        help="seconds spent at most on each lookup, full scans stop early (default: 3)",
+    )
+    parser.add_argument(
+        "--db", help="database file to create, a temporary one by default"
+    )
+    return parser.parse_args()
+
+
+def migrate():
+    # Same loop as vinted_notifications.py: apply the migrations from the current version
+    migration_files = os.listdir(os.path.join(ROOT, "migrations"))
+    current_version = db.get_parameter("version")
+    while True:
+        migration_file = next(
+            (f for f in migration_files if f.startswith(current_version + "_")),
+            None,
+        )
+        if not migration_file:
+            break
+        db.create_or_update_sqlite_db(os.path.join(ROOT, "migrations", migration_file))
+        current_version = db.get_parameter("version")
+
+
+def fill(rows, queries):
+    # Item i is found by query i % queries + 1, one item per second
+    conn = db.get_db_connection()
+    conn.executemany(
+        "INSERT INTO queries (id, query, last_item, query_name) VALUES (?, ?, ?, ?)",
+        [
+            (
+                query_id,
+                f"https://www.vinted.fr/catalog?search_text=q{query_id}",
+                None,
+                None,
+            )
+            for query_id in range(1, queries + 1)
+        ],
+    )
+    for start in range(0, rows, FILL_BATCH_SIZE):
+        conn.executemany(
+            "INSERT INTO items (item, title, price, currency, timestamp, photo_url, query_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    i + 1,
+                    f"Item {i + 1}",
+                    10.0,
+                    "EUR",
+                    BASE_TIMESTAMP + i,
+                    "https://images.vinted.net/photo.jpg",
+                    i % queries + 1,
+                )
+                for i in range(start, min(rows, start + FILL_BATCH_SIZE))
+            ),
+        )
+        conn.commit()
+
+
+def measure(operation, runs, budget):
+    # Median duration of the operation in milliseconds, within the time budget
+    durations = []
+    deadline = time.perf_counter() + budget
+    while len(durations) < runs and (
+        len(durations) < 3 or time.perf_counter() < deadline
+    ):
+        start = time.perf_counter()
+        operation()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), len(durations)
+
+
+def run_lookups(args):
+    rows = args.rows
+    query_id = 1
+    query_url = f"https://www.vinted.fr/catalog?search_text=q{query_id}"
+    # The item half-way through the history of the query, where a deep page starts
+    middle = (rows // 2) // args.queries * args.queries
+    before = (BASE_TIMESTAMP + middle, middle + 1)
+    offset = (rows // args.queries) // 2
+    conn = db.get_db_connection()
+
+    def offset_page():
+        conn.execute(
+            "SELECT i.item, i.title, i.price, i.currency, i.timestamp, q.query, i.photo_url "
+            "FROM items i JOIN queries q ON i.query_id = q.id WHERE i.query_id=? "
+            "ORDER BY i.timestamp DESC, i.item DESC LIMIT ? OFFSET ?",
+            (query_id, PAGE_SIZE, offset),
+        ).fetchall()
+
+    lookups = {
+        "get_known_item_ids([id])": lambda: db.get_known_item_ids(
+            [random.randint(1, rows)]
+        ),
+        "get_items(query=...), first page": lambda: db.get_items(
+            PAGE_SIZE, query=query_url
+        ),
+        "get_items(query_id=..., before=...), middle page": lambda: db.get_items(
+            PAGE_SIZE, query_id=query_id, before=before
+        ),
+        "same middle page with OFFSET": offset_page,
+    }
+    results = {}
+    for name, operation in lookups.items():
+        results[name] = measure(operation, args.runs, args.budget)
+    return results
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = args.db or os.path.join(tmp, "vinted_notifications.db")
+        if os.path.exists(db.DB_PATH):
+            sys.exit(f"{db.DB_PATH} already exists")
+        db.create_or_update_sqlite_db(os.path.join(ROOT, "initial_db.sql"))
+
+        start = time.perf_counter()
+        fill(args.rows, args.queries)
+        print(f"Filled {args.rows} items in {time.perf_counter() - start:.1f} s")
+        before = run_lookups(args)
+
+        start = time.perf_counter()
+        migrate()
+        print(
+            f"Migrated to {db.get_parameter('version')} "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+        after = run_lookups(args)
+        db.close_db_connection()
+
+    print()
+    print(f"{'lookup (median ms, runs)':<52}{'before':>18}{'after':>18}")
+    for name in before:
+        cells = [f"{ms:.3f} ({runs})" for ms, runs in (before[name], after[name])]
+        print(f"{name:<52}{cells[0]:>18}{cells[1]:>18}")
+
+
+if __name__ == "__main__":
+    main()
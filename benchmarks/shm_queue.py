@@ -0,0 +1,163 @@
+"""
+Benchmark of SharedMemoryQueue against multiprocessing.Queue, with one producer
+and one consumer process as between the processes of vinted_notifications.py.
+
+For each transport and message, the throughput is measured with the producer
+putting messages as fast as it can, and the latency with messages put one at a
+time at a regular interval. The latency of the consumer loop used before the
+blocking gets, polling empty() and sleeping 0.1 s, is measured for reference.
+
+Usage:
+    python benchmarks/shm_queue.py
+    python benchmarks/shm_queue.py --messages 200000 --latency-messages 2000
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+# The modules of the application live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from shm_queue import SharedMemoryQueue  # noqa: E402
+
+# The queues are inherited by the child processes, as in vinted_notifications.py
+context = multiprocessing.get_context("fork")
+
+# A notification, as put in new_items_queue
+MESSAGE = (
+    "🆕 Title : Shirt\n💶 Price : 10.0 EUR\n🛍️ Brand : Brand",
+    "https://www.vinted.fr/items/1234567890",
+    "Open Vinted",
+    None,
+    None,
+)
+# A batch of item records, as put in items_queue (see Item.to_record)
+RECORD_BATCH = (
+    [
+        (
+            1234567890 + i,
+            1700000000 + i,
+            f"Item {i}",
+            "10.0",
+            "EUR",
+            "Brand",
+            "https://images.vinted.net/photo.jpg",
+            f"https://www.vinted.fr/items/{1234567890 + i}",
+            98765,
+        )
+        for i in range(20)
+    ],
+    1,
+)
+# Seconds between two messages when measuring the latency
+LATENCY_INTERVAL = 0.002
+# Pause of the old consumer loop (seconds)
+POLL_SLEEP = 0.1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=100_000,
+        help="messages put to measure the throughput (default: 100000)",
+    )
+    parser.add_argument(
+        "--latency-messages",
+        type=int,
+        default=1000,
+        help="messages put to measure the latency (default: 1000)",
+    )
+    parser.add_argument(
+        "--poll-messages",
+        type=int,
+        default=50,
+        help="messages put to measure the old polling loop (default: 50)",
+    )
+    return parser.parse_args()
+
+
+def produce(transport, payload, count, interval):
+    # Each message carries the time it was put at
+    for _ in range(count):
+        transport.put((time.perf_counter(), payload))
+        if interval:
+            time.sleep(interval)
+
+
+def consume(transport, count, poll, results):
+    latencies = []
+    first = None
+    while len(latencies) < count:
+        if poll:
+            if transport.empty():
+                time.sleep(POLL_SLEEP)
+                continue
+            sent, _ = transport.get()
+        else:
+            sent, _ = transport.get(timeout=10)
+        now = time.perf_counter()
+        first = first or now
+        latencies.append(now - sent)
+    results.put((time.perf_counter() - first, latencies))
+
+
+def run(make_transport, payload, count, interval=0, poll=False):
+    transport = make_transport()
+    results = context.Queue()
+    consumer = context.Process(target=consume, args=(transport, count, poll, results))
+    producer = context.Process(
+        target=produce, args=(transport, payload, count, interval)
+    )
+    consumer.start()
+    producer.start()
+    elapsed, latencies = results.get()
+    producer.join()
+    consumer.join()
+    if isinstance(transport, SharedMemoryQueue):
+        transport.close()
+    latencies.sort()
+    return (
+        count / elapsed if elapsed else float("inf"),
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+    )
+
+
+def main():
+    args = parse_args()
+    transports = {"mp.Queue": context.Queue, "shm": SharedMemoryQueue}
+    payloads = {"message (5-tuple)": MESSAGE, "20-item record batch": RECORD_BATCH}
+
+    print(
+        f"{'payload':<24}{'transport':<12}{'throughput':>14}{'median':>12}{'p99':>12}"
+    )
+    for payload_name, payload in payloads.items():
+        for transport_name, make_transport in transports.items():
+            throughput, _, _ = run(make_transport, payload, args.messages)
+            _, median, p99 = run(
+                make_transport, payload, args.latency_messages, LATENCY_INTERVAL
+            )
+            print(
+                f"{payload_name:<24}{transport_name:<12}{throughput / 1000:>12.1f}k/s"
+                f"{median:>10.0f}us{p99:>10.0f}us"
+            )
+
+    # Messages are spread over the pause of the loop, as they arrive in practice
+    _, median, p99 = run(
+        context.Queue, MESSAGE, args.poll_messages, POLL_SLEEP * 0.37, poll=True
+    )
+    print(
+        f"{'old empty()+sleep loop':<24}{'mp.Queue':<12}{'':>14}"
+        f"{median / 1000:>10.0f}ms{p99 / 1000:>10.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
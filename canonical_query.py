@@ -0,0 +1,128 @@
+import hashlib
+import json
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from pyVintedVN.items import Items
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# Parameters of a Vinted URL that don't change the search results
+IGNORED_PARAMETERS = ("time", "search_id", "disabled_personalization", "page")
+# API parameters that are set for each request instead of being precompiled
+REQUEST_PARAMETERS = ("page", "per_page", "time")
+
+
+def canonicalize_query(query):
+    """
+    Get the canonical form of a Vinted query URL.
+
+    1. Brand URLs (url/brand/id-name) are converted to the standard catalog format
+    2. The order flag is set to "newest_first"
+    3. Parameters that don't change the results (time, search_id...) are removed
+    4. Parameters and their values are sorted, so the same search always gives the same URL
+
+    Args:
+        query (str): The Vinted query URL
+
+    Returns:
+        str: The canonical query URL
+    """
+    # Check if the URL is a brand URL (format: url/brand/id-name)
+    parsed_url = urlparse(query)
+    path_parts = parsed_url.path.strip("/").split("/")
+
+    if len(path_parts) >= 2 and path_parts[0] == "brand":
+        # Extract the brand ID from the format "id-name"
+        brand_id = path_parts[1].split("-")[0]
+
+        # Create a new URL with the standard format
+        query = urlunparse(
+            (
+                parsed_url.scheme,
+                parsed_url.netloc,
+                "/catalog",
+                "",
+                urlencode({"brand_ids[]": [brand_id]}, doseq=True),
+                "",
+            )
+        )
+        logger.info(f"Converted brand URL to standard format: {query}")
+        parsed_url = urlparse(query)
+
+    query_params = parse_qs(parsed_url.query)
+
+    # Ensure the order flag is set to newest_first
+    query_params["order"] = ["newest_first"]
+    for parameter in IGNORED_PARAMETERS:
+        query_params.pop(parameter, None)
+
+    # Rebuild the query string with sorted parameters and values
+    new_query = urlencode(
+        [
+            (key, value)
+            for key in sorted(query_params)
+            for value in sorted(query_params[key])
+        ]
+    )
+    return urlunparse(
+        (
+            parsed_url.scheme,
+            parsed_url.netloc.lower(),
+            parsed_url.path,
+            parsed_url.params,
+            new_query,
+            parsed_url.fragment,
+        )
+    )
+
+
+def get_query_fingerprint(canonical_query):
+    """
+    Get a stable fingerprint of a canonical query URL.
+    Two URLs describing the same search have the same fingerprint.
+
+    Args:
+        canonical_query (str): The canonical query URL, see canonicalize_query
+
+    Returns:
+        str: The hex digest of the query
+    """
+    parsed_url = urlparse(canonical_query)
+    key = f"{parsed_url.netloc}{parsed_url.path.rstrip('/')}?{parsed_url.query}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def compile_api_params(canonical_query):
+    """
+    Get the Vinted API parameters of a query, without the per-request ones
+    (page, per_page, time), serialized as JSON so they can be stored.
+
+    Args:
+        canonical_query (str): The canonical query URL, see canonicalize_query
+
+    Returns:
+        str: The API parameters as a JSON object
+    """
+    params = Items().parse_url(canonical_query)
+    for parameter in REQUEST_PARAMETERS:
+        params.pop(parameter, None)
+    return json.dumps(params, sort_keys=True)
+
+
+def prepare_query(query):
+    """
+    Canonicalize a query URL and compute everything stored alongside it.
+
+    Args:
+        query (str): The Vinted query URL
+
+    Returns:
+        tuple: (canonical_query, fingerprint, api_params)
+    """
+    canonical_query = canonicalize_query(query)
+    return (
+        canonical_query,
+        get_query_fingerprint(canonical_query),
+        compile_api_params(canonical_query),
+    )
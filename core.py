@@ -1,23 +1,92 @@
+import concurrent.futures
 import db
+import itertools
+import json
+import math
+import rate_limiter
 import requests
-from pyVintedVN import Vinted, requester
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+import threading
+import time
+from pyVintedVN import Vinted, Requester, requester
+from pyVintedVN.items.item import ItemRecord
+from queue import Empty
+from urllib.parse import urlparse, parse_qs
+from canonical_query import prepare_query
+from item_index import MAX_SEEN_IDS, RECENT_IDS_PER_QUERY, RecentItems, SeenItemIndex
+from polling_scheduler import PollingScheduler
+from query_coalescing import MAX_ITEMS_PER_PAGE, QueryGroup, plan_queries
 from logger import get_logger
 
 # Get logger for this module
 logger = get_logger(__name__)
 
+# Number of items deleted per transaction by the retention job
+RETENTION_BATCH_SIZE = 1000
+# Number of free pages released per incremental vacuum step
+RETENTION_VACUUM_PAGES = 2000
+# Pause between two retention batches, so other writers can get the lock (seconds)
+RETENTION_BATCH_PAUSE = 0.1
+# Maximum time the item extractor waits for the rate limiter to look up a user's
+# country (seconds). Past it, the country is unknown instead of stalling the extractor.
+USER_COUNTRY_MAX_WAIT = 5
+# Seconds before the items whose country couldn't be looked up are processed again,
+# and the maximum number of them kept meanwhile
+USER_COUNTRY_RETRY_DELAY = 30
+DEFERRED_ITEMS_MAX = 1000
+
+# Whether prune_old_items checked the auto_vacuum mode of the database, see
+# convert_to_incremental_vacuum
+_AUTO_VACUUM_CHECKED = False
+
+# Index of the item ids already in the db, built on first use by the item extractor
+_SEEN_ITEMS = None
+
+# Thread pool scraping the queries when query_concurrency is greater than 1
+_QUERY_EXECUTOR = None
+_QUERY_EXECUTOR_WORKERS = 0
+# Per-thread state of the scraper threads
+_SCRAPER_THREAD = threading.local()
+
+# Adaptive polling scheduler of the scraper process, see process_due_items
+_POLLING_SCHEDULER = None
+# Queries known by the scheduler, and the most recent item timestamp seen for each
+_POLLING_QUERIES = {}
+_POLLING_WATERMARKS = {}
+_POLLING_LAST_SYNC = float("-inf")
+# Interval between two reloads of the queries by the scheduler (seconds)
+POLLING_SYNC_INTERVAL = 10
+
+# Rate limiter counters at the last log, see log_rate_limiter_counters
+_RATE_LIMITER_COUNTERS = {}
+
+# Smallest page fetched when a query found few new items last time
+MIN_PAGE_SIZE = 5
+# Number of threads fetching the catch-up pages of a query
+CATCHUP_PAGE_WORKERS = 4
+# Thread pool fetching the catch-up pages, see fetch_catchup_pages
+_PAGE_EXECUTOR = None
+# Number of new items found by each query at its last poll, to size its next page
+_NEW_ITEM_COUNTS = {}
+# Items recently sent to the extractor by each query, see get_recent_items
+_RECENT_ITEMS = {}
+# query_id -> {item id: ItemRecord} of the items waiting for a country lookup,
+# and when they are processed again, see retry_deferred_items
+_DEFERRED_ITEMS = {}
+_DEFERRED_ITEMS_RETRY_AT = 0.0
+# Fingerprint of the last first page of each query (or group of queries),
+# see Items.search_changes, and how often it saved processing a page
+_RESPONSE_FINGERPRINTS = {}
+_RESPONSE_COUNTERS = {"pages": 0, "unchanged": 0}
+_RESPONSE_COUNTERS_LOCK = threading.Lock()
+
 
 def process_query(query, name=None):
     """
     Process a Vinted query URL by:
-    1. Checking if the URL is a brand URL and converting it to standard format if needed
-    2. Parsing the URL and extracting query parameters
-    3. Ensuring the order flag is set to "newest_first"
-    4. Removing time and search_id parameters
-    5. Rebuilding the query string and URL
-    6. Checking if the query already exists in the database
-    7. Adding the query to the database if it doesn't exist
+    1. Computing its canonical form (see canonical_query.canonicalize_query)
+    2. Computing its fingerprint and its API parameters
+    3. Checking if the query already exists in the database, by fingerprint
+    4. Adding the query to the database if it doesn't exist
 
     Args:
         query (str): The Vinted query URL
@@ -28,58 +97,14 @@ def process_query(query, name=None):
             - message (str): Status message
             - is_new_query (bool): True if query was added, False if it already existed
     """
-    # Check if the URL is a brand URL (format: url/brand/id-name)
-    parsed_url = urlparse(query)
-    path_parts = parsed_url.path.strip("/").split("/")
-
-    if len(path_parts) >= 2 and path_parts[0] == "brand":
-        # Extract the brand ID from the format "id-name"
-        brand_id_with_name = path_parts[1]
-        brand_id = brand_id_with_name.split("-")[0]
-
-        # Create a new URL with the standard format
-        new_path = "/catalog"
-        new_query_params = {"brand_ids[]": [brand_id]}
-        new_query_string = urlencode(new_query_params, doseq=True)
-
-        # Rebuild the URL
-        query = urlunparse(
-            (parsed_url.scheme, parsed_url.netloc, new_path, "", new_query_string, "")
-        )
-        logger.info(f"Converted brand URL to standard format: {query}")
-
-        # Parse the URL and extract the query parameters
-        parsed_url = urlparse(query)
-
-    query_params = parse_qs(parsed_url.query)
-
-    # Ensure the order flag is set to newest_first
-    query_params["order"] = ["newest_first"]
-    # Remove time and search_id if provided
-    query_params.pop("time", None)
-    query_params.pop("search_id", None)
-    query_params.pop("disabled_personalization", None)
-    query_params.pop("page", None)
-
-    # Rebuild the query string and the entire URL
-    new_query = urlencode(query_params, doseq=True)
-    processed_query = urlunparse(
-        (
-            parsed_url.scheme,
-            parsed_url.netloc,
-            parsed_url.path,
-            parsed_url.params,
-            new_query,
-            parsed_url.fragment,
-        )
-    )
+    processed_query, fingerprint, api_params = prepare_query(query)
 
-    # Some queries are made with filters only, so we need to check if the search_text is present
-    if db.is_query_in_db(processed_query) is True:
+    # Queries with the same parameters in a different order have the same fingerprint
+    if db.get_query_id_by_fingerprint(fingerprint) is not None:
         return "Query already exists.", False
     else:
         # add the query to the db
-        db.add_query_to_db(processed_query, name)
+        db.add_query_to_db(processed_query, name, fingerprint, api_params)
         return "Query added.", True
 
 
@@ -154,38 +179,37 @@ def process_update_query(query_id, query, name):
             - message (str): Status message
             - success (bool): True if query was updated successfully
     """
-    # Parse the URL and extract the query parameters
-    parsed_url = urlparse(query)
-    query_params = parse_qs(parsed_url.query)
-
-    # Ensure the order flag is set to newest_first
-    query_params["order"] = ["newest_first"]
-    # Remove time and search_id if provided
-    query_params.pop("time", None)
-    query_params.pop("search_id", None)
-    query_params.pop("disabled_personalization", None)
-    query_params.pop("page", None)
-
-    # Rebuild the query string and the entire URL
-    new_query = urlencode(query_params, doseq=True)
-    processed_query = urlunparse(
-        (
-            parsed_url.scheme,
-            parsed_url.netloc,
-            parsed_url.path,
-            parsed_url.params,
-            new_query,
-            parsed_url.fragment,
-        )
-    )
+    processed_query, fingerprint, api_params = prepare_query(query)
+
+    existing_query_id = db.get_query_id_by_fingerprint(fingerprint)
+    if existing_query_id is not None and existing_query_id != query_id:
+        return "Query already exists.", False
 
     # Update the query in the database
-    if db.update_query_in_db(query_id, processed_query, name):
+    if db.update_query_in_db(query_id, processed_query, name, fingerprint, api_params):
         return "Query updated.", True
     else:
         return "Failed to update query.", False
 
 
+def update_query_fingerprints():
+    """
+    Compute the fingerprint and the API parameters of the queries that don't have them yet,
+    i.e. the ones added before they were introduced. Queries that turn out to be duplicates
+    are merged into the first one.
+    """
+    for query in db.get_queries():
+        if query[4] is not None:
+            continue
+        _, fingerprint, api_params = prepare_query(query[1])
+        existing_query_id = db.get_query_id_by_fingerprint(fingerprint)
+        if existing_query_id is not None and existing_query_id != query[0]:
+            logger.info(f"Merging duplicate query {query[1]}")
+            db.merge_queries(query[0], existing_query_id)
+        else:
+            db.set_query_fingerprint(query[0], fingerprint, api_params)
+
+
 def process_add_country(country):
     """
     Process the addition of a country to the allowlist.
@@ -245,33 +269,49 @@ def get_user_country(profile_id):
     Get the country code for a Vinted user.
 
     Makes an API request to retrieve the user's country code.
-    Handles rate limiting by trying an alternative endpoint.
+    Handles rate limiting by trying an alternative endpoint, which has its own
+    rate limit (see rate_limiter.get_endpoint_class).
 
     Args:
         profile_id (str): The Vinted user's profile ID
 
     Returns:
-        str: The user's country code (2-letter ISO code) or "XX" if it can't be determined
+        str: The user's country code (2-letter ISO code), "XX" if the user has none,
+            or None if both endpoints are rate limited and the lookup must be retried later
     """
     # Users are shared between all Vinted platforms, so we can use whatever locale we want
     url = f"https://www.vinted.fr/api/v2/users/{profile_id}?localize=false"
-    response = requester.get(url)
-    # That's a LOT of requests, so if we get a 429 we wait a bit before retrying once
-    if response.status_code == 429:
-        # In case of rate limit, we're switching the endpoint. This one is slower, but it doesn't RL as soon.
-        # We're limiting the items per page to 1 to grab as little data as possible
-        url = f"https://www.vinted.fr/api/v2/users/{profile_id}/items?page=1&per_page=1"
-        response = requester.get(url)
-        try:
-            user_country = response.json()["items"][0]["user"]["country_iso_code"]
-        except KeyError:
-            logger.warning(
-                "Couldn't get the country due to too many requests. Returning default value."
-            )
-            user_country = "XX"
-    else:
-        user_country = response.json()["user"]["country_iso_code"]
-    return user_country
+    try:
+        # Requests are paced by the rate limiter, and a 429 blocks the users endpoints
+        # for a while. The lookup gives up rather than wait for long.
+        response = requester.get(url, max_wait=USER_COUNTRY_MAX_WAIT)
+        if response.status_code != 429:
+            return response.json()["user"].get("country_iso_code") or "XX"
+    except requests.exceptions.HTTPError:
+        # The users endpoint is backing off, switch endpoints right away
+        pass
+    except KeyError:
+        return "XX"
+
+    # In case of rate limit, we're switching the endpoint. This one is slower, but it doesn't RL as soon.
+    # We're limiting the items per page to 1 to grab as little data as possible
+    url = f"https://www.vinted.fr/api/v2/users/{profile_id}/items?page=1&per_page=1"
+    try:
+        response = requester.get(url, max_wait=USER_COUNTRY_MAX_WAIT)
+        if response.status_code != 429:
+            items = response.json()["items"]
+            if not items:
+                return "XX"
+            return items[0]["user"].get("country_iso_code") or "XX"
+    except requests.exceptions.HTTPError:
+        pass
+    except KeyError:
+        return "XX"
+    logger.warning(
+        f"Couldn't get the country of user {profile_id} due to too many requests, "
+        "the item will be checked again later"
+    )
+    return None
 
 
 def process_items(queue):
@@ -279,6 +319,11 @@ def process_items(queue):
     Process all queries from the database, search for items, and put them in the queue.
     Uses the global items_queue by default, but can accept a custom queue for backward compatibility.
 
+    When the query_concurrency parameter is greater than 1, the queries are scraped
+    concurrently by a pool of threads, and the items of each query are put in the queue
+    as soon as it completes. The number of requests in flight to a single Vinted domain
+    is limited by the query_concurrency_per_domain parameter.
+
     Args:
         queue (Queue, optional): The queue to put the items in. Defaults to the global items_queue.
 
@@ -288,77 +333,754 @@ def process_items(queue):
 
     all_queries = db.get_queries()
 
-    # Initialize Vinted
-    vinted = Vinted()
-
     # Get the number of items per query from the database
     items_per_query = int(db.get_parameter("items_per_query"))
 
-    # for each keyword we parse data
-    for query in all_queries:
-        all_items = vinted.items.search(query[1], nbr_items=items_per_query)
-        # Filter to only include new items. This should reduce the amount of db calls.
-        data = [item for item in all_items if item.is_new_item()]
-        queue.put((data, query[0]))
+    start = time.monotonic()
+    counters = get_response_counters()
+    scrape_queries(all_queries, items_per_query, queue)
+
+    elapsed = time.monotonic() - start
+    new_counters = get_response_counters()
+    logger.info(
+        f"Scraped {len(all_queries)} queries in {elapsed:.1f} seconds, "
+        f"{new_counters['unchanged'] - counters['unchanged']}/"
+        f"{new_counters['pages'] - counters['pages']} pages unchanged"
+    )
+    log_rate_limiter_counters()
+    if elapsed > int(db.get_parameter("query_refresh_delay")):
+        logger.warning(
+            "Scraping all the queries took longer than the query refresh delay, "
+            "consider increasing query_concurrency"
+        )
+
+
+def log_rate_limiter_counters():
+    """
+    Log the rate limiter counters of the scraper since the last call, if it had to slow down.
+    """
+    global _RATE_LIMITER_COUNTERS
+    counters = rate_limiter.get_counters()
+    delta = {
+        key: value - _RATE_LIMITER_COUNTERS.get(key, 0)
+        for key, value in counters.items()
+    }
+    _RATE_LIMITER_COUNTERS = counters
+    if delta["waits"] or delta["rate_limited"]:
+        logger.info(
+            f"Rate limiter: {delta['waits']}/{delta['requests']} requests waited "
+            f"({delta['wait_seconds']:.1f} seconds), {delta['rate_limited']} rate limited"
+        )
+
+
+def scrape_queries(queries, items_per_query, queue):
+    """
+    Scrape a list of queries, one after the other or concurrently depending on
+    the query_concurrency parameter. A failing query is logged and doesn't prevent
+    the others from being scraped.
+
+    When the query_coalescing parameter is enabled, queries that only differ by their
+    brands, sizes or colors are sent as a single request, see query_coalescing.
+
+    Args:
+        queries (list): The queries, as returned by db.get_queries
+        items_per_query (int): The number of items to fetch per query
+        queue (Queue): The queue to put the items in
+
+    Returns:
+        dict: query_id -> the items found, or None if the query failed
+    """
+    if db.get_parameter("query_coalescing") == "True":
+        groups = plan_queries(queries)
+    else:
+        groups = [QueryGroup([query]) for query in queries]
+
+    results = {}
+    concurrency = int(db.get_parameter("query_concurrency") or 1)
+    if concurrency <= 1:
+        # Initialize Vinted
+        vinted = Vinted()
+
+        # for each keyword we parse data
+        for group in groups:
+            try:
+                results.update(scrape_group(vinted, group, items_per_query, queue))
+            except Exception as e:
+                _log_group_error(group, e)
+                results.update((query[0], None) for query in group.queries)
+        return results
+
+    per_domain = int(db.get_parameter("query_concurrency_per_domain") or 0)
+    domain_slots = {}
+    groups_by_domain = {}
+    for group in groups:
+        domain = urlparse(group.queries[0][1]).netloc
+        groups_by_domain.setdefault(domain, []).append(group)
+        if per_domain > 0 and domain not in domain_slots:
+            domain_slots[domain] = threading.BoundedSemaphore(per_domain)
+
+    # Interleave the domains, so the workers don't all wait on the same one
+    ordered_groups = [
+        group
+        for domain_groups in itertools.zip_longest(*groups_by_domain.values())
+        for group in domain_groups
+        if group is not None
+    ]
+
+    executor = get_query_executor(concurrency)
+    futures = {
+        executor.submit(
+            _scrape_group_concurrently,
+            group,
+            items_per_query,
+            queue,
+            domain_slots.get(urlparse(group.queries[0][1]).netloc),
+        ): group
+        for group in ordered_groups
+    }
+    for future in concurrent.futures.as_completed(futures):
+        group = futures[future]
+        try:
+            results.update(future.result())
+        except Exception as e:
+            # One failing query must not prevent the others from being scraped
+            _log_group_error(group, e)
+            results.update((query[0], None) for query in group.queries)
+    return results
+
+
+def _log_group_error(group, error):
+    for query in group.queries:
+        logger.error(f"Error scraping query {query[1]}: {error}", exc_info=True)
+
+
+def scrape_group(vinted, group, items_per_query, queue):
+    """
+    Search the items of a group of queries with a single request, and put the new
+    ones of each query in the queue.
+
+    If the items returned lack the fields needed to route them, the queries of the
+    group are scraped one by one instead.
+
+    As in scrape_query, the group catches up the pages missed since its oldest
+    watermark, so none of its queries loses items, and its page size follows the
+    number of new items its queries found last time.
+
+    Args:
+        vinted (Vinted): The Vinted instance used for the search
+        group (QueryGroup): The queries, see query_coalescing.plan_queries
+        items_per_query (int): The number of items to fetch per query
+        queue (Queue): The queue to put the items in
+
+    Returns:
+        dict: query_id -> all the items returned by Vinted for the query. Empty if the
+            page is the same as at the last poll.
+    """
+    if group.params is None:
+        query = group.queries[0]
+        return {query[0]: scrape_query(vinted, query, items_per_query, queue)}
+
+    # The page is shared by the queries, so it gets bigger with the group
+    nbr_items = min(MAX_ITEMS_PER_PAGE, items_per_query * len(group.queries))
+    watermarks = [query[2] for query in group.queries if query[2] is not None]
+    max_pages = int(db.get_parameter("catchup_max_pages") or 1)
+    catch_up = bool(watermarks) and max_pages > 1
+    if catch_up:
+        new_items = sum(
+            _NEW_ITEM_COUNTS.get(query[0], items_per_query) for query in group.queries
+        )
+        nbr_items = min(nbr_items, max(MIN_PAGE_SIZE, 2 * new_items))
+    key = tuple(query[0] for query in group.queries)
+    all_items, fingerprint = vinted.items.search_changes(
+        group.queries[0][1],
+        _RESPONSE_FINGERPRINTS.get(key),
+        nbr_items=nbr_items,
+        params=group.params,
+    )
+    if all_items is None:
+        # Same page as last time, its items were already put in the queue
+        _record_response_fingerprint(key, fingerprint, unchanged=True)
+        for query in group.queries:
+            _NEW_ITEM_COUNTS[query[0]] = 0
+        return {query[0]: [] for query in group.queries}
+
+    if catch_up:
+        all_items += fetch_catchup_pages(
+            group.queries[0],
+            group.params,
+            nbr_items,
+            all_items,
+            max_pages,
+            watermark=min(watermarks),
+        )
+    routed = group.route(all_items)
+    if routed is None:
+        return {
+            query[0]: scrape_query(vinted, query, items_per_query, queue)
+            for query in group.queries
+        }
+
+    for query in group.queries:
+        recent_items = get_recent_items(query)
+        if catch_up and query[2] is not None:
+            data = recent_items.select(routed[query[0]])
+            _NEW_ITEM_COUNTS[query[0]] = len(data)
+        else:
+            # Filter to only include new items. This should reduce the amount of db calls.
+            data = recent_items.select(
+                [item for item in routed[query[0]] if item.is_new_item()]
+            )
+        queue.put(([item.to_record() for item in data], query[0]))
         logger.info(f"Scraped {len(data)} items for query: {query[1]}")
+    _record_response_fingerprint(key, fingerprint, unchanged=False)
+    logger.debug(f"Scraped {len(group.queries)} queries with a single request")
+    return routed
+
 
+def process_due_items(queue):
+    """
+    Scrape the queries that are due according to the adaptive polling scheduler,
+    and schedule their next poll from the number of new items they found.
+    Called every second by the scraper process when adaptive_polling is enabled.
 
-def clear_item_queue(items_queue, new_items_queue):
+    Args:
+        queue (Queue): The queue to put the items in
+    """
+    global _POLLING_QUERIES, _POLLING_LAST_SYNC
+
+    scheduler = get_polling_scheduler()
+    if time.monotonic() - _POLLING_LAST_SYNC >= POLLING_SYNC_INTERVAL:
+        # Pick up the new, updated and removed queries, and the budget changes
+        _POLLING_QUERIES = {query[0]: query for query in db.get_queries()}
+        for query_id, query in _POLLING_QUERIES.items():
+            _POLLING_WATERMARKS.setdefault(query_id, query[2] or 0)
+        scheduler.requests_per_minute = float(
+            db.get_parameter("polling_requests_per_minute")
+        )
+        scheduler.sync(db.get_query_polling())
+        _POLLING_LAST_SYNC = time.monotonic()
+        log_rate_limiter_counters()
+
+    due_queries = [
+        _POLLING_QUERIES[query_id]
+        for query_id in scheduler.pop_due()
+        if query_id in _POLLING_QUERIES
+    ]
+    if not due_queries:
+        return
+
+    items_per_query = int(db.get_parameter("items_per_query"))
+    sent_requests = rate_limiter.get_counters()["requests"]
+    results = scrape_queries(due_queries, items_per_query, queue)
+    # The budget was charged one request per query, charge the catch-up pages and
+    # retries as well, and give back what coalesced queries saved
+    scheduler.charge(
+        rate_limiter.get_counters()["requests"] - sent_requests - len(due_queries)
+    )
+
+    states = []
+    for query_id, items in results.items():
+        if items is None:
+            # A failed scrape says nothing about the arrival rate, retry it later
+            scheduler.observe(query_id, None)
+            continue
+        # Items more recent than the newest one seen so far are new arrivals
+        watermark = _POLLING_WATERMARKS.get(query_id, 0)
+        timestamps = [item.raw_timestamp for item in items]
+        new_items = sum(1 for timestamp in timestamps if timestamp > watermark)
+        _POLLING_WATERMARKS[query_id] = max([watermark, *timestamps])
+
+        interval = scheduler.observe(query_id, new_items)
+        if interval is not None:
+            states.append((query_id, *scheduler.get_state(query_id)))
+            logger.debug(
+                f"Query {query_id}: {new_items} new items, next poll in {interval:.0f} seconds"
+            )
+    db.update_query_polling(states)
+
+
+def get_polling_scheduler():
+    """
+    Get the adaptive polling scheduler of the scraper process, creating it on first use.
+
+    Returns:
+        PollingScheduler: The scheduler
+    """
+    global _POLLING_SCHEDULER
+    if _POLLING_SCHEDULER is None:
+        _POLLING_SCHEDULER = PollingScheduler(
+            requests_per_minute=float(db.get_parameter("polling_requests_per_minute")),
+            default_interval=int(db.get_parameter("query_refresh_delay")),
+        )
+    return _POLLING_SCHEDULER
+
+
+def scrape_query(vinted, query, items_per_query, queue):
+    """
+    Search the items of a query and put the new ones in the queue.
+
+    When the catchup_max_pages parameter is greater than 1 and the query has a watermark,
+    the items newer than the watermark are the new ones, and further pages are fetched
+    while the last one is still newer than the watermark (see fetch_catchup_pages), so
+    nothing is lost after a downtime or a burst. The page size then follows the number of
+    new items found last time, since any shortfall is caught up.
+
+    Args:
+        vinted (Vinted): The Vinted instance used for the search
+        query (tuple): The query, as returned by db.get_queries
+        items_per_query (int): The number of items to fetch
+        queue (Queue): The queue to put the items in
+
+    Returns:
+        list: All the items returned by Vinted, including the old ones. Empty if the
+            page is the same as at the last poll, see Items.search_changes.
+    """
+    # The API parameters are computed once, when the query is added
+    params = json.loads(query[4]) if query[4] else None
+    watermark = query[2]
+    max_pages = int(db.get_parameter("catchup_max_pages") or 1)
+    catch_up = watermark is not None and max_pages > 1
+    if catch_up:
+        # Fetch about twice the new items of the last poll, the catch-up covers the rest
+        page_size = min(
+            items_per_query,
+            max(MIN_PAGE_SIZE, 2 * _NEW_ITEM_COUNTS.get(query[0], items_per_query)),
+        )
+    else:
+        page_size = items_per_query
+
+    all_items, fingerprint = vinted.items.search_changes(
+        query[1],
+        _RESPONSE_FINGERPRINTS.get(query[0]),
+        nbr_items=page_size,
+        params=params,
+    )
+    if all_items is None:
+        # Same page as last time, its items were already put in the queue
+        _record_response_fingerprint(query[0], fingerprint, unchanged=True)
+        _NEW_ITEM_COUNTS[query[0]] = 0
+        logger.debug(f"Unchanged page for query: {query[1]}")
+        return []
+
+    # Only the items never sent before cross to the extractor, see get_recent_items
+    recent_items = get_recent_items(query)
+    if catch_up:
+        all_items += fetch_catchup_pages(query, params, page_size, all_items, max_pages)
+        data = recent_items.select(all_items)
+        _NEW_ITEM_COUNTS[query[0]] = len(data)
+    else:
+        # Filter to only include new items. This should reduce the amount of db calls.
+        data = recent_items.select([item for item in all_items if item.is_new_item()])
+    # Only the fields the extractor needs are sent to it, see Item.to_record
+    queue.put(([item.to_record() for item in data], query[0]))
+    _record_response_fingerprint(query[0], fingerprint, unchanged=False)
+    logger.info(f"Scraped {len(data)} items for query: {query[1]}")
+    return all_items
+
+
+def get_recent_items(query):
+    """
+    Get the items recently sent to the extractor by a query, so the scraper only sends
+    the new ones. They are loaded from the database on first use, from the watermark
+    of the query and its last stored items, so a restart doesn't send them again.
+
+    Args:
+        query (tuple): The query, as returned by db.get_queries
+
+    Returns:
+        RecentItems: The recent items of the query
+    """
+    recent_items = _RECENT_ITEMS.get(query[0])
+    if recent_items is None:
+        recent_items = _RECENT_ITEMS.setdefault(
+            query[0],
+            RecentItems(
+                query[2], db.get_recent_item_ids(query[0], RECENT_IDS_PER_QUERY)
+            ),
+        )
+    return recent_items
+
+
+def _record_response_fingerprint(key, fingerprint, unchanged):
+    # The fingerprint is only kept once the items of the page were queued
+    _RESPONSE_FINGERPRINTS[key] = fingerprint
+    with _RESPONSE_COUNTERS_LOCK:
+        _RESPONSE_COUNTERS["pages"] += 1
+        if unchanged:
+            _RESPONSE_COUNTERS["unchanged"] += 1
+
+
+def get_response_counters():
+    """
+    Get the number of first pages fetched by the scraper process, and how many of them
+    were identical to the previous poll of their query and skipped.
+
+    Returns:
+        dict: pages and unchanged
+    """
+    with _RESPONSE_COUNTERS_LOCK:
+        return dict(_RESPONSE_COUNTERS)
+
+
+def fetch_catchup_pages(
+    query, params, page_size, first_page, max_pages, watermark=None
+):
+    """
+    Fetch the pages following the first one until they reach the watermark of the query,
+    i.e. items that were already processed, or until max_pages pages were fetched.
+
+    The number of missing pages is estimated from the time covered by the pages already
+    fetched, and they are fetched concurrently.
+
+    Args:
+        query (tuple): The query, as returned by db.get_queries
+        params (dict): The API parameters of the query
+        page_size (int): The number of items per page
+        first_page (list): The items of the first page
+        max_pages (int): The maximum number of pages, including the first one
+        watermark (int, optional): The timestamp to catch up to. Defaults to None,
+            the watermark of the query.
+
+    Returns:
+        list: The items of the following pages, without the ones already on a previous page
+    """
+    if watermark is None:
+        watermark = query[2]
+    items = list(first_page)
+    fetched = 1
+    last_page = first_page
+    while (
+        fetched < max_pages
+        and len(last_page) >= page_size
+        and last_page[-1].raw_timestamp > watermark
+    ):
+        # Time covered by a page so far, and time left until the watermark
+        newest, oldest = items[0].raw_timestamp, items[-1].raw_timestamp
+        time_per_page = max(1, newest - oldest) / fetched
+        count = min(
+            max_pages - fetched, max(1, math.ceil((oldest - watermark) / time_per_page))
+        )
+        pages = list(
+            get_page_executor().map(
+                lambda page: _get_thread_vinted().items.search(
+                    query[1], nbr_items=page_size, page=page, params=params
+                ),
+                range(fetched + 1, fetched + count + 1),
+            )
+        )
+        fetched += count
+        for page in pages:
+            items += page
+            last_page = page
+            if len(page) < page_size or page[-1].raw_timestamp <= watermark:
+                break
+
+    if fetched > 1:
+        logger.info(f"Caught up {fetched} pages for query: {query[1]}")
+
+    # New items shift the listing between two requests, so a page may repeat items
+    seen = {item.id for item in first_page}
+    following = []
+    for item in items[len(first_page) :]:
+        if item.id not in seen:
+            seen.add(item.id)
+            following.append(item)
+    return following
+
+
+def get_page_executor():
+    """
+    Get the thread pool fetching the catch-up pages, created on first use.
+
+    Returns:
+        ThreadPoolExecutor: The thread pool
+    """
+    global _PAGE_EXECUTOR
+    if _PAGE_EXECUTOR is None:
+        _PAGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=CATCHUP_PAGE_WORKERS, thread_name_prefix="catchup"
+        )
+    return _PAGE_EXECUTOR
+
+
+def _get_thread_vinted():
+    # Each thread has its own requester, since a requester is set up for one locale at a time.
+    # Their sessions and connections are shared, see pyVintedVN.requester.SessionPool
+    vinted = getattr(_SCRAPER_THREAD, "vinted", None)
+    if vinted is None:
+        vinted = _SCRAPER_THREAD.vinted = Vinted(Requester())
+    return vinted
+
+
+def get_query_executor(max_workers):
+    """
+    Get the thread pool scraping the queries. It is kept between two cycles,
+    and recreated when the query_concurrency parameter changes.
+
+    Args:
+        max_workers (int): The number of threads of the pool
+
+    Returns:
+        ThreadPoolExecutor: The thread pool
+    """
+    global _QUERY_EXECUTOR, _QUERY_EXECUTOR_WORKERS
+    if _QUERY_EXECUTOR is None or _QUERY_EXECUTOR_WORKERS != max_workers:
+        if _QUERY_EXECUTOR is not None:
+            _QUERY_EXECUTOR.shutdown(wait=False)
+        _QUERY_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="scraper"
+        )
+        _QUERY_EXECUTOR_WORKERS = max_workers
+    return _QUERY_EXECUTOR
+
+
+def _scrape_group_concurrently(group, items_per_query, queue, domain_slot):
+    vinted = _get_thread_vinted()
+    if domain_slot is None:
+        return scrape_group(vinted, group, items_per_query, queue)
+    with domain_slot:
+        return scrape_group(vinted, group, items_per_query, queue)
+
+
+def get_seen_items():
+    """
+    Get the index of the item ids already in the database.
+    The index is built on first call from the highest ids of the items table.
+
+    Returns:
+        SeenItemIndex: The index of the seen items
+    """
+    global _SEEN_ITEMS
+    if _SEEN_ITEMS is None:
+        _SEEN_ITEMS = SeenItemIndex(db.iter_item_ids(MAX_SEEN_IDS))
+        logger.info(f"Loaded {_SEEN_ITEMS.count} known items in the seen item index")
+    return _SEEN_ITEMS
+
+
+def clear_item_queue(items_queue, new_items_queue, timeout=None):
     """
     Process items from the items_queue.
     This function is scheduled to run frequently.
+
+    Items whose seller country couldn't be looked up are kept aside and processed
+    again once USER_COUNTRY_RETRY_DELAY has passed, see process_item_batch.
+
+    Args:
+        items_queue (Queue): The queue of the scraped items.
+        new_items_queue (Queue): The queue of the notifications to send.
+        timeout (float, optional): Seconds to wait for a batch of items.
+            Defaults to None, returning right away if the queue is empty.
+    """
+    if timeout is not None or not items_queue.empty():
+        try:
+            records, query_id = items_queue.get(timeout=timeout)
+        except Empty:
+            records = None
+        if records:
+            process_item_batch(
+                [ItemRecord._make(record) for record in records],
+                query_id,
+                new_items_queue,
+            )
+    retry_deferred_items(new_items_queue)
+
+
+def retry_deferred_items(new_items_queue):
+    """
+    Process again the items whose seller country couldn't be looked up, once
+    USER_COUNTRY_RETRY_DELAY has passed since they were put aside.
+
+    Args:
+        new_items_queue (Queue): The queue of the notifications to send.
+    """
+    if not _DEFERRED_ITEMS or time.monotonic() < _DEFERRED_ITEMS_RETRY_AT:
+        return
+    deferred = dict(_DEFERRED_ITEMS)
+    _DEFERRED_ITEMS.clear()
+    for query_id, items in deferred.items():
+        # They are older than the watermark by now, which they held back
+        process_item_batch(
+            list(items.values()), query_id, new_items_queue, check_watermark=False
+        )
+
+
+def process_item_batch(data, query_id, new_items_queue, check_watermark=True):
+    """
+    Notify the new items of a batch found by a query, and add them to the database.
+
+    When the allowlist is set and the country of a seller can't be looked up because
+    Vinted is rate limiting us, the item is neither notified nor dropped: it is kept
+    aside for retry_deferred_items, and the watermark of the query isn't advanced past it.
+
+    Args:
+        data (list): The items, as ItemRecord, newest first.
+        query_id (int): The id of the query that found them.
+        new_items_queue (Queue): The queue of the notifications to send.
+        check_watermark (bool, optional): Whether to skip the items older than the
+            watermark of the query. Defaults to True.
     """
-    if not items_queue.empty():
-        data, query_id = items_queue.get()
-        banwords_str = db.get_parameter("banwords")
-        for item in reversed(data):
-
-            # If already in db, pass
-            last_query_timestamp = db.get_last_timestamp(query_id)
-            if (
-                last_query_timestamp is not None
-                and last_query_timestamp >= item.raw_timestamp
-            ):
-                pass
-            # In case of multiple queries, we need to check if the item is already in the db
-            elif db.is_item_in_db_by_id(item.id) is True:
-                # We update the timestamp
-                db.update_last_timestamp(query_id, item.raw_timestamp)
-                pass
-            # If there's an allowlist and
-            # If the user's country is not in the allowlist, we just update the timestamp
-            elif db.get_allowlist() != 0 and (
-                get_user_country(item.raw_data["user"]["id"])
-            ) not in (db.get_allowlist() + ["XX"]):
-                db.update_last_timestamp(query_id, item.raw_timestamp)
-                pass
-            # Check if the item title contains any banwords
-            elif banwords_str and contains_banwords(item.title, banwords_str):
-                # If it contains banwords, just update the timestamp and skip
-                db.update_last_timestamp(query_id, item.raw_timestamp)
-                pass
-            else:
-                # We create the message
-                message_template = db.get_parameter("message_template")
-                content = message_template.format(
-                    title=item.title,
-                    price=str(item.price) + " " + item.currency,
-                    brand=item.brand_title,
-                    image=None if item.photo is None else item.photo,
-                )
-                # add the item to the queue
-                new_items_queue.put((content, item.url, "Open Vinted", None, None))
-                # new_items_queue.put((content, item.url, "Open Vinted", item.buy_url, "Open buy page"))
-                # Add the item to the db
-                db.add_item_to_db(
-                    id=item.id,
-                    timestamp=item.raw_timestamp,
-                    price=item.price,
-                    title=item.title,
-                    photo_url=item.photo,
-                    query_id=query_id,
-                    currency=item.currency,
-                )
+    banwords_str = db.get_parameter("banwords")
+
+    # Items older than the watermark of the query were already processed.
+    # The ones at the watermark may not all have been, the known ids sort them out.
+    last_query_timestamp = db.get_last_timestamp(query_id) if check_watermark else None
+    candidates = [
+        item
+        for item in reversed(data)
+        if last_query_timestamp is None or last_query_timestamp <= item.raw_timestamp
+    ]
+    if not candidates:
+        return
+
+    # In case of multiple queries, the item may already be in the db.
+    # Only the items the index reports as probably seen are checked in the db.
+    seen_items = get_seen_items()
+    known_ids = db.get_known_item_ids(
+        [item.id for item in candidates if seen_items.might_contain(item.id)]
+    )
+    # Items whose seller has no country ("XX") are always allowed
+    allowlist = db.get_allowlist_set()
+    allowed_countries = allowlist | {"XX"}
+    new_items = []
+    deferred = []
+    for item in candidates:
+        if item.id in known_ids:
+            continue
+        # If there's an allowlist and
+        # If the user's country is not in the allowlist, we skip the item
+        if allowlist:
+            country = get_user_country(item.user_id)
+            if country is None:
+                deferred.append(item)
+                continue
+            if country not in allowed_countries:
+                continue
+        # Check if the item title contains any banwords
+        if banwords_str and contains_banwords(item.title, banwords_str):
+            continue
+        # We create the message
+        message_template = db.get_parameter("message_template")
+        content = message_template.format(
+            title=item.title,
+            price=str(item.price) + " " + item.currency,
+            brand=item.brand_title,
+            image=None if item.photo is None else item.photo,
+        )
+        # add the item to the queue
+        new_items_queue.put((content, item.url, "Open Vinted", None, None))
+        # new_items_queue.put((content, item.url, "Open Vinted", item.buy_url, "Open buy page"))
+        known_ids.add(item.id)
+        new_items.append(
+            (
+                item.id,
+                item.title,
+                item.price,
+                item.currency,
+                item.raw_timestamp,
+                item.photo,
+            )
+        )
+
+    # Add the new items to the db and advance the watermark once for the whole batch,
+    # but not past the items put aside, so the ones at their timestamp stay eligible
+    last_timestamp = max(item.raw_timestamp for item in candidates)
+    if deferred:
+        last_timestamp = min(
+            last_timestamp, min(item.raw_timestamp for item in deferred)
+        )
+        _defer_items(query_id, deferred)
+    db.add_items_bulk(new_items, query_id, last_timestamp=last_timestamp)
+    seen_items.update(item[0] for item in new_items)
+
+
+def _defer_items(query_id, items):
+    # Keep items aside until the country lookups can be retried, the oldest are
+    # dropped past DEFERRED_ITEMS_MAX
+    global _DEFERRED_ITEMS_RETRY_AT
+    query_items = _DEFERRED_ITEMS.setdefault(query_id, {})
+    for item in items:
+        query_items[item.id] = item
+    total = sum(len(query_items) for query_items in _DEFERRED_ITEMS.values())
+    while total > DEFERRED_ITEMS_MAX:
+        oldest_query, oldest_id = min(
+            (item.raw_timestamp, query_id, item_id)
+            for query_id, query_items in _DEFERRED_ITEMS.items()
+            for item_id, item in query_items.items()
+        )[1:]
+        del _DEFERRED_ITEMS[oldest_query][oldest_id]
+        total -= 1
+        logger.warning(
+            f"Too many items waiting for a country lookup, dropped {oldest_id}"
+        )
+    _DEFERRED_ITEMS_RETRY_AT = time.monotonic() + USER_COUNTRY_RETRY_DELAY
+
+
+def prune_old_items():
+    """
+    Remove the items older than the configured retention and shrink the database file.
+    Items are deleted in small batches so the other processes are never blocked for long.
+
+    Returns:
+        tuple: (deleted_items, reclaimed_bytes)
+    """
+    global _AUTO_VACUUM_CHECKED
+    retention_days = int(db.get_parameter("item_retention_days") or 0)
+    if retention_days <= 0:
+        return 0, 0
+    if not _AUTO_VACUUM_CHECKED:
+        _AUTO_VACUUM_CHECKED = True
+        convert_to_incremental_vacuum()
+
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    deleted_items = 0
+    while True:
+        deleted = db.delete_items_older_than(cutoff, RETENTION_BATCH_SIZE)
+        deleted_items += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+    # Release the freed pages a chunk at a time, like the deletes
+    reclaimed_bytes = 0
+    while True:
+        reclaimed = db.incremental_vacuum(RETENTION_VACUUM_PAGES)
+        reclaimed_bytes += reclaimed
+        if not reclaimed:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE)
+    if deleted_items or reclaimed_bytes:
+        logger.info(
+            f"Retention: removed {deleted_items} items older than {retention_days} days, "
+            f"reclaimed {reclaimed_bytes} bytes"
+        )
+    return deleted_items, reclaimed_bytes
+
+
+def convert_to_incremental_vacuum():
+    """
+    Convert a database created before auto_vacuum=INCREMENTAL was the default, so the
+    retention can shrink its file. The conversion rewrites the whole file once, so it is
+    only run when the retention is turned on. If it fails, the items are still pruned
+    and the conversion is tried again at the next start.
+
+    Returns:
+        bool: True if the database uses auto_vacuum=INCREMENTAL
+    """
+    if db.get_auto_vacuum() == 2:
+        return True
+    logger.info(
+        "Retention: converting the database to auto_vacuum=INCREMENTAL, "
+        "this one-time VACUUM may take a while"
+    )
+    start = time.monotonic()
+    if not db.enable_incremental_vacuum():
+        logger.warning(
+            "Retention: couldn't convert the database, old items are removed "
+            "but the file won't shrink"
+        )
+        return False
+    logger.info(f"Retention: database converted in {time.monotonic() - start:.1f} s")
+    return True
 
 
 def contains_banwords(title, banwords_str):
@@ -1,53 +1,296 @@
+import os
+import queue
 import sqlite3
-from traceback import print_exc
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError, current_process
+from multiprocessing.connection import Client, Listener, wait
+from traceback import format_exc, print_exc
 
 DB_PATH = "./data/vinted_notifications.db"
 
+# How long a connection waits on a locked database before raising (milliseconds)
+BUSY_TIMEOUT_MS = 5000
+# Number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Seconds during which the cached parameters are used without checking the database.
+# Parameters are read in hot loops, so the whole table is cached per process and
+# only reloaded when the version counter maintained by triggers has changed.
+PARAMETERS_CACHE_TTL = 1
+
+# (checked_at, version, parameters) of the parameter cache
+_parameters_cache = (0.0, None, None)
+# (checked_at, version, countries) of the allowlist cache, refreshed the same way
+_allowlist_cache = (0.0, None, None)
+
+# Maximum number of writes committed in one transaction by the writer process
+WRITER_MAX_BATCH = 256
+# Seconds a process waits for the writer process to commit one of its writes
+WRITER_REPLY_TIMEOUT = 30
+
+# Seconds the writer process waits for writes before accepting new connections
+WRITER_ACCEPT_INTERVAL = 0.1
+
+# Address of the writer process, None when each process writes directly
+_writer_address = None
+# [connection, sequence] of this process to the writer process
+_writer_channel = None
+_writer_channel_lock = threading.Lock()
+
+# One connection per thread. The pid is stored alongside it so a connection
+# inherited through fork() is never reused by the child process.
+_local = threading.local()
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    # WAL lets readers run alongside the single writer, and NORMAL sync is safe with WAL
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
+def get_db_connection():
+    """
+    Get the long-lived connection of the current process and thread.
+
+    The connection is opened on first use and then reused by every function of
+    this module, so callers must not close it.
+
+    Returns:
+        sqlite3.Connection: The connection to the database
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close_db_connection():
+    """
+    Close the connection of the current thread, if any.
+    The next database call will open a new one.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
 def create_or_update_sqlite_db(db_path):
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
         # Using the sql script
         with open(db_path, "r", encoding="utf-8") as sql_file:
             sql_script = sql_file.read()
-            cursor.executescript(sql_script)
+            conn.executescript(sql_script)
 
         conn.commit()
     except Exception:
+        conn.rollback()
         print_exc()
     finally:
-        if conn:
-            conn.close()
+        # A migration may have changed the parameters
+        invalidate_parameters_cache()
+
 
+def _run_write(operation, *args, default=None):
+    """
+    Run a write operation in its own transaction, or in the writer process if enabled.
 
-def is_item_in_db_by_id(id):
-    conn = None
+    Args:
+        operation (callable): A module-level function taking a cursor and the args
+        *args: The arguments of the operation
+        default (optional): The value returned if the operation fails. Defaults to None.
+
+    Returns:
+        The result of the operation, or default if it failed
+    """
+    if _writer_address is not None:
+        return _send_to_writer(operation, args, default)
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT() FROM items WHERE item=?", (id,))
-        if cursor.fetchone()[0]:
-            return True
-        return False
+        result = operation(conn.cursor(), *args)
+        conn.commit()
+        return result
     except Exception:
+        conn.rollback()
         print_exc()
-    finally:
-        if conn:
-            conn.close()
+        return default
+
+
+def _reset_writer_channel():
+    global _writer_channel, _writer_channel_lock
+    _writer_channel = None
+    _writer_channel_lock = threading.Lock()
+
+
+# A lock held by another thread at fork time would never be released in the child,
+# and the connection of the parent to the writer process must not be shared
+os.register_at_fork(after_in_child=_reset_writer_channel)
+
+
+def _send_to_writer(operation, args, default):
+    global _writer_channel
+    with _writer_channel_lock:
+        try:
+            if _writer_channel is None:
+                # Each process has its own connection to the writer, so a process
+                # killed while sending a write can't block the writes of the others
+                _writer_channel = [
+                    Client(_writer_address, authkey=current_process().authkey),
+                    0,
+                ]
+            conn = _writer_channel[0]
+            _writer_channel[1] += 1
+            sequence = _writer_channel[1]
+
+            conn.send((sequence, operation, args))
+            deadline = time.monotonic() + WRITER_REPLY_TIMEOUT
+            while conn.poll(max(0.0, deadline - time.monotonic())):
+                reply_sequence, ok, result = conn.recv()
+                # Replies to writes that timed out earlier are dropped
+                if reply_sequence != sequence:
+                    continue
+                if ok:
+                    return result
+                print(result, file=sys.stderr)
+                return default
+        except (OSError, EOFError):
+            # The writer process is gone, connect again on the next write
+            _writer_channel = None
+            print_exc()
+            return default
+        print(
+            f"No answer from the database writer process after {WRITER_REPLY_TIMEOUT}s",
+            file=sys.stderr,
+        )
+        return default
+
+
+def create_writer_listener():
+    """
+    Create the listener the writer process gets the connections of the other
+    processes from, see run_writer.
+
+    Returns:
+        multiprocessing.connection.Listener: The listener, its address is passed to start_writer
+    """
+    return Listener(authkey=current_process().authkey)
+
+
+def start_writer(address):
+    """
+    Send all the writes of this process, and of the processes forked from it
+    afterwards, to the writer process listening on address. Reads still use the
+    connection of each process.
+
+    Args:
+        address: The address of the listener of the writer process, see
+            create_writer_listener, or None to write directly again
+    """
+    global _writer_address
+    _writer_address = address
+    _reset_writer_channel()
+
+
+def run_writer(listener):
+    """
+    Execute the writes sent by the other processes, until interrupted.
+
+    Every process sends its writes on its own connection, accepted from listener.
+    A process that dies while sending only loses its connection.
+
+    Every write waiting on the connections is executed in the same transaction
+    (group commit), each one in its own savepoint so a failing write doesn't
+    affect the others. Each sender gets the result of its write once the
+    transaction is committed.
+
+    Args:
+        listener (multiprocessing.connection.Listener): The listener, see create_writer_listener
+    """
+    global _writer_address
+    # This process writes directly
+    _writer_address = None
+    conn = get_db_connection()
+    channels = []
+    accepted = queue.SimpleQueue()
+
+    def accept():
+        while True:
+            try:
+                accepted.put(listener.accept())
+            except (OSError, EOFError, AuthenticationError):
+                print_exc()
+
+    threading.Thread(target=accept, name="writer_accept", daemon=True).start()
+    while True:
+        while not accepted.empty():
+            channels.append(accepted.get())
+        if not channels:
+            time.sleep(WRITER_ACCEPT_INTERVAL)
+            continue
+
+        writes = []
+        for channel in wait(channels, timeout=WRITER_ACCEPT_INTERVAL):
+            try:
+                while len(writes) < WRITER_MAX_BATCH:
+                    sequence, operation, args = channel.recv()
+                    writes.append((channel, sequence, operation, args))
+                    if not channel.poll():
+                        break
+            except Exception:
+                # The sender is gone, possibly in the middle of a write
+                channels.remove(channel)
+                channel.close()
+        if not writes:
+            continue
+
+        replies = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for channel, sequence, operation, args in writes:
+                conn.execute("SAVEPOINT write")
+                try:
+                    result = operation(conn.cursor(), *args)
+                    conn.execute("RELEASE write")
+                    replies.append((channel, (sequence, True, result)))
+                except Exception:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    replies.append((channel, (sequence, False, format_exc())))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            error = format_exc()
+            replies = [
+                (channel, (sequence, False, error))
+                for channel, sequence, _, _ in writes
+            ]
+
+        for channel, reply in replies:
+            try:
+                channel.send(reply)
+            except OSError:
+                # The sender is gone
+                if channel in channels:
+                    channels.remove(channel)
+                    channel.close()
 
 
 def get_last_timestamp(query_id):
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute("SELECT last_item FROM queries WHERE id=?", (query_id,))
         result = cursor.fetchone()
@@ -57,110 +300,428 @@ def get_last_timestamp(query_id):
     except Exception:
         print_exc()
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
-def update_last_timestamp(query_id, timestamp):
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+# Maximum number of ids bound in a single IN (...) clause
+_MAX_IN_CLAUSE_IDS = 500
+
+
+def _select_known_item_ids(cursor, ids):
+    known_ids = set()
+    for i in range(0, len(ids), _MAX_IN_CLAUSE_IDS):
+        chunk = ids[i : i + _MAX_IN_CLAUSE_IDS]
+        placeholders = ",".join("?" * len(chunk))
         cursor.execute(
-            "UPDATE queries SET last_item=? WHERE id=?", (timestamp, query_id)
+            f"SELECT item FROM items WHERE item IN ({placeholders})", tuple(chunk)
         )
-        conn.commit()
+        known_ids.update(row[0] for row in cursor.fetchall())
+    return known_ids
+
+
+def get_known_item_ids(ids):
+    """
+    Get which of the given item ids are already stored in the database.
+
+    Args:
+        ids (list): The item ids to look up
+
+    Returns:
+        set: The subset of ids that are already in the items table
+    """
+    ids = list(ids)
+    if not ids:
+        return set()
+    conn = get_db_connection()
+    try:
+        return _select_known_item_ids(conn.cursor(), ids)
     except Exception:
         print_exc()
-    finally:
-        if conn:
-            conn.close()
+        return set()
 
 
-def add_item_to_db(id, title, query_id, price, timestamp, photo_url, currency="EUR"):
-    conn = None
+def iter_item_ids(limit=None, batch_size=10000):
+    """
+    Stream the ids of the items in the database, highest first.
+
+    Args:
+        limit (int, optional): The maximum number of ids. Defaults to None, all of them.
+        batch_size (int, optional): The number of rows fetched at once. Defaults to 10000.
+
+    Yields:
+        int: The id of an item
+    """
+    cursor = get_db_connection().cursor()
+    # Read in the order of idx_items_item
+    cursor.execute(
+        "SELECT DISTINCT item FROM items ORDER BY item DESC LIMIT ?",
+        (-1 if limit is None else limit,),
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row[0]
+
+
+def get_recent_item_ids(query_id, limit):
+    """
+    Get the ids of the last items stored for a query.
+
+    Args:
+        query_id (int): The ID of the query
+        limit (int): The maximum number of ids to return
+
+    Returns:
+        list: The ids of the items, oldest first
+    """
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
-        # Insert into db the id and the query_id related to the item
         cursor.execute(
-            "INSERT INTO items (item, title, price, currency, timestamp, photo_url, query_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (id, title, price, currency, timestamp, photo_url, query_id),
+            "SELECT item FROM items WHERE query_id=? ORDER BY timestamp DESC LIMIT ?",
+            (query_id, limit),
         )
-        # Update the last item for the query
+        return [row[0] for row in reversed(cursor.fetchall())]
+    except Exception:
+        print_exc()
+        return []
+
+
+def add_items_bulk(items, query_id, last_timestamp=None):
+    """
+    Add a batch of items found by a query in a single transaction.
+
+    Items already in the database are skipped, the others are inserted at once
+    and the last_item watermark of the query is advanced a single time.
+
+    Args:
+        items (list): Tuples of (id, title, price, currency, timestamp, photo_url)
+        query_id (int): The ID of the query that found the items
+        last_timestamp (int, optional): The new watermark of the query.
+            Defaults to the most recent timestamp of the items.
+
+    Returns:
+        int: The number of items inserted
+    """
+    if last_timestamp is None and items:
+        last_timestamp = max(item[4] for item in items)
+    return _run_write(_add_items_bulk, items, query_id, last_timestamp, default=0)
+
+
+def _add_items_bulk(cursor, items, query_id, last_timestamp):
+    known_ids = _select_known_item_ids(cursor, [item[0] for item in items])
+    rows = []
+    for id, title, price, currency, timestamp, photo_url in items:
+        if id in known_ids:
+            continue
+        known_ids.add(id)
+        rows.append((id, title, price, currency, timestamp, photo_url, query_id))
+    cursor.executemany(
+        "INSERT INTO items (item, title, price, currency, timestamp, photo_url, query_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    if last_timestamp is not None:
+        # The watermark never moves backwards
         cursor.execute(
-            "UPDATE queries SET last_item=? WHERE id=?", (timestamp, query_id)
+            "UPDATE queries SET last_item=MAX(COALESCE(last_item, 0), ?) WHERE id=?",
+            (last_timestamp, query_id),
         )
+    return len(rows)
+
+
+def delete_items_older_than(timestamp, batch_size=1000):
+    """
+    Delete a batch of items older than the given timestamp.
+    Deleting in small batches keeps the write lock short for the other processes.
+
+    Args:
+        timestamp (int): Items with an older timestamp are deleted
+        batch_size (int, optional): The maximum number of items deleted. Defaults to 1000.
+
+    Returns:
+        int: The number of items deleted
+    """
+    return _run_write(_delete_items_older_than, timestamp, batch_size, default=0)
+
+
+def _delete_items_older_than(cursor, timestamp, batch_size):
+    cursor.execute(
+        "DELETE FROM items WHERE rowid IN (SELECT rowid FROM items WHERE timestamp < ? LIMIT ?)",
+        (timestamp, batch_size),
+    )
+    return cursor.rowcount
+
+
+def incremental_vacuum(max_pages=2000):
+    """
+    Release free pages of the database file back to the file system.
+    Only has an effect when the database uses auto_vacuum=INCREMENTAL.
+
+    Args:
+        max_pages (int, optional): The maximum number of pages released, to keep
+            the write lock short. Defaults to 2000.
+
+    Returns:
+        int: The number of bytes reclaimed
+    """
+    return _run_write(_incremental_vacuum, int(max_pages), default=0)
+
+
+def _incremental_vacuum(cursor, max_pages):
+    page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+    free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    pages = min(max_pages, free_pages)
+    # Each execution of the pragma by sqlite3 releases a single page, and unlike
+    # executescript it doesn't commit the transaction of the writer process first
+    for _ in range(pages):
+        cursor.execute("PRAGMA incremental_vacuum(1)")
+    # Running another statement also finishes the last pragma
+    released = free_pages - cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    return released * page_size
+
+
+def get_auto_vacuum():
+    """
+    Get the auto_vacuum mode of the database.
+
+    Returns:
+        int: 0 for NONE, 1 for FULL, 2 for INCREMENTAL, or None if it couldn't be read
+    """
+    conn = get_db_connection()
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    except Exception:
+        print_exc()
+        return None
+
+
+def enable_incremental_vacuum():
+    """
+    Convert the database to auto_vacuum=INCREMENTAL, so incremental_vacuum can shrink it.
+
+    Databases created from initial_db.sql already use it. Older ones need a full VACUUM,
+    which rewrites the whole file while holding the write lock. It runs on the connection
+    of the calling process even when the writer process is on, as VACUUM can't run
+    inside a transaction.
+
+    Returns:
+        bool: True if the database now uses auto_vacuum=INCREMENTAL
+    """
+    conn = get_db_connection()
+    try:
         conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
     except Exception:
         print_exc()
-    finally:
-        if conn:
-            conn.close()
+        return False
 
 
 def get_queries():
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        cursor.execute("SELECT id, query, last_item, query_name FROM queries")
+        cursor.execute(
+            "SELECT id, query, last_item, query_name, api_params FROM queries"
+        )
         return cursor.fetchall()
     except Exception:
         print_exc()
-    finally:
-        if conn:
-            conn.close()
 
 
-def is_query_in_db(processed_query):
-    conn = None
+def get_query_polling():
+    """
+    Get the polling state of all the queries, used by the adaptive scheduler.
+
+    Returns:
+        dict: query_id -> (poll_interval, arrival_rate). Both are None for a query
+            that was never polled adaptively.
+    """
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        # replace spaces in searched_text by % to match any query containing the searched text
+        cursor.execute("SELECT id, poll_interval, arrival_rate FROM queries")
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    except Exception:
+        print_exc()
+        return {}
+
+
+def update_query_polling(states):
+    """
+    Store the polling state of several queries in a single transaction.
+
+    Args:
+        states (list): Tuples of (query_id, poll_interval, arrival_rate)
+    """
+    _run_write(_update_query_polling, states)
+
+
+def _update_query_polling(cursor, states):
+    cursor.executemany(
+        "UPDATE queries SET poll_interval=?, arrival_rate=? WHERE id=?",
+        [(interval, rate, query_id) for query_id, interval, rate in states],
+    )
+
+
+def get_cookie_jar(locale, proxy):
+    """
+    Get the cookies stored for the session of a locale and a proxy.
 
+    Args:
+        locale (str): The locale domain (e.g., 'www.vinted.fr')
+        proxy (str, optional): The proxy of the session, None for a direct connection
+
+    Returns:
+        tuple: (user_agent, cookies, expires), cookies being a JSON list, or None
+            if no cookies are stored for the session
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
         cursor.execute(
-            "SELECT COUNT() FROM queries WHERE query = ?", (processed_query,)
+            "SELECT user_agent, cookies, expires FROM cookie_jars WHERE locale=? AND proxy=?",
+            (locale, proxy or ""),
         )
-        if cursor.fetchone()[0]:
-            return True
-        return False
+        return cursor.fetchone()
+    except sqlite3.OperationalError as e:
+        # The requester is imported before the migrations run, the table may not exist yet
+        if "no such table" not in str(e):
+            print_exc()
+        return None
     except Exception:
         print_exc()
-        return False
-    finally:
-        if conn:
-            conn.close()
+        return None
+
+
+def save_cookie_jar(locale, proxy, user_agent, cookies, expires):
+    """
+    Store the cookies of the session of a locale and a proxy.
+
+    Args:
+        locale (str): The locale domain (e.g., 'www.vinted.fr')
+        proxy (str, optional): The proxy of the session, None for a direct connection
+        user_agent (str): The User-Agent the cookies were issued to
+        cookies (str): The cookies, as a JSON list
+        expires (float): When the first of the cookies expires (Unix time)
+    """
+    _run_write(_save_cookie_jar, locale, proxy, user_agent, cookies, expires)
+
+
+def _save_cookie_jar(cursor, locale, proxy, user_agent, cookies, expires):
+    cursor.execute(
+        "INSERT OR REPLACE INTO cookie_jars (locale, proxy, user_agent, cookies, expires) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (locale, proxy or "", user_agent, cookies, expires),
+    )
+
+
+def delete_stale_cookie_jars(proxies):
+    """
+    Delete the stored cookies that expired, and those of the proxies no longer in use.
+
+    Args:
+        proxies (list): The proxies in use, the cookies of direct sessions are kept
+
+    Returns:
+        int: The number of cookie jars deleted
+    """
+    return _run_write(_delete_stale_cookie_jars, list(proxies), default=0)
+
 
+def _delete_stale_cookie_jars(cursor, proxies):
+    cursor.execute("DELETE FROM cookie_jars WHERE expires < ?", (time.time(),))
+    deleted = cursor.rowcount
+    kept = set(proxies) | {""}
+    cursor.execute("SELECT DISTINCT proxy FROM cookie_jars")
+    gone = [(proxy,) for (proxy,) in cursor.fetchall() if proxy not in kept]
+    if gone:
+        cursor.executemany("DELETE FROM cookie_jars WHERE proxy=?", gone)
+        deleted += cursor.rowcount
+    return deleted
 
-def add_query_to_db(query, name=None):
-    conn = None
+
+def get_query_id_by_fingerprint(fingerprint):
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        if name:
-            cursor.execute(
-                "INSERT INTO queries (query, last_item, query_name) VALUES (?, NULL, ?)",
-                (query, name),
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO queries (query, last_item) VALUES (?, NULL)", (query,)
-            )
-        conn.commit()
+        cursor.execute("SELECT id FROM queries WHERE fingerprint = ?", (fingerprint,))
+        result = cursor.fetchone()
+        if result:
+            return result[0]
+        return None
     except Exception:
         print_exc()
-    finally:
-        if conn:
-            conn.close()
+        return None
+
+
+def add_query_to_db(query, name=None, fingerprint=None, api_params=None):
+    _run_write(_add_query_to_db, query, name, fingerprint, api_params)
+
+
+def _add_query_to_db(cursor, query, name, fingerprint, api_params):
+    cursor.execute(
+        "INSERT INTO queries (query, last_item, query_name, fingerprint, api_params) VALUES (?, NULL, ?, ?, ?)",
+        (query, name or None, fingerprint, api_params),
+    )
+
+
+def set_query_fingerprint(query_id, fingerprint, api_params):
+    """
+    Store the fingerprint and the precompiled API parameters of a query.
+
+    Args:
+        query_id (int): The ID of the query
+        fingerprint (str): The fingerprint of the query
+        api_params (str): The API parameters of the query, as JSON
+
+    Returns:
+        bool: True if they were stored, False otherwise
+    """
+    return _run_write(
+        _set_query_fingerprint, query_id, fingerprint, api_params, default=False
+    )
+
+
+def _set_query_fingerprint(cursor, query_id, fingerprint, api_params):
+    cursor.execute(
+        "UPDATE queries SET fingerprint=?, api_params=? WHERE id=?",
+        (fingerprint, api_params, query_id),
+    )
+    return True
+
+
+def merge_queries(duplicate_id, query_id):
+    """
+    Merge a duplicate query into another one.
+    The items of the duplicate are moved to the query, then the duplicate is removed.
+
+    Args:
+        duplicate_id (int): The ID of the query to remove
+        query_id (int): The ID of the query to keep
+    """
+    _run_write(_merge_queries, duplicate_id, query_id)
+
+
+def _merge_queries(cursor, duplicate_id, query_id):
+    cursor.execute(
+        "UPDATE items SET query_id=? WHERE query_id=?", (query_id, duplicate_id)
+    )
+    # Keep the newest watermark, NULL only if neither query was ever scraped
+    duplicate_last_item = "(SELECT last_item FROM queries WHERE id=?)"
+    cursor.execute(
+        f"UPDATE queries SET last_item=MAX(COALESCE(last_item, {duplicate_last_item}), "
+        f"COALESCE({duplicate_last_item}, last_item)) WHERE id=?",
+        (duplicate_id, duplicate_id, query_id),
+    )
+    cursor.execute("DELETE FROM queries WHERE id=?", (duplicate_id,))
 
 
 def get_query_id_by_rowid(rowid):
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         query = f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY ROWID) rn FROM queries) t WHERE rn={rowid}"
         cursor.execute(query)
@@ -171,46 +732,31 @@ def get_query_id_by_rowid(rowid):
     except Exception:
         print_exc()
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 def remove_query_from_db(query_number):
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # Delete items associated with this query using query_id
-        cursor.execute("DELETE FROM items WHERE query_id=?", (query_number,))
-        # Delete the query
-        cursor.execute("DELETE FROM queries WHERE id=?", (query_number,))
-        conn.commit()
-    except Exception:
-        print_exc()
-    finally:
-        if conn:
-            conn.close()
+    _run_write(_remove_query_from_db, query_number)
+
+
+def _remove_query_from_db(cursor, query_number):
+    # Delete items associated with this query using query_id
+    cursor.execute("DELETE FROM items WHERE query_id=?", (query_number,))
+    # Delete the query
+    cursor.execute("DELETE FROM queries WHERE id=?", (query_number,))
 
 
 def remove_all_queries_from_db():
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        # Delete all items first to maintain foreign key integrity
-        cursor.execute("DELETE FROM items")
-        # Then delete all queries
-        cursor.execute("DELETE FROM queries")
-        conn.commit()
-    except Exception:
-        print_exc()
-    finally:
-        if conn:
-            conn.close()
+    _run_write(_remove_all_queries_from_db)
+
+
+def _remove_all_queries_from_db(cursor):
+    # Delete all items first to maintain foreign key integrity
+    cursor.execute("DELETE FROM items")
+    # Then delete all queries
+    cursor.execute("DELETE FROM queries")
 
 
-def update_query_in_db(query_id, query, name):
+def update_query_in_db(query_id, query, name, fingerprint=None, api_params=None):
     """
     Update an existing query in the database.
 
@@ -218,198 +764,292 @@ def update_query_in_db(query_id, query, name):
         query_id (int): The ID of the query to update
         query (str): The new query URL
         name (str, optional): The new name for the query
+        fingerprint (str, optional): The fingerprint of the new query URL
+        api_params (str, optional): The API parameters of the new query URL, as JSON
 
     Returns:
         bool: True if the query was updated successfully, False otherwise
     """
-    conn = None
+    return _run_write(
+        _update_query_in_db,
+        query_id,
+        query,
+        name,
+        fingerprint,
+        api_params,
+        default=False,
+    )
+
+
+def _update_query_in_db(cursor, query_id, query, name, fingerprint, api_params):
+    cursor.execute(
+        "UPDATE queries SET query=?, query_name=?, fingerprint=?, api_params=? WHERE id=?",
+        (query, name, fingerprint, api_params, query_id),
+    )
+    return True
+
+
+def _get_cache_version(cursor, version_table):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE queries SET query=?, query_name=? WHERE id=?",
-            (query, name, query_id),
-        )
-        conn.commit()
-        return True
-    except Exception:
-        print_exc()
-        return False
-    finally:
-        if conn:
-            conn.close()
+        cursor.execute(f"SELECT version FROM {version_table} WHERE id = 0")
+        return cursor.fetchone()[0]
+    except sqlite3.OperationalError:
+        # The version table does not exist before the migrations ran
+        return None
 
 
 def add_to_allowlist(country):
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO allowlist VALUES (?)", (country,))
-        conn.commit()
-    except Exception:
-        print_exc()
-    finally:
-        if conn:
-            conn.close()
+    _run_write(_add_to_allowlist, country)
+    invalidate_allowlist_cache()
+
+
+def _add_to_allowlist(cursor, country):
+    cursor.execute("INSERT INTO allowlist VALUES (?)", (country,))
 
 
 def remove_from_allowlist(country):
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM allowlist WHERE country=?", (country,))
-        conn.commit()
-    except Exception:
-        print_exc()
-    finally:
-        if conn:
-            conn.close()
+    _run_write(_remove_from_allowlist, country)
+    invalidate_allowlist_cache()
+
+
+def _remove_from_allowlist(cursor, country):
+    cursor.execute("DELETE FROM allowlist WHERE country=?", (country,))
 
 
 def get_allowlist():
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM allowlist")
-        # Get list of countries
-        countries = [country[0] for country in cursor.fetchall()]
-        # Return 0 if there are no countries in the allowlist
-        if not countries:
-            return 0
-        return countries
-    finally:
-        if conn:
-            conn.close()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM allowlist")
+    # Get list of countries
+    countries = [country[0] for country in cursor.fetchall()]
+    # Return 0 if there are no countries in the allowlist
+    if not countries:
+        return 0
+    return countries
 
 
-def clear_allowlist():
-    conn = None
+def get_allowlist_set():
+    """
+    Get the allowlist as a set, for fast membership checks.
+
+    The allowlist is cached in the process and reloaded only when the
+    allowlist table changed, which is checked at most every PARAMETERS_CACHE_TTL seconds.
+    If the database can't be read, the last allowlist loaded is used, so a failing
+    read never lets every country through.
+
+    Returns:
+        frozenset: The allowed country codes, empty if there is no allowlist
+
+    Raises:
+        sqlite3.Error: If the database can't be read and no allowlist was loaded yet
+    """
+    global _allowlist_cache
+    now = time.monotonic()
+    checked_at, version, countries = _allowlist_cache
+    if countries is not None and now - checked_at < PARAMETERS_CACHE_TTL:
+        return countries
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM allowlist")
-        conn.commit()
+        cursor = get_db_connection().cursor()
+        new_version = _get_cache_version(cursor, "allowlist_version")
+        if countries is None or new_version is None or new_version != version:
+            cursor.execute("SELECT country FROM allowlist")
+            countries = frozenset(row[0] for row in cursor.fetchall())
+        _allowlist_cache = (
+            now if new_version is not None else 0.0,
+            new_version,
+            countries,
+        )
+        return countries
     except Exception:
+        if countries is None:
+            raise
         print_exc()
-    finally:
-        if conn:
-            conn.close()
+        return countries
+
+
+def invalidate_allowlist_cache():
+    """
+    Force the next allowlist read of this process to check the database again.
+    The allowlist loaded so far is kept, in case the database can't be read.
+    """
+    global _allowlist_cache
+    _allowlist_cache = (0.0, None, _allowlist_cache[2])
+
+
+def clear_allowlist():
+    _run_write(_clear_allowlist)
+    invalidate_allowlist_cache()
+
+
+def _clear_allowlist(cursor):
+    cursor.execute("DELETE FROM allowlist")
+
+
+def _load_parameters():
+    global _parameters_cache
+    now = time.monotonic()
+    checked_at, version, parameters = _parameters_cache
+    if parameters is not None and now - checked_at < PARAMETERS_CACHE_TTL:
+        return parameters
+
+    cursor = get_db_connection().cursor()
+    new_version = _get_cache_version(cursor, "parameters_version")
+    if parameters is None or new_version is None or new_version != version:
+        cursor.execute("SELECT key, value FROM parameters")
+        parameters = {row[0]: row[1] for row in cursor.fetchall()}
+    # Without a version table we can't know when to reload, so don't cache
+    _parameters_cache = (
+        now if new_version is not None else 0.0,
+        new_version,
+        parameters,
+    )
+    return parameters
+
+
+def invalidate_parameters_cache():
+    """
+    Force the next parameter read of this process to check the database again.
+    """
+    global _parameters_cache
+    _parameters_cache = (0.0, None, None)
 
 
 def get_parameter(key):
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM parameters WHERE key=?", (key,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        return _load_parameters().get(key)
     except Exception:
         print_exc()
-    finally:
-        if conn:
-            conn.close()
 
 
 def set_parameter(key, value):
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE parameters SET value=? WHERE key=?", (value, key))
-        conn.commit()
-    except Exception:
-        print_exc()
-    finally:
-        if conn:
-            conn.close()
+    _run_write(_set_parameter, key, value)
+    invalidate_parameters_cache()
+
+
+def _set_parameter(cursor, key, value):
+    cursor.execute("UPDATE parameters SET value=? WHERE key=?", (value, key))
 
 
 def get_all_parameters():
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM parameters")
-        return {row[0]: row[1] for row in cursor.fetchall()}
+        return dict(_load_parameters())
     except Exception:
         print_exc()
         return {}
-    finally:
-        if conn:
-            conn.close()
 
 
-def get_items(limit=50, query=None):
-    conn = None
+def get_items(limit=50, query=None, query_id=None, before=None):
+    """
+    Get a page of items, most recent first.
+
+    Pages are read with keyset pagination on (timestamp, item), so reading a
+    page deep in the history costs the same as reading the first one.
+
+    Args:
+        limit (int, optional): The maximum number of items. Defaults to 50.
+        query (str, optional): Only return the items of the query with this URL
+        query_id (int, optional): Only return the items of the query with this ID
+        before (tuple, optional): The (timestamp, item) of the last item of the previous
+            page. Only the items after it are returned.
+
+    Returns:
+        list: Tuples of (item, title, price, currency, timestamp, query, photo_url)
+    """
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         if query:
             # Get the query_id for the given query
             cursor.execute("SELECT id FROM queries WHERE query=?", (query,))
             result = cursor.fetchone()
-            if result:
-                query_id = result[0]
-                # Get items with the matching query_id
-                cursor.execute(
-                    "SELECT i.item, i.title, i.price, i.currency, i.timestamp, q.query, i.photo_url FROM items i JOIN queries q ON i.query_id = q.id WHERE i.query_id=? ORDER BY i.timestamp DESC LIMIT ?",
-                    (query_id, limit),
-                )
-            else:
+            if not result:
                 return []
-        else:
-            # Join with queries table to get the query text
-            cursor.execute(
-                "SELECT i.item, i.title, i.price, i.currency, i.timestamp, q.query, i.photo_url FROM items i JOIN queries q ON i.query_id = q.id ORDER BY i.timestamp DESC LIMIT ?",
-                (limit,),
-            )
+            query_id = result[0]
+
+        conditions = []
+        params = []
+        if query_id is not None:
+            conditions.append("i.query_id=?")
+            params.append(query_id)
+        if before is not None:
+            conditions.append("(i.timestamp, i.item) < (?, ?)")
+            params.extend(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Join with queries table to get the query text
+        cursor.execute(
+            "SELECT i.item, i.title, i.price, i.currency, i.timestamp, q.query, i.photo_url "
+            f"FROM items i JOIN queries q ON i.query_id = q.id {where} "
+            "ORDER BY i.timestamp DESC, i.item DESC LIMIT ?",
+            (*params, limit),
+        )
         return cursor.fetchall()
     except Exception:
         print_exc()
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
-def get_total_items_count():
-    conn = None
+def get_stats():
+    """
+    Get the aggregates of the items table.
+    They are maintained by triggers, so this never scans the items table.
+
+    Returns:
+        dict: total_items, first_timestamp and last_timestamp
+    """
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM items")
-        return cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT total_items, first_timestamp, last_timestamp FROM stats WHERE id = 0"
+        )
+        result = cursor.fetchone()
+        if result:
+            return {
+                "total_items": result[0],
+                "first_timestamp": result[1],
+                "last_timestamp": result[2],
+            }
     except Exception:
         print_exc()
-        return 0
-    finally:
-        if conn:
-            conn.close()
+    return {"total_items": 0, "first_timestamp": None, "last_timestamp": None}
+
+
+def get_query_item_counts():
+    """
+    Get the number of items found by each query.
+
+    Returns:
+        dict: The number of items, by query ID
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT query_id, item_count FROM query_stats")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except Exception:
+        print_exc()
+        return {}
+
+
+def get_total_items_count():
+    return get_stats()["total_items"]
 
 
 def get_total_queries_count():
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) FROM queries")
         return cursor.fetchone()[0]
     except Exception:
         print_exc()
         return 0
-    finally:
-        if conn:
-            conn.close()
 
 
 def get_last_found_item():
-    conn = None
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute(
             "SELECT i.item, i.title, i.price, i.currency, i.timestamp, q.query, i.photo_url FROM items i JOIN queries q ON i.query_id = q.id ORDER BY i.timestamp DESC LIMIT 1"
@@ -418,33 +1058,22 @@ def get_last_found_item():
     except Exception:
         print_exc()
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
-def get_items_per_day():
-    conn = None
+def get_items_per_day(stats=None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Get total items
-        cursor.execute("SELECT COUNT(*) FROM items")
-        total_items = cursor.fetchone()[0]
+        if stats is None:
+            stats = get_stats()
+        total_items = stats["total_items"]
 
         if total_items == 0:
             return 0
 
-        # Get earliest and latest timestamps
-        cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM items")
-        min_timestamp, max_timestamp = cursor.fetchone()
-
         # Calculate number of days (add 1 to include both start and end days)
         import datetime
 
-        min_date = datetime.datetime.fromtimestamp(min_timestamp).date()
-        max_date = datetime.datetime.fromtimestamp(max_timestamp).date()
+        min_date = datetime.datetime.fromtimestamp(stats["first_timestamp"]).date()
+        max_date = datetime.datetime.fromtimestamp(stats["last_timestamp"]).date()
         days_diff = (max_date - min_date).days + 1
 
         # Ensure at least 1 day to avoid division by zero
@@ -455,6 +1084,3 @@ def get_items_per_day():
     except Exception:
         print_exc()
         return 0
-    finally:
-        if conn:
-            conn.close()
@@ -3,6 +3,12 @@
 
 PRAGMA foreign_keys = ON;
 
+-- Let the database file shrink as old items are pruned, see db.incremental_vacuum.
+-- The connection already wrote the header of the file, the VACUUM applies the
+-- setting and is instant on an empty database.
+PRAGMA auto_vacuum = INCREMENTAL;
+VACUUM;
+
 /* ============================
    Tables
    ============================ */
@@ -0,0 +1,163 @@
+import heapq
+from collections import OrderedDict
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# Number of the highest item ids kept in the index of seen items
+MAX_SEEN_IDS = 1_000_000
+
+# Number of item ids the scraper remembers per query, see RecentItems
+RECENT_IDS_PER_QUERY = 1000
+
+
+class SeenItemIndex:
+    """
+    An in-memory index of the item ids stored in the database.
+
+    The MAX_SEEN_IDS highest ids are kept in an exact set. Vinted ids grow over time,
+    so the ids dropped once it is full are the ones of the oldest items, and the
+    highest id dropped is kept as a floor: an id at or below the floor may have been
+    seen, any other id is seen only if it is in the set.
+
+    A negative answer is always definitive, so only ids reported as seen
+    need to be confirmed against the database. The ids of new items are above
+    the floor, so they rarely are.
+
+    Example:
+        >>> index = SeenItemIndex([1, 2, 3], max_ids=2)
+        >>> index.might_contain(1), index.might_contain(3), index.might_contain(4)
+        (True, True, False)
+    """
+
+    def __init__(self, item_ids=(), max_ids=MAX_SEEN_IDS):
+        """
+        Initialize the index with the ids already known.
+
+        Args:
+            item_ids (iterable, optional): The known item ids, highest first for
+                the index to be built the fastest. Defaults to ().
+            max_ids (int, optional): The number of ids kept. Defaults to MAX_SEEN_IDS.
+        """
+        self.max_ids = max_ids
+        self._ids = set()
+        # The same ids, to find the lowest one when the set is full
+        self._heap = []
+        self._floor = None
+        self.count = 0
+        self.update(item_ids)
+
+    def add(self, item_id):
+        """
+        Add an item id to the index.
+
+        Args:
+            item_id (int): The id of the item.
+        """
+        if self.might_contain(item_id):
+            return
+        self._ids.add(item_id)
+        heapq.heappush(self._heap, item_id)
+        self.count += 1
+        if len(self._ids) > self.max_ids:
+            # The lowest id is above the floor, so the floor only grows
+            self._floor = heapq.heappop(self._heap)
+            self._ids.discard(self._floor)
+
+    def update(self, item_ids):
+        """
+        Add several item ids to the index.
+
+        Args:
+            item_ids (iterable): The ids of the items.
+        """
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def might_contain(self, item_id):
+        """
+        Check if an item id may have been seen.
+
+        Args:
+            item_id (int): The id of the item.
+
+        Returns:
+            bool: False if the item was never seen, True if it probably was.
+        """
+        return item_id in self._ids or (
+            self._floor is not None and item_id <= self._floor
+        )
+
+
+class RecentItems:
+    """
+    The items of a query recently sent by the scraper to the extractor.
+
+    Keeps the watermark of the query (the newest timestamp sent) and a bounded set
+    of the ids sent last, so a poll only sends the items that were never sent:
+    the ones older than the watermark are dropped, and the ones at or above it
+    are dropped if their id was already sent.
+
+    Example:
+        >>> recent = RecentItems(watermark=100, item_ids=[1])
+        >>> recent.is_new(1, 120), recent.is_new(2, 120), recent.is_new(3, 90)
+        (False, True, False)
+    """
+
+    def __init__(self, watermark=None, item_ids=(), max_ids=RECENT_IDS_PER_QUERY):
+        """
+        Initialize the items of a query from what is stored for it.
+
+        Args:
+            watermark (int, optional): The timestamp of the newest item processed,
+                None if the query never found any. Defaults to None.
+            item_ids (iterable, optional): The ids of the last items processed,
+                oldest first. Defaults to ().
+            max_ids (int, optional): The number of ids remembered.
+                Defaults to RECENT_IDS_PER_QUERY.
+        """
+        self.watermark = watermark
+        self.max_ids = max_ids
+        self._ids = OrderedDict()
+        for item_id in item_ids:
+            self._remember(item_id)
+
+    def _remember(self, item_id):
+        self._ids[item_id] = None
+        self._ids.move_to_end(item_id)
+        if len(self._ids) > self.max_ids:
+            self._ids.popitem(last=False)
+
+    def is_new(self, item_id, timestamp):
+        """
+        Check if an item was never sent.
+
+        Args:
+            item_id (int): The id of the item.
+            timestamp (int): The timestamp of the item.
+
+        Returns:
+            bool: True if the item is newer than the watermark and was never sent.
+        """
+        if self.watermark is not None and timestamp < self.watermark:
+            return False
+        return item_id not in self._ids
+
+    def select(self, items):
+        """
+        Keep the items that were never sent, and record them as sent.
+
+        Args:
+            items (list): The items found by a poll of the query.
+
+        Returns:
+            list: The new items, in the same order.
+        """
+        new_items = [item for item in items if self.is_new(item.id, item.raw_timestamp)]
+        # Oldest first, so the newest ids are the last to be forgotten
+        for item in sorted(new_items, key=lambda item: item.raw_timestamp):
+            self._remember(item.id)
+            if self.watermark is None or item.raw_timestamp > self.watermark:
+                self.watermark = item.raw_timestamp
+        return new_items
@@ -0,0 +1,30 @@
+BEGIN TRANSACTION;
+
+-- Canonical fingerprint and precompiled API parameters of each query.
+-- They are computed for the existing queries at startup.
+ALTER TABLE queries
+    ADD COLUMN fingerprint TEXT;
+ALTER TABLE queries
+    ADD COLUMN api_params TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_queries_fingerprint ON queries (fingerprint);
+
+-- Duplicate queries found while computing the fingerprints are merged by moving their items
+CREATE TRIGGER IF NOT EXISTS stats_items_update_query
+    AFTER UPDATE OF query_id
+    ON items
+BEGIN
+    UPDATE query_stats
+    SET item_count = item_count - 1
+    WHERE query_id = OLD.query_id;
+    INSERT INTO query_stats (query_id, item_count)
+    SELECT NEW.query_id, 1
+    WHERE NEW.query_id IS NOT NULL
+    ON CONFLICT (query_id) DO UPDATE SET item_count = item_count + 1;
+END;
+
+UPDATE parameters
+SET value = '1.0.5.11'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,14 @@
+BEGIN TRANSACTION;
+
+-- Number of queries scraped concurrently (1 scrapes them one after the other),
+-- and the limits of requests in flight per Vinted domain and per proxy (0 means no limit)
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('query_concurrency', '1'),
+       ('query_concurrency_per_domain', '4'),
+       ('query_concurrency_per_proxy', '2');
+
+UPDATE parameters
+SET value = '1.0.5.12'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,18 @@
+BEGIN TRANSACTION;
+
+-- Polling state of each query, kept by the adaptive scheduler across restarts
+ALTER TABLE queries
+    ADD COLUMN poll_interval REAL;
+ALTER TABLE queries
+    ADD COLUMN arrival_rate REAL;
+
+-- Poll each query according to its arrival rate, within a budget of requests per minute
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('adaptive_polling', 'False'),
+       ('polling_requests_per_minute', '60');
+
+UPDATE parameters
+SET value = '1.0.5.13'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,12 @@
+BEGIN TRANSACTION;
+
+-- Requests per minute allowed per locale and proxy, for each class of Vinted endpoints (0 means no limit)
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('rate_limit_catalog', '120'),
+       ('rate_limit_users', '60');
+
+UPDATE parameters
+SET value = '1.0.5.14'
+WHERE key = 'version';
+
+COMMIT;
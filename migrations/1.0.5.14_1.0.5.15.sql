@@ -0,0 +1,11 @@
+BEGIN TRANSACTION;
+
+-- Send the queries that only differ by brands, sizes or colors as a single request
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('query_coalescing', 'False');
+
+UPDATE parameters
+SET value = '1.0.5.15'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN TRANSACTION;
+
+-- Maximum number of pages fetched per query to catch up with its watermark (1 disables the catch-up)
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('catchup_max_pages', '5');
+
+UPDATE parameters
+SET value = '1.0.5.16'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN TRANSACTION;
+
+-- Comma-separated hops between the processes using a shared memory queue (items, new_items, rss, telegram)
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('shared_memory_queues', '');
+
+UPDATE parameters
+SET value = '1.0.5.17'
+WHERE key = 'version';
+
+COMMIT;
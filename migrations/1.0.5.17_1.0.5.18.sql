@@ -0,0 +1,19 @@
+BEGIN TRANSACTION;
+
+-- Cookies of the Vinted sessions, per locale and proxy ('' for a direct connection),
+-- so a restarted process doesn't have to fetch them again
+CREATE TABLE IF NOT EXISTS cookie_jars
+(
+    locale     TEXT NOT NULL,
+    proxy      TEXT NOT NULL,
+    user_agent TEXT,
+    cookies    TEXT NOT NULL,
+    expires    REAL NOT NULL,
+    PRIMARY KEY (locale, proxy)
+);
+
+UPDATE parameters
+SET value = '1.0.5.18'
+WHERE key = 'version';
+
+COMMIT;
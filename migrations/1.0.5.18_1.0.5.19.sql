@@ -0,0 +1,13 @@
+BEGIN TRANSACTION;
+
+-- Merging two queries that were never scraped used to set their watermark to 0
+-- instead of leaving it NULL
+UPDATE queries
+SET last_item = NULL
+WHERE last_item = 0;
+
+UPDATE parameters
+SET value = '1.0.5.19'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,28 @@
+BEGIN TRANSACTION;
+
+-- Merge duplicate queries so the unique index can be created.
+-- Items of a duplicate are moved to the oldest copy of the query.
+UPDATE items
+SET query_id = (SELECT MIN(q2.id)
+                FROM queries q1
+                         JOIN queries q2 ON q2.query = q1.query
+                WHERE q1.id = items.query_id)
+WHERE query_id IN (SELECT id
+                   FROM queries
+                   WHERE id NOT IN (SELECT MIN(id) FROM queries GROUP BY query));
+
+DELETE
+FROM queries
+WHERE id NOT IN (SELECT MIN(id) FROM queries GROUP BY query);
+
+-- Indexes for the items and queries hot paths
+CREATE INDEX IF NOT EXISTS idx_items_item ON items (item);
+CREATE INDEX IF NOT EXISTS idx_items_query_id_timestamp ON items (query_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_items_timestamp ON items (timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_queries_query ON queries (query);
+
+UPDATE parameters
+SET value = '1.0.5.4'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,38 @@
+BEGIN TRANSACTION;
+
+-- Counter bumped on every change of the parameters table, used to invalidate the parameter cache
+CREATE TABLE IF NOT EXISTS parameters_version
+(
+    id      INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO parameters_version (id, version)
+VALUES (0, 0);
+
+CREATE TRIGGER IF NOT EXISTS parameters_version_insert
+    AFTER INSERT
+    ON parameters
+BEGIN
+    UPDATE parameters_version SET version = version + 1 WHERE id = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS parameters_version_update
+    AFTER UPDATE
+    ON parameters
+BEGIN
+    UPDATE parameters_version SET version = version + 1 WHERE id = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS parameters_version_delete
+    AFTER DELETE
+    ON parameters
+BEGIN
+    UPDATE parameters_version SET version = version + 1 WHERE id = 0;
+END;
+
+UPDATE parameters
+SET value = '1.0.5.5'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,38 @@
+BEGIN TRANSACTION;
+
+-- Counter bumped on every change of the allowlist table, used to invalidate the allowlist cache
+CREATE TABLE IF NOT EXISTS allowlist_version
+(
+    id      INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO allowlist_version (id, version)
+VALUES (0, 0);
+
+CREATE TRIGGER IF NOT EXISTS allowlist_version_insert
+    AFTER INSERT
+    ON allowlist
+BEGIN
+    UPDATE allowlist_version SET version = version + 1 WHERE id = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS allowlist_version_update
+    AFTER UPDATE
+    ON allowlist
+BEGIN
+    UPDATE allowlist_version SET version = version + 1 WHERE id = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS allowlist_version_delete
+    AFTER DELETE
+    ON allowlist
+BEGIN
+    UPDATE allowlist_version SET version = version + 1 WHERE id = 0;
+END;
+
+UPDATE parameters
+SET value = '1.0.5.6'
+WHERE key = 'version';
+
+COMMIT;
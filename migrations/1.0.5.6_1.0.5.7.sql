@@ -0,0 +1,15 @@
+-- The database file shrinks as old items are pruned when it uses auto_vacuum=INCREMENTAL.
+-- New databases are created with it. Converting an existing one takes a full VACUUM,
+-- which only runs once the retention is turned on, see core.prune_old_items.
+
+BEGIN TRANSACTION;
+
+-- Number of days items are kept, 0 keeps them forever
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('item_retention_days', '0');
+
+UPDATE parameters
+SET value = '1.0.5.7'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,77 @@
+BEGIN TRANSACTION;
+
+-- Aggregates over the items table, maintained by triggers so the dashboard never scans items
+CREATE TABLE IF NOT EXISTS stats
+(
+    id              INTEGER PRIMARY KEY CHECK (id = 0),
+    total_items     INTEGER NOT NULL DEFAULT 0,
+    first_timestamp NUMERIC,
+    last_timestamp  NUMERIC
+);
+
+CREATE TABLE IF NOT EXISTS query_stats
+(
+    query_id   INTEGER PRIMARY KEY,
+    item_count INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR REPLACE INTO stats (id, total_items, first_timestamp, last_timestamp)
+SELECT 0, COUNT(*), MIN(timestamp), MAX(timestamp)
+FROM items;
+
+DELETE
+FROM query_stats;
+INSERT INTO query_stats (query_id, item_count)
+SELECT query_id, COUNT(*)
+FROM items
+WHERE query_id IS NOT NULL
+GROUP BY query_id;
+
+CREATE TRIGGER IF NOT EXISTS stats_items_insert
+    AFTER INSERT
+    ON items
+BEGIN
+    UPDATE stats
+    SET total_items     = total_items + 1,
+        first_timestamp = MIN(COALESCE(first_timestamp, NEW.timestamp), NEW.timestamp),
+        last_timestamp  = MAX(COALESCE(last_timestamp, NEW.timestamp), NEW.timestamp)
+    WHERE id = 0;
+    INSERT INTO query_stats (query_id, item_count)
+    SELECT NEW.query_id, 1
+    WHERE NEW.query_id IS NOT NULL
+    ON CONFLICT (query_id) DO UPDATE SET item_count = item_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_items_delete
+    AFTER DELETE
+    ON items
+BEGIN
+    UPDATE stats
+    SET total_items = total_items - 1
+    WHERE id = 0;
+    -- The bounds only need to be looked up again when the deleted item was one of them
+    UPDATE stats
+    SET first_timestamp = (SELECT MIN(timestamp) FROM items)
+    WHERE id = 0
+      AND OLD.timestamp <= first_timestamp;
+    UPDATE stats
+    SET last_timestamp = (SELECT MAX(timestamp) FROM items)
+    WHERE id = 0
+      AND OLD.timestamp >= last_timestamp;
+    UPDATE query_stats
+    SET item_count = item_count - 1
+    WHERE query_id = OLD.query_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_queries_delete
+    AFTER DELETE
+    ON queries
+BEGIN
+    DELETE FROM query_stats WHERE query_id = OLD.id;
+END;
+
+UPDATE parameters
+SET value = '1.0.5.8'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,13 @@
+BEGIN TRANSACTION;
+
+-- Items are browsed by (timestamp, item) pages, so the item id is added to the timestamp indexes
+CREATE INDEX IF NOT EXISTS idx_items_timestamp_item ON items (timestamp, item);
+CREATE INDEX IF NOT EXISTS idx_items_query_id_timestamp_item ON items (query_id, timestamp, item);
+DROP INDEX IF EXISTS idx_items_timestamp;
+DROP INDEX IF EXISTS idx_items_query_id_timestamp;
+
+UPDATE parameters
+SET value = '1.0.5.9'
+WHERE key = 'version';
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN TRANSACTION;
+
+-- Send all database writes through a single writer process (applied on restart)
+INSERT OR IGNORE INTO parameters (key, value)
+VALUES ('db_writer_process', 'False');
+
+UPDATE parameters
+SET value = '1.0.5.10'
+WHERE key = 'version';
+
+COMMIT;
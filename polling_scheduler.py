@@ -0,0 +1,194 @@
+import heapq
+import time
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# Bounds of the polling interval of a query (seconds)
+MIN_POLL_INTERVAL = 10
+MAX_POLL_INTERVAL = 3600
+# Weight of the last poll in the arrival rate estimate
+ARRIVAL_RATE_SMOOTHING = 0.3
+# Number of new items a query should find per poll: poll about as often as items arrive
+TARGET_ITEMS_PER_POLL = 1
+
+
+class PollingScheduler:
+    """
+    Decides when each query is polled, from the rate at which it finds new items.
+
+    Each query has an estimate of its arrival rate (new items per second), smoothed over
+    its polls. A query is polled about once per expected new item, within
+    MIN_POLL_INTERVAL and MAX_POLL_INTERVAL, so busy queries are polled often and quiet
+    ones back off. When the intervals ask for more than the global budget of requests
+    per minute, they are all stretched by the same factor.
+
+    The next due time of each query is kept in a priority queue.
+
+    Example:
+        >>> scheduler = PollingScheduler(requests_per_minute=60, default_interval=60)
+        >>> scheduler.sync({1: (None, None)})
+        >>> scheduler.pop_due()
+        [1]
+    """
+
+    def __init__(self, requests_per_minute, default_interval):
+        """
+        Initialize an empty scheduler.
+
+        Args:
+            requests_per_minute (float): The global budget of requests per minute.
+            default_interval (float): The polling interval of a query without history.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.default_interval = default_interval
+        # query_id -> [desired interval, arrival rate, last poll time, next due time]
+        self._queries = {}
+        self._heap = []
+        self._tokens = requests_per_minute / 60
+        self._tokens_updated = time.monotonic()
+
+    def sync(self, polling, now=None):
+        """
+        Add the new queries and drop the removed ones.
+
+        New queries are due right away, with the interval and arrival rate stored
+        for them if any.
+
+        Args:
+            polling (dict): query_id -> (poll_interval, arrival_rate) of all the queries,
+                as returned by db.get_query_polling.
+            now (float, optional): The current monotonic time.
+        """
+        now = time.monotonic() if now is None else now
+        for query_id in set(self._queries) - set(polling):
+            del self._queries[query_id]
+        for query_id, (interval, rate) in polling.items():
+            if query_id not in self._queries:
+                self._queries[query_id] = [
+                    interval or self.default_interval,
+                    rate or 0.0,
+                    None,
+                    now,
+                ]
+                heapq.heappush(self._heap, (now, query_id))
+
+    def pop_due(self, now=None):
+        """
+        Get the queries due for a poll, within the budget of requests.
+
+        Args:
+            now (float, optional): The current monotonic time.
+
+        Returns:
+            list: The ids of the queries to poll now, most overdue first.
+        """
+        now = time.monotonic() if now is None else now
+        # Refill the budget
+        rate = self.requests_per_minute / 60
+        self._tokens = min(
+            self._max_tokens(), self._tokens + (now - self._tokens_updated) * rate
+        )
+        self._tokens_updated = now
+
+        due = []
+        while self._heap and self._heap[0][0] <= now and self._tokens >= 1:
+            due_time, query_id = heapq.heappop(self._heap)
+            state = self._queries.get(query_id)
+            # Skip the entries of removed or rescheduled queries
+            if state is None or state[3] != due_time:
+                continue
+            self._tokens -= 1
+            due.append(query_id)
+        return due
+
+    def charge(self, requests):
+        """
+        Adjust the budget to the requests the polls actually made.
+
+        pop_due takes one token per query. A poll catching up several pages or
+        retrying makes more requests, and coalesced queries share one, so the
+        difference is taken from the budget, or given back to it.
+
+        Args:
+            requests (int): The number of requests made beyond one per query polled,
+                negative if fewer were made.
+        """
+        self._tokens = min(self._max_tokens(), self._tokens - requests)
+
+    def observe(self, query_id, new_items, now=None):
+        """
+        Record the result of a poll and schedule the next one.
+
+        Args:
+            query_id (int): The id of the polled query.
+            new_items (int): The number of new items found by the poll, None if it
+                failed. A failed poll keeps the arrival rate, and the next poll
+                accounts for the whole time since the last successful one.
+            now (float, optional): The current monotonic time.
+
+        Returns:
+            float: The interval until the next poll of the query, in seconds.
+        """
+        now = time.monotonic() if now is None else now
+        state = self._queries.get(query_id)
+        if state is None:
+            return None
+
+        desired_interval, rate, last_poll, _ = state
+        if new_items is not None:
+            # The first poll after a start covers an unknown period, it only seeds the rate
+            if last_poll is not None:
+                sample = new_items / max(now - last_poll, 1)
+                rate = (
+                    ARRIVAL_RATE_SMOOTHING * sample
+                    + (1 - ARRIVAL_RATE_SMOOTHING) * rate
+                )
+                if rate > 0:
+                    desired_interval = TARGET_ITEMS_PER_POLL / rate
+                else:
+                    desired_interval = MAX_POLL_INTERVAL
+                desired_interval = min(
+                    MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, desired_interval)
+                )
+            state[0], state[1], state[2] = desired_interval, rate, now
+
+        interval = self.get_interval(query_id)
+        state[3] = now + interval
+        heapq.heappush(self._heap, (state[3], query_id))
+        return interval
+
+    def get_interval(self, query_id):
+        """
+        Get the interval between two polls of a query, stretched to fit the budget.
+
+        Args:
+            query_id (int): The id of the query.
+
+        Returns:
+            float: The interval in seconds.
+        """
+        return min(MAX_POLL_INTERVAL, self._queries[query_id][0] * self._budget_scale())
+
+    def get_state(self, query_id):
+        """
+        Get the values of a query to store in the database.
+
+        Args:
+            query_id (int): The id of the query.
+
+        Returns:
+            tuple: (poll_interval, arrival_rate)
+        """
+        state = self._queries[query_id]
+        return state[0], state[1]
+
+    def _max_tokens(self):
+        # The budget allows a burst of a few seconds of requests
+        return max(self.requests_per_minute / 60 * 5, 1)
+
+    def _budget_scale(self):
+        # Requests per minute asked by the desired intervals, against the budget
+        demand = sum(60 / state[0] for state in self._queries.values())
+        return max(1.0, demand / self.requests_per_minute)
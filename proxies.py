@@ -1,5 +1,7 @@
+import contextlib
 import random
 import requests
+import threading
 import time
 from requests.exceptions import RequestException
 import concurrent.futures
@@ -13,6 +15,12 @@ logger = get_logger(__name__)
 _PROXY_CACHE = None
 _PROXY_CACHE_INITIALIZED = False
 _SINGLE_PROXY = None
+# Guards the proxy cache when queries are scraped from several threads
+_PROXY_CACHE_LOCK = threading.Lock()
+
+# Semaphores limiting the number of requests in flight through each proxy
+_PROXY_SEMAPHORES = {}
+_PROXY_SEMAPHORES_LOCK = threading.Lock()
 
 # URL to test proxies against
 _TEST_URL = "https://www.vinted.fr/"
@@ -94,6 +102,26 @@ def get_random_proxy() -> Optional[str]:
     Returns:
         Optional[str]: A randomly selected proxy string or None if no working proxies are found.
     """
+    # Only one thread checks the proxies, the others wait for the result
+    with _PROXY_CACHE_LOCK:
+        return _get_random_proxy()
+
+
+def get_proxies() -> List[str]:
+    """
+    Get the proxies in use, checking them first if needed (see get_random_proxy).
+
+    The list is the one cached until the next check, it must not be modified.
+
+    Returns:
+        List[str]: The working proxies, empty if there are none.
+    """
+    with _PROXY_CACHE_LOCK:
+        _get_random_proxy()
+        return _PROXY_CACHE or []
+
+
+def _get_random_proxy() -> Optional[str]:
     global _PROXY_CACHE, _PROXY_CACHE_INITIALIZED, _SINGLE_PROXY
 
     # Import db here to avoid circular imports
@@ -179,6 +207,38 @@ def get_random_proxy() -> Optional[str]:
     return None
 
 
+def proxy_slot(proxy: Optional[str]):
+    """
+    Get a context manager holding one of the request slots of a proxy.
+
+    The number of slots per proxy is the query_concurrency_per_proxy parameter,
+    so concurrent queries don't all go through the same proxy at once.
+
+    Args:
+        proxy (Optional[str]): The proxy the request goes through.
+
+    Returns:
+        A context manager, which blocks until a slot of the proxy is free.
+    """
+    if proxy is None:
+        return contextlib.nullcontext()
+
+    # Import db here to avoid circular imports
+    import db
+
+    limit = int(db.get_parameter("query_concurrency_per_proxy") or 0)
+    if limit <= 0:
+        return contextlib.nullcontext()
+
+    with _PROXY_SEMAPHORES_LOCK:
+        current = _PROXY_SEMAPHORES.get(proxy)
+        # Create a new semaphore when the limit changed
+        if current is None or current[0] != limit:
+            current = (limit, threading.BoundedSemaphore(limit))
+            _PROXY_SEMAPHORES[proxy] = current
+        return current[1]
+
+
 def check_proxy(proxy: str) -> bool:
     """
     Check if a proxy is working by making a request to the test URL.
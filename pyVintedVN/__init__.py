@@ -1,2 +1,3 @@
 from .vinted import Vinted as Vinted
 from .requester import requester as requester
+from .requester import Requester as Requester
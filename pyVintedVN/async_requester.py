@@ -0,0 +1,232 @@
+import asyncio
+import json
+import proxies
+import rate_limiter
+import sys
+import os
+import db
+import random
+import httpx
+from urllib.parse import urlparse
+
+# Add the parent directory to sys.path to import logger
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncRequester:
+    """
+    An asyncio counterpart of Requester, built on httpx.
+
+    It is opt-in: the scraper uses Requester.
+
+    Requests to the same host share the pooled connections of one client, and
+    with HTTP/2 they are multiplexed over a single connection, so one event loop
+    can keep many catalog requests in flight over a few sockets.
+
+    Unlike Requester, it is not configured for a locale: the host and the cookies
+    are taken from the URL of each request, so one instance can serve all locales
+    at the same time. One client is kept per proxy.
+
+    Example:
+        >>> async with AsyncRequester() as requester:
+        ...     response = await requester.get("https://www.vinted.fr/api/v2/catalog/items")
+    """
+
+    def __init__(self, http2=None, max_connections=100, timeout=10, debug=False):
+        """
+        Initialize the AsyncRequester with default headers.
+
+        Args:
+            http2 (bool, optional): Whether to use HTTP/2. Defaults to None, which
+                uses it when the h2 package is installed.
+            max_connections (int, optional): Maximum number of connections per client.
+                Defaults to 100.
+            timeout (float, optional): Timeout of a request in seconds. Defaults to 10.
+            debug (bool, optional): Whether to print debug messages. Defaults to False.
+        """
+        # Get user agents and default headers from the database
+        user_agents_json = db.get_parameter("user_agents")
+        default_headers_json = db.get_parameter("default_headers")
+
+        # Parse JSON strings
+        user_agents = json.loads(user_agents_json) if user_agents_json else []
+        default_headers = (
+            json.loads(default_headers_json) if default_headers_json else {}
+        )
+
+        # The Host header is set by httpx from the URL of each request
+        self.HEADER = {
+            "User-Agent": random.choice(user_agents) if user_agents else "Mozilla/5.0",
+            **(default_headers or {}),
+        }
+        self.HEADER.pop("Host", None)
+        self.MAX_RETRIES = 3
+
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested but the h2 package is not installed")
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2 and HTTP2_AVAILABLE
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.timeout = timeout
+        self.debug = debug
+
+        # One client per proxy, None being the direct connection
+        self._clients = {}
+
+        if self.debug:
+            logger.debug(
+                f"Using User-Agent: {self.HEADER['User-Agent']} (HTTP/2: {self.http2})"
+            )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def _new_client(self, proxy):
+        if proxy is not None and "://" not in proxy:
+            proxy = f"http://{proxy}"
+        return httpx.AsyncClient(
+            headers=self.HEADER,
+            http2=self.http2,
+            limits=self.limits,
+            timeout=self.timeout,
+            proxy=proxy,
+        )
+
+    def _get_client(self, proxy):
+        client = self._clients.get(proxy)
+        if client is None:
+            client = self._clients[proxy] = self._new_client(proxy)
+        return client
+
+    async def _reset_client(self, proxy):
+        client = self._clients.pop(proxy, None)
+        if client is not None:
+            await client.aclose()
+        return self._get_client(proxy)
+
+    async def get(self, url, params=None):
+        """
+        Make a GET request with the same retry logic as Requester.get.
+
+        If a 401 or 404 status code is received, it will attempt to refresh the cookies
+        of the host and retry the request up to MAX_RETRIES times. If it still fails
+        with a 401 or 403, the client is reset once. Requests are paced by rate_limiter,
+        and a 429 status code backs off before retrying.
+
+        Args:
+            url (str): The URL to request
+            params (dict, optional): Query parameters for the request
+
+        Returns:
+            httpx.Response: The response object if successful, or the last response
+
+        Raises:
+            httpx.HTTPError: If the request fails after all retries
+        """
+        # Set a random proxy for this request. The first call checks the proxies,
+        # and the others wait for it, so it runs outside of the event loop.
+        proxy = await asyncio.to_thread(proxies.get_random_proxy)
+        client = self._get_client(proxy)
+        if self.debug and proxy is not None:
+            logger.debug(f"Using proxy: {proxy}")
+
+        # Drop the None values, as requests does
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+
+        tried = 0
+        rate_limited = 0
+        new_session = False
+        while tried < self.MAX_RETRIES:
+            tried += 1
+            # Wait for the rate limiter without blocking the event loop
+            wait = rate_limiter.reserve(url, proxy)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            response = await client.get(url, params=params)
+            if response.status_code == 429:
+                # Every 429 blocks the bucket, the next reservation waits for the delay
+                rate_limited += 1
+                rate_limiter.rate_limited(url, proxy, response.headers, rate_limited)
+                if tried == self.MAX_RETRIES:
+                    return response
+            elif response.status_code in (401, 404) and tried < self.MAX_RETRIES:
+                if self.debug:
+                    logger.debug(f"Cookies invalid retrying {tried}/{self.MAX_RETRIES}")
+                await self.set_cookies(url, client)
+            elif response.status_code == 200:
+                return response
+            elif tried == self.MAX_RETRIES:
+                # New try : if we still get a 401 or 403, we reset the client
+                if response.status_code in (401, 403) and not new_session:
+                    logger.error(
+                        f"Received {response.status_code} error for URL: {url}\n"
+                        f"Response headers: {dict(response.headers)}\n"
+                        f"Response body (first 500 chars): {response.text[:500]}"
+                    )
+                    new_session = True
+                    client = await self._reset_client(proxy)
+                    if self.debug:
+                        logger.debug(
+                            f"Client reset due to {response.status_code} error"
+                        )
+                    tried = 0
+                    continue
+                return response
+
+        # This should only happen if the loop exits without returning
+        raise httpx.HTTPError(
+            f"Failed to get a valid response after {self.MAX_RETRIES} attempts"
+        )
+
+    async def set_cookies(self, url, client=None):
+        """
+        Reset and fetch new cookies for the host of a URL.
+
+        As Requester.set_cookies, only the session cookies are cleared, and only
+        those of that host, so the other locales keep theirs.
+
+        Args:
+            url (str): A URL of the host
+            client (httpx.AsyncClient, optional): The client to refresh.
+                Defaults to the direct connection client.
+        """
+        if client is None:
+            client = self._get_client(None)
+        host = urlparse(url).netloc
+        for cookie in list(client.cookies.jar):
+            if cookie.discard and cookie.domain.lstrip(".") in host:
+                client.cookies.jar.clear(cookie.domain, cookie.path, cookie.name)
+        try:
+            await client.head(f"https://{host}/")
+            if self.debug:
+                logger.debug("Cookies set!")
+        except httpx.HTTPError:
+            if self.debug:
+                logger.error(
+                    "There was an error fetching cookies for vinted", exc_info=True
+                )
+
+    async def aclose(self):
+        """
+        Close the connections of all the clients.
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
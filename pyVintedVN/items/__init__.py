@@ -1 +1,2 @@
 from pyVintedVN.items.items import Items as Items
+from pyVintedVN.items.async_items import AsyncItems as AsyncItems
@@ -0,0 +1,61 @@
+from pyVintedVN.items.item import Item
+from pyVintedVN.items.items import Items
+from typing import List, Dict, Optional
+
+
+class AsyncItems(Items):
+    """
+    An asyncio counterpart of Items, searching through an AsyncRequester.
+
+    Many searches can run concurrently on one event loop, on any mix of locales,
+    since the requester takes the host of each request from its URL.
+
+    Example:
+        >>> async with AsyncRequester() as requester:
+        ...     items = AsyncItems(requester)
+        ...     results = await asyncio.gather(*(items.search(url) for url in urls))
+    """
+
+    def __init__(self, requester):
+        """
+        Initialize the AsyncItems class.
+
+        Args:
+            requester (AsyncRequester): The requester used for the API calls.
+        """
+        self.requester = requester
+
+    async def search(
+        self,
+        url: str,
+        nbr_items: int = 20,
+        page: int = 1,
+        time: Optional[int] = None,
+        json: bool = False,
+        params: Optional[Dict] = None,
+    ) -> List[Item]:
+        """
+        Retrieve items from a given search URL on Vinted.
+
+        Args:
+            url (str): The URL of the search on Vinted.
+            nbr_items (int, optional): Number of items to be returned. Defaults to 20.
+            page (int, optional): Page number to be returned. Defaults to 1.
+            time (int, optional): Timestamp to filter items by time. Defaults to None.
+            json (bool, optional): Whether to return raw JSON data instead of Item objects.
+                Defaults to False.
+            params (Dict, optional): API parameters already parsed from the URL, without
+                page, per_page and time. Defaults to None.
+
+        Returns:
+            List[Item]: A list of Item objects.
+
+        Raises:
+            httpx.HTTPStatusError: If the request to the Vinted API fails.
+        """
+        _, api_url, params = self._prepare_request(url, nbr_items, page, time, params)
+
+        # Make the request to the Vinted API
+        response = await self.requester.get(url=api_url, params=params)
+        response.raise_for_status()
+        return self._parse_response(response, json)
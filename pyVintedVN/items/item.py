@@ -1,13 +1,36 @@
+import time
+from collections import namedtuple
 from datetime import datetime, timezone
 
+# The fields of an item needed once it has been scraped, see Item.to_record
+ItemRecord = namedtuple(
+    "ItemRecord",
+    (
+        "id",
+        "raw_timestamp",
+        "title",
+        "price",
+        "currency",
+        "brand_title",
+        "photo",
+        "url",
+        "user_id",
+    ),
+)
+
 
 class Item:
     """
     Represents a single item from Vinted.
 
-    This class parses and stores various attributes of a Vinted item,
+    This class gives access to various attributes of a Vinted item,
     such as id, title, brand, size, price, etc.
 
+    The attributes are read from the raw data when they are accessed, and the
+    ones that need some work (created_at_ts, buy_url) are only computed on demand.
+    Items use __slots__, so building the items of a page costs little more than
+    decoding it.
+
     Attributes:
         raw_data (dict): The raw data of the item as received from the API.
         id (str): The unique identifier of the item.
@@ -22,6 +45,8 @@ class Item:
         raw_timestamp (int): The raw timestamp value from the API.
     """
 
+    __slots__ = ("raw_data", "_created_at_ts")
+
     def __init__(self, data):
         """
         Initialize an Item with data from the Vinted API.
@@ -30,28 +55,87 @@ class Item:
             data (dict): The item data from the Vinted API.
         """
         self.raw_data = data
-        self.id = data["id"]
-        self.title = data["title"]
-        self.brand_title = data["brand_title"]
-        try:
-            self.size_title = data["size_title"]
-        except KeyError:
-            # If size_title is not available, set it to None
-            self.size_title = None
-        self.currency = data["price"]["currency_code"]
-        self.price = data["price"]["amount"]
-        self.photo = data["photo"]["url"]
-        self.url = data["url"]
+        self._created_at_ts = None
+
+    @property
+    def id(self):
+        return self.raw_data["id"]
+
+    @property
+    def title(self):
+        return self.raw_data["title"]
+
+    @property
+    def brand_title(self):
+        return self.raw_data["brand_title"]
+
+    @property
+    def size_title(self):
+        # If size_title is not available, it is None
+        return self.raw_data.get("size_title")
+
+    @property
+    def currency(self):
+        return self.raw_data["price"]["currency_code"]
+
+    @property
+    def price(self):
+        return self.raw_data["price"]["amount"]
+
+    @property
+    def photo(self):
+        return self.raw_data["photo"]["url"]
+
+    @property
+    def url(self):
+        return self.raw_data["url"]
+
+    @property
+    def buy_url(self):
         # We keep everything before the "items"
-        self.buy_url = (
-            data["url"].split("items")[0]
+        return (
+            self.raw_data["url"].split("items")[0]
             + "transaction/buy/new?source_screen=item&transaction%5Bitem_id%5D="
-            + str(data["id"])
+            + str(self.raw_data["id"])
         )
-        self.created_at_ts = datetime.fromtimestamp(
-            data["photo"]["high_resolution"]["timestamp"], tz=timezone.utc
+
+    @property
+    def raw_timestamp(self):
+        return self.raw_data["photo"]["high_resolution"]["timestamp"]
+
+    @property
+    def created_at_ts(self):
+        if self._created_at_ts is None:
+            self._created_at_ts = datetime.fromtimestamp(
+                self.raw_timestamp, tz=timezone.utc
+            )
+        return self._created_at_ts
+
+    def to_record(self):
+        """
+        Get the fields of this item needed to process it, without the raw data.
+
+        The record is a plain tuple in the order of ItemRecord, so lists of records
+        are small and fast to pickle when they are sent to another process.
+        Use ItemRecord._make to access its fields by name.
+
+        Returns:
+            tuple: (id, raw_timestamp, title, price, currency, brand_title, photo, url, user_id)
+        """
+        data = self.raw_data
+        photo = data["photo"]
+        price = data["price"]
+        return (
+            data["id"],
+            photo["high_resolution"]["timestamp"],
+            data["title"],
+            price["amount"],
+            price["currency_code"],
+            data["brand_title"],
+            photo["url"],
+            data["url"],
+            data["user"]["id"],
         )
-        self.raw_timestamp = data["photo"]["high_resolution"]["timestamp"]
 
     def __eq__(self, other):
         """
@@ -95,8 +179,7 @@ class Item:
         Returns:
             bool: True if the item is new, False otherwise.
         """
-        delta = datetime.now(timezone.utc) - self.created_at_ts
-        return delta.total_seconds() < minutes * 60
+        return time.time() - self.raw_timestamp < minutes * 60
 
     # Alias for backward compatibility
     isNewItem = is_new_item
@@ -1,10 +1,17 @@
+import hashlib
 from pyVintedVN.items.item import Item
-from pyVintedVN.requester import requester
+from pyVintedVN.requester import Requester, requester as default_requester
 from urllib.parse import urlparse, parse_qsl
 from requests.exceptions import HTTPError
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from pyVintedVN.settings import Urls
 
+# orjson decodes the API responses several times faster, it is used when installed
+try:
+    from orjson import loads as decode_json
+except ImportError:
+    from json import loads as decode_json
+
 
 class Items:
     """
@@ -18,6 +25,17 @@ class Items:
         >>> results = items.search("https://www.vinted.fr/catalog?search_text=shoes")
     """
 
+    def __init__(self, requester: Optional[Requester] = None):
+        """
+        Initialize the Items class.
+
+        Args:
+            requester (Requester, optional): The requester used for the API calls.
+                Defaults to the shared requester. Threads searching concurrently
+                need their own, since a requester is configured for one locale at a time.
+        """
+        self.requester = requester if requester is not None else default_requester
+
     def search(
         self,
         url: str,
@@ -25,6 +43,7 @@ class Items:
         page: int = 1,
         time: Optional[int] = None,
         json: bool = False,
+        params: Optional[Dict] = None,
     ) -> List[Item]:
         """
         Retrieve items from a given search URL on Vinted.
@@ -36,6 +55,8 @@ class Items:
             time (int, optional): Timestamp to filter items by time. Defaults to None. Looks like it doesn't work though.
             json (bool, optional): Whether to return raw JSON data instead of Item objects.
                 Defaults to False.
+            params (Dict, optional): API parameters already parsed from the URL, without
+                page, per_page and time. Skips parsing the URL on every call. Defaults to None.
 
         Returns:
             List[Item]: A list of Item objects.
@@ -43,36 +64,99 @@ class Items:
         Raises:
             HTTPError: If the request to the Vinted API fails.
         """
-        # Extract the domain from the URL and set the locale
-        locale = urlparse(url).netloc
-        requester.set_locale(locale)
-
-        # Parse the URL to get the API parameters
-        params = self.parse_url(url, nbr_items, page, time)
-
-        # Construct the API URL
-        api_url = (
-            f"https://{locale}{Urls.VINTED_API_URL}/{Urls.VINTED_PRODUCTS_ENDPOINT}"
+        locale, api_url, params = self._prepare_request(
+            url, nbr_items, page, time, params
         )
+        # Set the locale of the requester
+        self.requester.set_locale(locale)
 
         try:
             # Make the request to the Vinted API
-            response = requester.get(url=api_url, params=params)
+            response = self.requester.get(url=api_url, params=params)
             response.raise_for_status()
-
-            # Parse the response
-            items = response.json()
-            items = items["items"]
-
-            # Return either Item objects or raw JSON data
-            if not json:
-                return [Item(_item) for _item in items]
-            else:
-                return items
+            return self._parse_response(response, json)
 
         except HTTPError as err:
             raise err
 
+    def search_changes(
+        self,
+        url: str,
+        fingerprint: Optional[Tuple] = None,
+        nbr_items: int = 20,
+        page: int = 1,
+        params: Optional[Dict] = None,
+    ) -> Tuple[Optional[List[Item]], Tuple]:
+        """
+        Retrieve items from a given search URL on Vinted, unless they are the same as
+        the last time.
+
+        The fingerprint of a page is the hash of the response body and the ordered ids of
+        its items. When the body is identical, it isn't even decoded. When only the ids
+        are identical (e.g. a view count changed), no Item is built.
+
+        Args:
+            url (str): The URL of the search on Vinted.
+            fingerprint (Tuple, optional): The fingerprint returned by the previous call
+                for this search. Defaults to None.
+            nbr_items (int, optional): Number of items to be returned. Defaults to 20.
+            page (int, optional): Page number to be returned. Defaults to 1.
+            params (Dict, optional): API parameters already parsed from the URL, see search.
+                Defaults to None.
+
+        Returns:
+            Tuple: (items, fingerprint). items is None if the page didn't change.
+
+        Raises:
+            HTTPError: If the request to the Vinted API fails.
+        """
+        locale, api_url, params = self._prepare_request(
+            url, nbr_items, page, None, params
+        )
+        # Set the locale of the requester
+        self.requester.set_locale(locale)
+
+        response = self.requester.get(url=api_url, params=params)
+        response.raise_for_status()
+
+        body_hash = hashlib.blake2b(response.content, digest_size=16).digest()
+        if fingerprint is not None and body_hash == fingerprint[0]:
+            return None, fingerprint
+
+        items = decode_json(response.content)["items"]
+        item_ids = tuple(item["id"] for item in items)
+        if fingerprint is not None and item_ids == fingerprint[1]:
+            return None, (body_hash, item_ids)
+        return [Item(_item) for _item in items], (body_hash, item_ids)
+
+    def _prepare_request(self, url, nbr_items, page, time, params):
+        # Extract the domain from the URL
+        locale = urlparse(url).netloc
+
+        # Parse the URL to get the API parameters, unless they were precompiled
+        if params is None:
+            params = self.parse_url(url, nbr_items, page, time)
+        else:
+            params = dict(params, page=page, per_page=nbr_items, time=time)
+
+        # Construct the API URL
+        api_url = (
+            f"https://{locale}{Urls.VINTED_API_URL}/{Urls.VINTED_PRODUCTS_ENDPOINT}"
+        )
+        return locale, api_url, params
+
+    @staticmethod
+    def _parse_response(response, json):
+        # Parse the response
+        items = decode_json(response.content)
+        items = items["items"]
+
+        # Return either Item objects or raw JSON data
+        if not json:
+            return [Item(_item) for _item in items]
+        else:
+            return items
+
     def parse_url(
         self, url: str, nbr_items: int = 20, page: int = 1, time: Optional[int] = None
     ) -> Dict:
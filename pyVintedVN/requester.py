@@ -1,10 +1,16 @@
 import json
 import proxies
+import rate_limiter
 import sys
 import os
 import db
 import random
 import requests
+import threading
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
 from requests.exceptions import HTTPError
 
 # Add the parent directory to sys.path to import logger
@@ -14,6 +20,382 @@ from logger import get_logger
 # Get logger for this module
 logger = get_logger(__name__)
 
+# Cookies are refreshed this many seconds before they expire
+COOKIE_REFRESH_MARGIN = 300
+# Lifetime given to cookies without an expiry date (seconds)
+COOKIE_LIFETIME = 3600
+# Interval between two checks of the cookie expiry dates (seconds)
+COOKIE_CHECK_INTERVAL = 60
+
+# Connection pools of a session: hosts kept, and keep-alive connections per host.
+# A session only talks to one Vinted domain through one proxy, and every scraper
+# thread of the process may use it at the same time.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+
+# Session pool of this process, and the thread refreshing its cookies
+_SESSION_POOL = None
+_SESSION_POOL_PID = None
+_SESSION_POOL_LOCK = threading.Lock()
+_COOKIE_REFRESHER = None
+_COOKIE_REFRESHER_LOCK = threading.Lock()
+
+
+class SessionPool:
+    """
+    The requests sessions of a process, one per locale and proxy.
+
+    A session is bound to its proxy for its whole life, so its keep-alive
+    connections are reused by every request routed to it, and its cookies are only
+    ever sent from the IP they were issued to. The sessions are shared by all the
+    Requester instances of the process, so the scraper threads share the connections
+    instead of each opening its own. With many proxies, the requests to a locale only
+    rotate over some of them, see pick_proxy, so the requests don't each close a
+    session to make room for their own.
+
+    The cookies of the sessions are stored in the database, so a restarted process
+    picks them up instead of fetching new ones. Once a request was made, a background
+    thread fetches new cookies for the sessions shortly before theirs expire.
+    """
+
+    # Maximum number of sessions kept, the least recently used ones are closed first
+    MAX_SESSIONS = 256
+    # Number of proxies the requests to a locale rotate over, see pick_proxy
+    PROXIES_PER_LOCALE = 32
+
+    def __init__(self):
+        """
+        Initialize an empty pool with the headers stored in the database.
+        """
+        self._sessions = OrderedDict()
+        # Sessions created without fetching their cookies, they are warmed on first request
+        self._cold_sessions = set()
+        # Sessions whose cookies are being fetched, the other threads wait for them
+        self._warming = {}
+        # When the cookies of each session expire, see _save_cookies
+        self._cookie_expiry = {}
+        # The proxies in use when the last one was picked, see pick_proxy
+        self._proxies = None
+        self._lock = threading.Lock()
+        self._load_headers()
+
+    def _load_headers(self):
+        # Get user agents and default headers from the database
+        user_agents_json = db.get_parameter("user_agents")
+        default_headers_json = db.get_parameter("default_headers")
+        self._headers_source = (user_agents_json, default_headers_json)
+
+        # Parse JSON strings
+        self._user_agents = json.loads(user_agents_json) if user_agents_json else []
+        self._default_headers = (
+            json.loads(default_headers_json) if default_headers_json else {}
+        )
+
+    def check_headers(self):
+        """
+        Drop the sessions if the user agents or the default headers were changed.
+        """
+        if self._headers_source != (
+            db.get_parameter("user_agents"),
+            db.get_parameter("default_headers"),
+        ):
+            self.close()
+            self._load_headers()
+
+    def pick_proxy(self, locale):
+        """
+        Pick the proxy of a request to a locale.
+
+        With up to PROXIES_PER_LOCALE proxies, any of them may be picked. With more,
+        the requests to a locale rotate over the proxies it already has a session for,
+        so they reuse their connections and cookies instead of each opening a new
+        session. A proxy is replaced when its session is discarded, or when it is no
+        longer in use after the proxies were checked again.
+
+        Args:
+            locale (str): The locale domain (e.g., 'www.vinted.fr')
+
+        Returns:
+            str: The proxy, or None for a direct connection
+        """
+        proxy_list = proxies.get_proxies()
+        if proxy_list is not self._proxies and proxy_list != self._proxies:
+            self._update_proxies(proxy_list)
+        if not proxy_list:
+            return None
+        if len(proxy_list) > self.PROXIES_PER_LOCALE:
+            with self._lock:
+                pooled = [
+                    proxy
+                    for session_locale, proxy in self._sessions
+                    if session_locale == locale and proxy is not None
+                ]
+            if len(pooled) >= self.PROXIES_PER_LOCALE:
+                return random.choice(pooled)
+        return random.choice(proxy_list)
+
+    def _update_proxies(self, proxy_list):
+        # Drop the sessions and the stored cookies of the proxies no longer in use
+        self._proxies = proxy_list
+        kept = set(proxy_list)
+        with self._lock:
+            gone = [
+                key
+                for key in self._sessions
+                if key[1] is not None and key[1] not in kept
+            ]
+            for key in gone:
+                self._drop(key)
+        db.delete_stale_cookie_jars(proxy_list)
+
+    def get(self, locale, proxy, warm=True):
+        """
+        Get the session of a locale and a proxy, creating it if needed.
+
+        Args:
+            locale (str): The locale domain (e.g., 'www.vinted.fr')
+            proxy (str, optional): The proxy of the session, None for a direct connection
+            warm (bool, optional): Whether to fetch the cookies of a new session right away.
+                Defaults to True.
+
+        Returns:
+            requests.Session: The session
+        """
+        key = (locale, proxy)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+
+        if session is None:
+            # Start from the stored cookies, unless they are about to expire
+            # or were issued to a User-Agent that was removed since.
+            # They are read without holding the lock, the other sessions stay usable.
+            jar = db.get_cookie_jar(locale, proxy)
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    if (
+                        jar
+                        and jar[2] > time.time() + COOKIE_REFRESH_MARGIN
+                        and (not self._user_agents or jar[0] in self._user_agents)
+                    ):
+                        session = self._new_session(locale, proxy, jar[0])
+                        self._load_cookies(session, jar[1])
+                        self._cookie_expiry[key] = jar[2]
+                    else:
+                        session = self._new_session(locale, proxy)
+                        self._cold_sessions.add(key)
+                    self._sessions[key] = session
+                    while len(self._sessions) > self.MAX_SESSIONS:
+                        self._drop(next(iter(self._sessions)))
+
+        with self._lock:
+            warming = self._warming.get(key)
+            cold = warm and warming is None and key in self._cold_sessions
+            if cold:
+                self._cold_sessions.discard(key)
+                warming = self._warming[key] = threading.Event()
+
+        if cold:
+            try:
+                self.fetch_cookies(session, locale, proxy)
+            finally:
+                with self._lock:
+                    del self._warming[key]
+                warming.set()
+        elif warm and warming is not None:
+            # Another thread is fetching the cookies of the session
+            warming.wait(timeout=10)
+        return session
+
+    def _drop(self, key):
+        # Close a session, the lock must be held
+        session = self._sessions.pop(key)
+        self._cold_sessions.discard(key)
+        self._cookie_expiry.pop(key, None)
+        session.close()
+
+    def discard(self, locale, proxy):
+        """
+        Close the session of a locale and a proxy, if there is one.
+
+        Args:
+            locale (str): The locale domain (e.g., 'www.vinted.fr')
+            proxy (str, optional): The proxy of the session, None for a direct connection
+        """
+        with self._lock:
+            if (locale, proxy) in self._sessions:
+                self._drop((locale, proxy))
+
+    def _new_session(self, locale, proxy, user_agent=None):
+        session = requests.Session()
+        session.headers.update(
+            {
+                # Grabs a user agent from the database, kept for the whole life of the session
+                "User-Agent": user_agent
+                or (
+                    random.choice(self._user_agents)
+                    if self._user_agents
+                    else "Mozilla/5.0"
+                ),
+                **(self._default_headers or {}),
+                "Host": f"{locale}",
+            }
+        )
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # configure_proxy picks a random proxy when given None, a direct session has none
+        if proxy is not None:
+            proxies.configure_proxy(session, proxy)
+        logger.debug(
+            f"New session for {locale} (proxy: {proxy}) "
+            f"with User-Agent: {session.headers['User-Agent']}"
+        )
+        return session
+
+    def reset(self, locale, proxy):
+        """
+        Replace the session of a locale and a proxy with a new one, keeping its
+        User-Agent but not its cookies.
+
+        Args:
+            locale (str): The locale domain (e.g., 'www.vinted.fr')
+            proxy (str, optional): The proxy of the session, None for a direct connection
+
+        Returns:
+            requests.Session: The new session
+        """
+        key = (locale, proxy)
+        with self._lock:
+            old_session = self._sessions.pop(key, None)
+            user_agent = old_session.headers["User-Agent"] if old_session else None
+            if old_session is not None:
+                old_session.close()
+            session = self._new_session(locale, proxy, user_agent)
+            self._sessions[key] = session
+            self._cold_sessions.discard(key)
+            self._cookie_expiry.pop(key, None)
+        return session
+
+    def fetch_cookies(self, session, locale, proxy):
+        """
+        Fetch the cookies of a session from the home page of its locale, and store them.
+
+        Args:
+            session (requests.Session): The session
+            locale (str): The locale domain (e.g., 'www.vinted.fr')
+            proxy (str, optional): The proxy of the session, None for a direct connection
+
+        Returns:
+            bool: True if the cookies were fetched
+        """
+        try:
+            session.head(f"https://{locale}/")
+            logger.debug("Cookies set!")
+        except Exception:
+            logger.debug(
+                "There was an error fetching cookies for vinted", exc_info=True
+            )
+            return False
+        self._save_cookies(session, locale, proxy)
+        return True
+
+    def _save_cookies(self, session, locale, proxy):
+        # Store the cookies of a session, and when the first of them expires
+        now = time.time()
+        cookies = [cookie for cookie in session.cookies if not cookie.is_expired(now)]
+        expires = min(
+            (cookie.expires for cookie in cookies if cookie.expires),
+            default=now + COOKIE_LIFETIME,
+        )
+        self._cookie_expiry[(locale, proxy)] = expires
+        db.save_cookie_jar(
+            locale,
+            proxy,
+            session.headers["User-Agent"],
+            json.dumps(
+                [
+                    {
+                        "name": cookie.name,
+                        "value": cookie.value,
+                        "domain": cookie.domain,
+                        "path": cookie.path,
+                        "expires": cookie.expires,
+                        "secure": cookie.secure,
+                    }
+                    for cookie in cookies
+                ]
+            ),
+            expires,
+        )
+
+    @staticmethod
+    def _load_cookies(session, cookies):
+        for cookie in json.loads(cookies):
+            session.cookies.set_cookie(create_cookie(**cookie))
+
+    def refresh_cookies(self):
+        """
+        Fetch new cookies for the sessions whose cookies are about to expire.
+
+        The cookies are fetched with a new session using the same User-Agent and proxy,
+        then copied over, so requests in flight never see an empty cookie jar.
+        Called by the cookie refresher thread.
+        """
+        now = time.time()
+        with self._lock:
+            expiring = [
+                (key, session)
+                for key, session in self._sessions.items()
+                if key in self._cookie_expiry
+                and self._cookie_expiry[key] - now < COOKIE_REFRESH_MARGIN
+            ]
+        for (locale, proxy), session in expiring:
+            fresh_session = self._new_session(
+                locale, proxy, session.headers["User-Agent"]
+            )
+            try:
+                fresh_session.head(f"https://{locale}/")
+                session.cookies.update(fresh_session.cookies)
+                self._save_cookies(session, locale, proxy)
+                logger.debug(f"Cookies refreshed for {locale} (proxy: {proxy})")
+            except Exception as e:
+                logger.warning(f"Could not refresh the cookies for {locale}: {e}")
+            finally:
+                fresh_session.close()
+
+    def close(self):
+        """
+        Close all the sessions.
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._cold_sessions.clear()
+            self._cookie_expiry.clear()
+
+
+def get_session_pool():
+    """
+    Get the session pool of this process, creating it on first use.
+    A forked process gets its own pool, the connections of its parent aren't reused.
+
+    Returns:
+        SessionPool: The session pool
+    """
+    global _SESSION_POOL, _SESSION_POOL_PID
+    if _SESSION_POOL is None or _SESSION_POOL_PID != os.getpid():
+        with _SESSION_POOL_LOCK:
+            if _SESSION_POOL is None or _SESSION_POOL_PID != os.getpid():
+                _SESSION_POOL = SessionPool()
+                _SESSION_POOL_PID = os.getpid()
+    return _SESSION_POOL
+
 
 class Requester:
     """
@@ -21,6 +403,10 @@ class Requester:
 
     This class manages session headers, cookies, and provides methods for making
     HTTP requests with retry logic for handling authentication issues.
+
+    Each request is routed to the session of the locale and of the proxy picked for
+    it, see SessionPool. Switching between locales or proxies reuses the sessions
+    and their connections instead of reconfiguring a single one.
     """
 
     def __init__(self, debug=False):
@@ -33,96 +419,86 @@ class Requester:
         Args:
             debug (bool, optional): Whether to print debug messages. Defaults to False.
         """
-
-        # Add the parent directory to sys.path to import db
-        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        import db
-
-        # Get user agents and default headers from the database
-        user_agents_json = db.get_parameter("user_agents")
-        default_headers_json = db.get_parameter("default_headers")
-
-        # Parse JSON strings
-        user_agents = json.loads(user_agents_json) if user_agents_json else []
-        default_headers = (
-            json.loads(default_headers_json) if default_headers_json else {}
-        )
-
-        self.HEADER = {
-            # Grabs a user agent from the database
-            "User-Agent": random.choice(user_agents) if user_agents else "Mozilla/5.0",
-            **(default_headers or {}),
-            "Host": "www.vinted.fr",
-        }
-        self.VINTED_AUTH_URL = "https://www.vinted.fr/"
         self.MAX_RETRIES = 3
-        self.session = requests.Session()
-        self.session.headers.update(self.HEADER)
         self.debug = debug
-
-        if self.debug:
-            logger.debug(f"Using User-Agent: {self.HEADER['User-Agent']}")
+        self.proxy = None
+        self.set_locale("www.vinted.fr")
 
     def set_locale(self, locale):
         """
         Set the locale of the requester.
 
-        Updates the authentication URL and headers to use the specified locale.
+        Switches to the sessions of the specified locale. They are created on first use,
+        without any request until the first one is made through them, and they are
+        dropped when the user agents or the default headers are changed.
 
         Args:
             locale (str): The locale domain to use (e.g., 'www.vinted.fr', 'www.vinted.de')
         """
-        self.VINTED_AUTH_URL = f"https://{locale}/"
-        # Get user agents and default headers from the database
-        user_agents_json = db.get_parameter("user_agents")
-        default_headers_json = db.get_parameter("default_headers")
-
-        # Parse JSON strings
-        user_agents = json.loads(user_agents_json) if user_agents_json else []
-        default_headers = (
-            json.loads(default_headers_json) if default_headers_json else {}
-        )
+        get_session_pool().check_headers()
 
-        self.HEADER = {
-            "User-Agent": random.choice(user_agents) if user_agents else "Mozilla/5.0",
-            **(default_headers or {}),
-            "Host": f"{locale}",
-        }
-        self.session.headers.update(self.HEADER)
+        self.locale = locale
+        self.VINTED_AUTH_URL = f"https://{locale}/"
+        self.proxy = None
+        self.session = get_session_pool().get(locale, None, warm=False)
+        self.HEADER = dict(self.session.headers)
         if self.debug:
             logger.debug(
                 f"Locale set to {locale} with User-Agent: {self.HEADER['User-Agent']}"
             )
 
-    def get(self, url, params=None):
+    def get(self, url, params=None, max_wait=None):
         """
         Make a GET request with retry logic.
 
         If a 401 status code is received, it will attempt to refresh cookies
-        and retry the request up to MAX_RETRIES times.
+        and retry the request up to MAX_RETRIES times. Requests are paced by
+        rate_limiter, and a 429 status code backs off before retrying.
 
         Args:
             url (str): The URL to request
             params (dict, optional): Query parameters for the request
+            max_wait (float, optional): Maximum number of seconds to wait for the rate
+                limiter before each try. Defaults to None, no limit.
 
         Returns:
             requests.Response: The response object if successful
 
         Raises:
-            HTTPError: If the request fails after all retries
+            HTTPError: If the request fails after all retries, or would have waited
+                longer than max_wait
         """
 
-        # Set a random proxy for this request
-        proxy_configured = proxies.configure_proxy(self.session)
-        if self.debug and proxy_configured:
+        # Pick a proxy for this request, and use the session of the locale through it
+        proxy = self.proxy = get_session_pool().pick_proxy(self.locale)
+        self.session = get_session_pool().get(self.locale, proxy)
+        _start_cookie_refresher()
+        if self.debug and proxy is not None:
             logger.debug(f"Using proxy: {self.session.proxies}")
 
         tried = 0
+        rate_limited = 0
         new_session = False
         while tried < self.MAX_RETRIES:
             tried += 1
-            with self.session.get(url, params=params) as response:
-                if response.status_code in (401, 404) and tried < self.MAX_RETRIES:
+            # Wait for the rate limiter, then for a free slot on the proxy, see proxies.proxy_slot
+            if not rate_limiter.acquire(url, proxy, max_wait):
+                raise HTTPError(
+                    f"Rate limited, not waiting more than {max_wait} seconds for {url}"
+                )
+            with proxies.proxy_slot(proxy), self.session.get(
+                url, params=params
+            ) as response:
+                if response.status_code == 429:
+                    # Every 429 blocks the bucket, the next acquire of any thread
+                    # waits for the delay asked by Vinted
+                    rate_limited += 1
+                    rate_limiter.rate_limited(
+                        url, proxy, response.headers, rate_limited
+                    )
+                    if tried == self.MAX_RETRIES:
+                        return response
+                elif response.status_code in (401, 404) and tried < self.MAX_RETRIES:
                     print(f"Cookies invalid, retrying {tried}/{self.MAX_RETRIES}")
                     if self.debug:
                         logger.debug(
@@ -145,10 +521,11 @@ class Requester:
                         )
 
                         new_session = True
-                        self.session = requests.Session()
-                        self.session.headers.update(self.HEADER)
-                        # proxy
-                        proxy_configured = proxies.configure_proxy(self.session)
+                        # Switch to another proxy, the failing one may be blocked
+                        if proxy is not None:
+                            get_session_pool().discard(self.locale, proxy)
+                        proxy = self.proxy = get_session_pool().pick_proxy(self.locale)
+                        self.session = get_session_pool().reset(self.locale, proxy)
                         if self.debug:
                             logger.debug(
                                 f"Session reset due to {response.status_code} error"
@@ -176,9 +553,11 @@ class Requester:
         Raises:
             HTTPError: If the request fails
         """
-        # Set a random proxy for this request
-        proxy_configured = proxies.configure_proxy(self.session)
-        if self.debug and proxy_configured:
+        # Pick a proxy for this request
+        proxy = self.proxy = get_session_pool().pick_proxy(self.locale)
+        self.session = get_session_pool().get(self.locale, proxy)
+        _start_cookie_refresher()
+        if self.debug and proxy is not None:
             logger.debug(f"Using proxy: {self.session.proxies}")
 
         response = self.session.post(url, params)
@@ -190,18 +569,11 @@ class Requester:
         Reset and fetch new cookies for authentication.
 
         Clears the current session cookies and makes a HEAD request to
-        the Vinted authentication URL to get new cookies.
+        the Vinted authentication URL to get new cookies. The sessions of
+        the other locales keep their cookies.
         """
         self.session.cookies.clear_session_cookies()
-        try:
-            self.session.head(self.VINTED_AUTH_URL)
-            if self.debug:
-                logger.debug("Cookies set!")
-        except Exception:
-            if self.debug:
-                logger.error(
-                    "There was an error fetching cookies for vinted", exc_info=True
-                )
+        get_session_pool().fetch_cookies(self.session, self.locale, self.proxy)
 
     def update_cookies(self, cookies: dict):
         """
@@ -214,10 +586,39 @@ class Requester:
         if self.debug:
             logger.debug(f"Cookies manually updated ({len(cookies)} cookies received)")
 
+    def close(self):
+        """
+        Close all the sessions of the process.
+        """
+        get_session_pool().close()
+
     # Alias for backward compatibility
     setLocale = set_locale
     setCookies = set_cookies
 
 
+def _refresh_cookies_forever():
+    while True:
+        time.sleep(COOKIE_CHECK_INTERVAL)
+        try:
+            get_session_pool().refresh_cookies()
+        except Exception as e:
+            logger.error(f"Error refreshing cookies: {e}", exc_info=True)
+
+
+def _start_cookie_refresher():
+    # Start the refresher thread of this process, if it isn't running yet.
+    # A forked process doesn't inherit the thread of its parent, it starts its own.
+    global _COOKIE_REFRESHER
+    if _COOKIE_REFRESHER is not None and _COOKIE_REFRESHER.is_alive():
+        return
+    with _COOKIE_REFRESHER_LOCK:
+        if _COOKIE_REFRESHER is None or not _COOKIE_REFRESHER.is_alive():
+            _COOKIE_REFRESHER = threading.Thread(
+                target=_refresh_cookies_forever, name="cookie_refresher", daemon=True
+            )
+            _COOKIE_REFRESHER.start()
+
+
 # Singleton instance of the Requester class
 requester = Requester()
@@ -16,12 +16,14 @@ class Vinted:
         >>> items = vinted.items.search("https://www.vinted.fr/catalog?search_text=shoes")
     """
 
-    def __init__(self):
+    def __init__(self, requester=None):
         """
         Initialize the Vinted class with optional proxy settings.
 
-        Args: None
+        Args:
+            requester (Requester, optional): The requester used for the API calls.
+                Defaults to the shared requester.
         """
 
         # Initialize Items instance for searching Vinted listings
-        self.items = Items()
+        self.items = Items(requester)
@@ -0,0 +1,160 @@
+import json
+from urllib.parse import urlparse
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# API parameters that may differ between coalesced queries, and the item fields they filter on
+COALESCIBLE_PARAMETERS = {
+    "brand_ids": ("brand_id",),
+    "size_ids": ("size_id",),
+    "color_ids": ("color1_id", "color2_id"),
+}
+# Maximum number of items Vinted returns per page
+MAX_ITEMS_PER_PAGE = 96
+
+# Parameters whose item fields turned out to be missing from the API results.
+# Queries filtering on them are not coalesced anymore.
+_UNSUPPORTED_PARAMETERS = set()
+
+
+class QueryGroup:
+    """
+    Queries sent to Vinted as a single catalog request.
+
+    A group of one query is scraped as usual. The queries of a larger group share the
+    same locale and API parameters, except for the COALESCIBLE_PARAMETERS. The request
+    uses the union of their values, and the items returned are routed to each query
+    by checking its own values locally.
+
+    Attributes:
+        queries (list): The queries, as returned by db.get_queries.
+        params (dict): The API parameters of the request, None for a group of one query.
+        filters (dict): query_id -> {parameter: set of accepted values}. A parameter
+            missing from the dict accepts every value.
+    """
+
+    def __init__(self, queries, params=None, filters=None):
+        self.queries = queries
+        self.params = params
+        self.filters = filters
+
+    def matches(self, query_id, item):
+        """
+        Check if an item returned for the group matches one of its queries.
+
+        Args:
+            query_id (int): The id of the query.
+            item (Item): The item.
+
+        Returns:
+            bool: Whether the item matches, or None if the item lacks the fields to tell.
+        """
+        for parameter, accepted in self.filters[query_id].items():
+            fields = COALESCIBLE_PARAMETERS[parameter]
+            values = [
+                item.raw_data[field] for field in fields if field in item.raw_data
+            ]
+            if not values:
+                return None
+            if not any(str(value) in accepted for value in values):
+                return False
+        return True
+
+    def route(self, items):
+        """
+        Dispatch the items returned for the group to its queries.
+
+        Args:
+            items (list): The items returned by the request.
+
+        Returns:
+            dict: query_id -> the items matching the query, or None if the items lack
+                the fields of the filters. The parameters concerned are then no longer coalesced.
+        """
+        routed = {}
+        for query in self.queries:
+            query_items = []
+            for item in items:
+                match = self.matches(query[0], item)
+                if match is None:
+                    # Only the filters whose fields are all missing can't be checked
+                    missing = {
+                        parameter
+                        for parameter in self.filters[query[0]]
+                        if not any(
+                            field in item.raw_data
+                            for field in COALESCIBLE_PARAMETERS[parameter]
+                        )
+                    }
+                    logger.warning(
+                        f"Items lack the fields of {', '.join(sorted(missing))}, "
+                        "these filters won't be coalesced anymore"
+                    )
+                    _UNSUPPORTED_PARAMETERS.update(missing)
+                    return None
+                if match:
+                    query_items.append(item)
+            routed[query[0]] = query_items
+        return routed
+
+
+def _split_params(query):
+    # Returns the shared part of the parameters, and the coalescible filters
+    params = json.loads(query[4])
+    filters = {}
+    for parameter in COALESCIBLE_PARAMETERS:
+        value = params.pop(parameter, "")
+        if value:
+            filters[parameter] = set(value.split(","))
+    return params, filters
+
+
+def plan_queries(queries):
+    """
+    Group the queries that can be sent as a single catalog request.
+
+    Args:
+        queries (list): The queries, as returned by db.get_queries.
+
+    Returns:
+        list: The QueryGroup to scrape, each query being in exactly one of them.
+    """
+    groups = {}
+    plan = []
+    for query in queries:
+        if query[4] is None:
+            plan.append(QueryGroup([query]))
+            continue
+        params, filters = _split_params(query)
+        if _UNSUPPORTED_PARAMETERS.intersection(filters):
+            plan.append(QueryGroup([query]))
+            continue
+        key = (urlparse(query[1]).netloc, json.dumps(params, sort_keys=True))
+        groups.setdefault(key, []).append((query, params, filters))
+
+    for members in groups.values():
+        if len(members) == 1:
+            plan.append(QueryGroup([members[0][0]]))
+            continue
+
+        params = dict(members[0][1])
+        for parameter in COALESCIBLE_PARAMETERS:
+            # A query without a filter accepts every value, so the request must too
+            if all(parameter in filters for _, _, filters in members):
+                params[parameter] = ",".join(
+                    sorted(
+                        set().union(*(filters[parameter] for _, _, filters in members))
+                    )
+                )
+            else:
+                params[parameter] = ""
+        plan.append(
+            QueryGroup(
+                [query for query, _, _ in members],
+                params,
+                {query[0]: filters for query, _, filters in members},
+            )
+        )
+    return plan
@@ -0,0 +1,252 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# Parameters holding the rate limit of each endpoint class (requests per minute, 0 means no limit)
+RATE_LIMIT_PARAMETERS = {
+    "catalog": "rate_limit_catalog",
+    "users": "rate_limit_users",
+    "user_items": "rate_limit_users",
+}
+# Seconds of requests a bucket can hold, i.e. the allowed burst
+BURST_SECONDS = 10
+# Exponential backoff after a 429 without Retry-After (seconds)
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+
+# Token buckets, keyed by (locale, endpoint class, proxy)
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+# Counters of this process, see get_counters
+_COUNTERS = {"requests": 0, "waits": 0, "wait_seconds": 0.0, "rate_limited": 0}
+_COUNTERS_LOCK = threading.Lock()
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    Requests reserve a token and are told how long to wait for it, so the
+    waiting happens outside the lock and works for threads and coroutines alike.
+    The bucket can also be blocked until a given time, when Vinted asks us to slow down.
+
+    Attributes:
+        rate (float): Tokens added per second, None for no limit.
+        capacity (float): Maximum number of tokens.
+    """
+
+    def __init__(self, rate):
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate (float): Tokens added per second, None for no limit.
+        """
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate * BURST_SECONDS) if rate else 1.0
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token.
+
+        Args:
+            max_wait (float, optional): Don't take the token if it would have to wait
+                longer than this many seconds. Defaults to None, no limit.
+
+        Returns:
+            float: The number of seconds to wait before using it, or None if the
+                token wasn't taken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.rate:
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                # A negative balance is paid back by waiting for the refill
+                if self.tokens < 1:
+                    wait = max(wait, (1 - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            if self.rate:
+                self.tokens -= 1
+            return wait
+
+    def block(self, seconds):
+        """
+        Refuse tokens for the given number of seconds, and empty the bucket.
+
+        Args:
+            seconds (float): How long to block the bucket.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, self.blocked_until)
+
+
+def get_endpoint_class(url):
+    """
+    Get the class of a Vinted API endpoint, each class having its own rate limit.
+
+    The items of a user are limited apart from the user profiles, so the country
+    lookup can fall back on them while the profiles are backing off.
+
+    Args:
+        url (str): The URL of the request.
+
+    Returns:
+        str: "catalog", "users", "user_items" or "other".
+    """
+    path = urlparse(url).path
+    if "/catalog/" in path:
+        return "catalog"
+    if "/users/" in path:
+        if path.rstrip("/").endswith("/items"):
+            return "user_items"
+        return "users"
+    return "other"
+
+
+def _get_bucket(url, proxy):
+    # Import db here to avoid circular imports
+    import db
+
+    endpoint_class = get_endpoint_class(url)
+    key = (urlparse(url).netloc, endpoint_class, proxy)
+    parameter = RATE_LIMIT_PARAMETERS.get(endpoint_class)
+    rate = float(db.get_parameter(parameter) or 0) / 60 if parameter else 0
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get(key)
+        if bucket is None:
+            bucket = _BUCKETS[key] = TokenBucket(rate)
+        elif bucket.rate != rate:
+            bucket.set_rate(rate)
+    return bucket
+
+
+def reserve(url, proxy=None, max_wait=None):
+    """
+    Reserve a request to a URL through a proxy.
+
+    Args:
+        url (str): The URL of the request.
+        proxy (str, optional): The proxy the request goes through.
+        max_wait (float, optional): Don't reserve the request if it would have to
+            wait longer than this many seconds. Defaults to None, no limit.
+
+    Returns:
+        float: The number of seconds to wait before sending the request, or None
+            if it wasn't reserved.
+    """
+    wait = _get_bucket(url, proxy).reserve(max_wait)
+    if wait is None:
+        return None
+    with _COUNTERS_LOCK:
+        _COUNTERS["requests"] += 1
+        if wait > 0:
+            _COUNTERS["waits"] += 1
+            _COUNTERS["wait_seconds"] += wait
+    return wait
+
+
+def acquire(url, proxy=None, max_wait=None):
+    """
+    Wait until a request to a URL through a proxy is allowed.
+
+    Args:
+        url (str): The URL of the request.
+        proxy (str, optional): The proxy the request goes through.
+        max_wait (float, optional): Give up without waiting if the request would have
+            to wait longer than this many seconds. Defaults to None, no limit.
+
+    Returns:
+        bool: True if the request is allowed, False if it gave up.
+    """
+    wait = reserve(url, proxy, max_wait)
+    if wait is None:
+        return False
+    if wait > 0:
+        time.sleep(wait)
+    return True
+
+
+def get_retry_delay(headers, attempt):
+    """
+    Get how long to wait after a 429 response.
+
+    Uses the Retry-After header when present, otherwise an exponential backoff
+    with full jitter.
+
+    Args:
+        headers (Mapping): The headers of the response.
+        attempt (int): The number of 429 responses received in a row, starting at 1.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                return min(BACKOFF_MAX, max(0.0, delay))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def rate_limited(url, proxy, headers, attempt):
+    """
+    Record a 429 response, and block the bucket of the request for the retry delay,
+    so every thread sending the same kind of request backs off.
+
+    Args:
+        url (str): The URL of the request.
+        proxy (str, optional): The proxy the request went through.
+        headers (Mapping): The headers of the response.
+        attempt (int): The number of 429 responses received in a row, starting at 1.
+
+    Returns:
+        float: The retry delay in seconds.
+    """
+    delay = get_retry_delay(headers, attempt)
+    _get_bucket(url, proxy).block(delay)
+    with _COUNTERS_LOCK:
+        _COUNTERS["rate_limited"] += 1
+    logger.warning(
+        f"Rate limited by Vinted on {get_endpoint_class(url)} requests, "
+        f"backing off for {delay:.1f} seconds"
+    )
+    return delay
+
+
+def get_counters():
+    """
+    Get the rate limiting counters of this process.
+
+    Returns:
+        dict: requests (reserved), waits (requests that had to wait), wait_seconds
+            (total time spent waiting) and rate_limited (429 responses received).
+    """
+    with _COUNTERS_LOCK:
+        return dict(_COUNTERS)
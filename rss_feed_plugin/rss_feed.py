@@ -1,9 +1,9 @@
 from flask import Flask, Response
 import threading
-import time
 import db
 import datetime
 import html
+from queue import Empty
 from logger import get_logger
 from feedgen.feed import FeedGenerator
 
@@ -37,21 +37,22 @@ class RSSFeed:
         while True:
             try:
                 self.check_rss_queue()
-                time.sleep(0.1)  # Small sleep to prevent high CPU usage
             except Exception as e:
                 logger.error(f"Error checking RSS queue: {str(e)}", exc_info=True)
 
     def check_rss_queue(self):
-        if not self.queue.empty():
-            try:
-                content, url, text, buy_url, buy_text = self.queue.get()
+        # Wait for the next item, the call returns after a second without any
+        try:
+            item = self.queue.get(timeout=1)
+        except Empty:
+            return
+        try:
+            content, url, text, buy_url, buy_text = item
 
-                # Add item to the feed
-                self.add_item_to_feed(content, url)
-            except Exception as e:
-                logger.error(
-                    f"Error processing item for RSS feed: {str(e)}", exc_info=True
-                )
+            # Add item to the feed
+            self.add_item_to_feed(content, url)
+        except Exception as e:
+            logger.error(f"Error processing item for RSS feed: {str(e)}", exc_info=True)
 
     def add_item_to_feed(self, content, url):
         # Extract title from content (assuming it's in the format from configuration_values.MESSAGE)
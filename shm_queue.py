@@ -0,0 +1,333 @@
+import multiprocessing
+import os
+import pickle
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+from logger import get_logger
+
+# Get logger for this module
+logger = get_logger(__name__)
+
+# Names of the hops between the processes, see create_queue
+QUEUE_HOPS = ("items", "new_items", "rss", "telegram")
+# Default size of a slot and number of slots of a ring buffer (1 MiB)
+SLOT_SIZE = 256
+SLOT_COUNT = 4096
+
+# Seconds a writer waits for the write lock before checking that its holder is alive
+LOCK_CHECK_INTERVAL = 1
+# Seconds a writer waits for free slots, or a reader for a record, before checking again
+WAKEUP_CHECK_INTERVAL = 0.1
+
+# Header of the buffer: slots written and slots read since the creation,
+# and pids of the last processes that took the write lock and the read lock
+_HEADER = struct.Struct("QQQQ")
+_COUNTER = struct.Struct("Q")
+_WRITTEN, _READ, _WRITER, _READER = 0, 8, 16, 24
+# Prefix of a record: size of the pickled object
+_RECORD = struct.Struct("I")
+
+
+class SharedMemoryQueue:
+    """
+    A multiprocessing queue backed by a ring buffer in shared memory.
+
+    The buffer is made of fixed-size slots. A record is the pickled object prefixed
+    with its size, and spans as many consecutive slots as it needs. A blocked get is
+    woken up by a semaphore as soon as a record is written. A put waits for free slots
+    without holding the write lock, and only takes it to copy its record once there
+    is room for all of it. A process killed while holding the write or the read lock
+    (e.g. a scraper terminated by check_refresh_delay) is detected from its pid, and
+    the lock is released for the others.
+
+    Unlike multiprocessing.Queue, a put copies the record into the buffer from the
+    calling thread, without a pipe or a feeder thread in between.
+
+    The queue must be created before the processes using it are started. The process
+    creating it owns the shared memory and releases it with close.
+
+    Example:
+        >>> items_queue = SharedMemoryQueue()
+        >>> items_queue.put(([(1, 2)], 3))
+        >>> items_queue.get()
+        ([(1, 2)], 3)
+    """
+
+    def __init__(self, slot_size=SLOT_SIZE, slot_count=SLOT_COUNT):
+        """
+        Create an empty queue.
+
+        Args:
+            slot_size (int, optional): Size of a slot in bytes. Defaults to SLOT_SIZE.
+            slot_count (int, optional): Number of slots. Defaults to SLOT_COUNT.
+        """
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=_HEADER.size + slot_size * slot_count
+        )
+        _HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0)
+        self._owner = True
+        # Wake up the readers waiting for a record and the writers waiting for free
+        # slots. They are only released up to 1, so the operations made while nobody
+        # waits don't pile up wakeups, see _wake_up.
+        self._ready = multiprocessing.BoundedSemaphore(1)
+        self._freed = multiprocessing.BoundedSemaphore(1)
+        self._ready.acquire()
+        self._freed.acquire()
+        self._put_lock = multiprocessing.Lock()
+        self._recover_lock = multiprocessing.Lock()
+        self._get_lock = multiprocessing.Lock()
+
+    def __getstate__(self):
+        # Only used when starting a process with the spawn method
+        return (
+            self._shm.name,
+            self.slot_size,
+            self.slot_count,
+            self._ready,
+            self._freed,
+            self._put_lock,
+            self._recover_lock,
+            self._get_lock,
+        )
+
+    def __setstate__(self, state):
+        (
+            name,
+            self.slot_size,
+            self.slot_count,
+            self._ready,
+            self._freed,
+            self._put_lock,
+            self._recover_lock,
+            self._get_lock,
+        ) = state
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = False
+
+    def _slots(self, size):
+        # Number of slots taken by a record of the given size
+        return -(-(_RECORD.size + size) // self.slot_size)
+
+    def _copy_in(self, position, data):
+        # Write bytes at a position of the ring, wrapping around its end
+        capacity = self.slot_size * self.slot_count
+        start = _HEADER.size + position % capacity
+        first = min(len(data), _HEADER.size + capacity - start)
+        buf = self._shm.buf
+        buf[start : start + first] = data[:first]
+        if first < len(data):
+            buf[_HEADER.size : _HEADER.size + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        # Read bytes at a position of the ring, wrapping around its end
+        capacity = self.slot_size * self.slot_count
+        start = _HEADER.size + position % capacity
+        first = min(size, _HEADER.size + capacity - start)
+        buf = self._shm.buf
+        data = bytes(buf[start : start + first])
+        if first < size:
+            data += bytes(buf[_HEADER.size : _HEADER.size + size - first])
+        return data
+
+    def _acquire_lock(self, lock, holder_offset, deadline):
+        # Take the write or the read lock, or take it over if its holder died
+        # while holding it. The pid of the holder is kept at holder_offset.
+        while True:
+            wait = LOCK_CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, max(0, deadline - time.monotonic()))
+            if lock.acquire(timeout=wait):
+                _COUNTER.pack_into(self._shm.buf, holder_offset, os.getpid())
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            # The lock is only held while copying a record, so it was likely abandoned.
+            # Only one process may take it over.
+            if not self._recover_lock.acquire(timeout=LOCK_CHECK_INTERVAL):
+                continue
+            try:
+                (holder,) = _COUNTER.unpack_from(self._shm.buf, holder_offset)
+                if holder and not _is_alive(holder):
+                    logger.warning(
+                        f"Process {holder} died while using a shared memory "
+                        "queue, taking over its lock"
+                    )
+                    # Its record was not committed, the counters are unchanged
+                    _COUNTER.pack_into(self._shm.buf, holder_offset, os.getpid())
+                    return True
+            finally:
+                self._recover_lock.release()
+
+    @staticmethod
+    def _wake_up(semaphore):
+        # Wake up a waiting process, or the next one to wait if none is. Nothing
+        # happens if a wakeup is already pending.
+        try:
+            semaphore.release()
+        except ValueError:
+            pass
+
+    def put(self, obj, block=True, timeout=None):
+        """
+        Put an object in the queue.
+
+        Args:
+            obj: The object to put, it must be picklable.
+            block (bool, optional): Whether to wait for free slots. Defaults to True.
+            timeout (float, optional): Maximum number of seconds to wait.
+                Defaults to None, waiting as long as needed.
+
+        Raises:
+            ValueError: If the pickled object doesn't fit in the buffer.
+            queue.Full: If there was no room for the object in time.
+        """
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        slots = self._slots(len(data))
+        if slots > self.slot_count:
+            raise ValueError(
+                f"Object of {len(data)} bytes doesn't fit in a queue of "
+                f"{self.slot_size * self.slot_count} bytes"
+            )
+
+        if not block:
+            deadline = time.monotonic()
+        elif timeout is None:
+            deadline = None
+        else:
+            deadline = time.monotonic() + timeout
+        while True:
+            if not self._acquire_lock(self._put_lock, _WRITER, deadline):
+                raise queue.Full
+            try:
+                written, read, _, _ = _HEADER.unpack_from(self._shm.buf, 0)
+                if self.slot_count - (written - read) >= slots:
+                    self._copy_in(
+                        written * self.slot_size, _RECORD.pack(len(data)) + data
+                    )
+                    # Committing the record is the last write, a writer killed
+                    # before it leaves the queue as it was
+                    _COUNTER.pack_into(self._shm.buf, _WRITTEN, written + slots)
+                    break
+            finally:
+                self._put_lock.release()
+
+            # Wait for the reader to free slots, never while holding the lock
+            wait = WAKEUP_CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise queue.Full
+            self._freed.acquire(timeout=wait)
+        self._wake_up(self._ready)
+
+    def put_nowait(self, obj):
+        """Put an object in the queue without waiting, see put."""
+        self.put(obj, block=False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return an object from the queue.
+
+        Args:
+            block (bool, optional): Whether to wait for an object. Defaults to True.
+            timeout (float, optional): Maximum number of seconds to wait.
+                Defaults to None, waiting as long as needed.
+
+        Returns:
+            The oldest object of the queue.
+
+        Raises:
+            queue.Empty: If no object was available in time.
+        """
+        if not block:
+            deadline = time.monotonic()
+        elif timeout is None:
+            deadline = None
+        else:
+            deadline = time.monotonic() + timeout
+        while True:
+            if not self._acquire_lock(self._get_lock, _READER, deadline):
+                raise queue.Empty
+            try:
+                written, read, _, _ = _HEADER.unpack_from(self._shm.buf, 0)
+                if written != read:
+                    position = read * self.slot_size
+                    (size,) = _RECORD.unpack(self._copy_out(position, _RECORD.size))
+                    data = self._copy_out(position + _RECORD.size, size)
+                    # Committing the read is the last write, a reader killed
+                    # before it leaves the record in the queue
+                    _COUNTER.pack_into(self._shm.buf, _READ, read + self._slots(size))
+                    break
+            finally:
+                self._get_lock.release()
+            if not block:
+                raise queue.Empty
+            # The semaphore only wakes the reader up, the counters tell if a record is
+            # there, so a writer killed before signaling its record doesn't delay it
+            wait = WAKEUP_CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise queue.Empty
+            self._ready.acquire(timeout=wait)
+        self._wake_up(self._freed)
+        return pickle.loads(data)
+
+    def get_nowait(self):
+        """Remove and return an object without waiting, see get."""
+        return self.get(block=False)
+
+    def empty(self):
+        """
+        Check if the queue is empty. As for multiprocessing.Queue, the result is
+        only a hint, another process may change it right away.
+
+        Returns:
+            bool: True if no object is waiting to be read.
+        """
+        written, read, _, _ = _HEADER.unpack_from(self._shm.buf, 0)
+        return written == read
+
+    def close(self):
+        """
+        Detach from the shared memory, and release it in the process that created it.
+        """
+        try:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+        except (BufferError, FileNotFoundError):
+            logger.debug("Shared memory of the queue already released")
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def create_queue(hop, shared_memory_hops):
+    """
+    Create the queue of a hop between two processes.
+
+    Args:
+        hop (str): The name of the hop, one of QUEUE_HOPS.
+        shared_memory_hops (str): The comma-separated hops using a SharedMemoryQueue,
+            as stored in the shared_memory_queues parameter.
+
+    Returns:
+        SharedMemoryQueue or multiprocessing.Queue: The queue.
+    """
+    hops = {name.strip() for name in (shared_memory_hops or "").split(",")}
+    if hop in hops:
+        logger.info(f"Using a shared memory queue for the {hop} hop")
+        return SharedMemoryQueue()
+    return multiprocessing.Queue()
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the application live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+
+def migrate():
+    # Same loop as vinted_notifications.py: apply the migrations from the current version
+    migration_files = os.listdir(os.path.join(ROOT, "migrations"))
+    current_version = db.get_parameter("version")
+    while True:
+        migration_file = next(
+            (f for f in migration_files if f.startswith(current_version + "_")),
+            None,
+        )
+        if not migration_file:
+            break
+        db.create_or_update_sqlite_db(os.path.join(ROOT, "migrations", migration_file))
+        current_version = db.get_parameter("version")
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """A database created from initial_db.sql and all the migrations, in a temporary directory."""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "vinted_notifications.db"))
+    db.close_db_connection()
+    db.invalidate_parameters_cache()
+    monkeypatch.setattr(db, "_allowlist_cache", (0.0, None, None))
+    db.create_or_update_sqlite_db(os.path.join(ROOT, "initial_db.sql"))
+    migrate()
+    yield db
+    db.close_db_connection()
@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+
+import proxies
+import rate_limiter
+
+
+def test_async_get_retries_through_the_mock_transport(fresh_db, monkeypatch):
+    from pyVintedVN.async_requester import AsyncRequester
+
+    monkeypatch.setattr(proxies, "get_random_proxy", lambda: None)
+    monkeypatch.setattr(rate_limiter, "_BUCKETS", {})
+    # The backoff of the 429 is checked by the requester tests, don't wait for it
+    monkeypatch.setattr(rate_limiter, "reserve", lambda url, proxy: 0)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "60"}),
+        httpx.Response(401),
+        httpx.Response(200, json={"items": []}),
+    ]
+    requests = []
+
+    def handler(request):
+        requests.append((request.method, request.url.path, request.url.params))
+        if request.method == "HEAD":
+            return httpx.Response(200)
+        return responses.pop(0)
+
+    requester = AsyncRequester(http2=False)
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(
+        requester,
+        "_new_client",
+        lambda proxy: httpx.AsyncClient(headers=requester.HEADER, transport=transport),
+    )
+    rate_limited = rate_limiter.get_counters()["rate_limited"]
+
+    async def search():
+        async with requester:
+            return await requester.get(
+                "https://www.vinted.fr/api/v2/catalog/items",
+                params={"page": 1, "brand_ids": None},
+            )
+
+    response = asyncio.run(search())
+
+    assert response.status_code == 200
+    assert response.json() == {"items": []}
+    assert rate_limiter.get_counters()["rate_limited"] == rate_limited + 1
+    # The 401 refreshed the cookies of the host before the last try
+    assert [(method, path) for method, path, _ in requests] == [
+        ("GET", "/api/v2/catalog/items"),
+        ("GET", "/api/v2/catalog/items"),
+        ("HEAD", "/"),
+        ("GET", "/api/v2/catalog/items"),
+    ]
+    # The None parameters are dropped, as with requests
+    assert dict(requests[0][2]) == {"page": "1"}
+    assert requester._clients == {}
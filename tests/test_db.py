@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import signal
+import sqlite3
+
+import pytest
+
+import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_merge_never_scraped_queries_keeps_null_watermark(fresh_db):
+    fresh_db.add_query_to_db("https://www.vinted.fr/catalog?search_text=a", "a")
+    fresh_db.add_query_to_db("https://www.vinted.fr/catalog?search_text=b", "b")
+    (keep_id, *_), (duplicate_id, *_) = fresh_db.get_queries()
+
+    fresh_db.merge_queries(duplicate_id, keep_id)
+
+    queries = fresh_db.get_queries()
+    assert [query[0] for query in queries] == [keep_id]
+    assert queries[0][2] is None
+
+
+def test_merge_queries_keeps_newest_watermark(fresh_db):
+    fresh_db.add_query_to_db("https://www.vinted.fr/catalog?search_text=a", "a")
+    fresh_db.add_query_to_db("https://www.vinted.fr/catalog?search_text=b", "b")
+    (keep_id, *_), (duplicate_id, *_) = fresh_db.get_queries()
+    fresh_db.add_items_bulk([], duplicate_id, last_timestamp=1700000000)
+
+    fresh_db.merge_queries(duplicate_id, keep_id)
+
+    assert fresh_db.get_last_timestamp(keep_id) == 1700000000
+
+
+def test_cookie_jar_before_its_migration(tmp_path, monkeypatch, capsys):
+    # vinted_notifications.py imports the requester before running the migrations
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "vinted_notifications.db"))
+    db.close_db_connection()
+    db.invalidate_parameters_cache()
+    db.create_or_update_sqlite_db(os.path.join(ROOT, "initial_db.sql"))
+    capsys.readouterr()
+
+    assert db.get_cookie_jar("www.vinted.fr", None) is None
+    assert "Traceback" not in capsys.readouterr().err
+    db.close_db_connection()
+
+
+def _fill_free_pages(conn, rows=20000):
+    conn.execute("CREATE TABLE filler (x)")
+    conn.executemany("INSERT INTO filler VALUES (?)", [("x" * 500,)] * rows)
+    conn.execute("DROP TABLE filler")
+    conn.commit()
+
+
+def test_incremental_vacuum_releases_max_pages(fresh_db):
+    conn = fresh_db.get_db_connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    _fill_free_pages(conn)
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+
+    assert fresh_db.incremental_vacuum(100) == 100 * page_size
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == free_pages - 100
+    while fresh_db.incremental_vacuum(1000):
+        pass
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_incremental_vacuum_through_the_writer_process(fresh_db):
+    _fill_free_pages(fresh_db.get_db_connection())
+    listener = fresh_db.create_writer_listener()
+    writer = multiprocessing.Process(target=fresh_db.run_writer, args=(listener,))
+    writer.start()
+    try:
+        fresh_db.start_writer(listener.address)
+        assert fresh_db.incremental_vacuum(100) > 0
+        # The writer's transaction was still open for the write that followed
+        fresh_db.set_parameter("version", "vacuumed")
+        assert fresh_db.get_parameter("version") == "vacuumed"
+    finally:
+        fresh_db.start_writer(None)
+        writer.terminate()
+        writer.join()
+        listener.close()
+
+
+def test_allowlist_read_failure_keeps_the_last_allowlist(fresh_db, monkeypatch):
+    fresh_db.add_to_allowlist("FR")
+    assert fresh_db.get_allowlist_set() == {"FR"}
+
+    def broken_connection():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(fresh_db, "get_db_connection", broken_connection)
+    fresh_db.invalidate_allowlist_cache()
+    assert fresh_db.get_allowlist_set() == {"FR"}
+
+    # Without an allowlist loaded, the error isn't taken for an empty allowlist
+    monkeypatch.setattr(fresh_db, "_allowlist_cache", (0.0, None, None))
+    with pytest.raises(sqlite3.OperationalError):
+        fresh_db.get_allowlist_set()
+
+
+def test_retention_converts_an_old_database_once(fresh_db, monkeypatch):
+    import core
+
+    monkeypatch.setattr(core, "_AUTO_VACUUM_CHECKED", False)
+    # A database created before auto_vacuum=INCREMENTAL was the default
+    conn = fresh_db.get_db_connection()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    assert fresh_db.get_auto_vacuum() == 0
+
+    # Nothing is rewritten while the retention is off
+    assert core.prune_old_items() == (0, 0)
+    assert fresh_db.get_auto_vacuum() == 0
+
+    fresh_db.set_parameter("item_retention_days", "30")
+    core.prune_old_items()
+    assert fresh_db.get_auto_vacuum() == 2
+    assert core._AUTO_VACUUM_CHECKED
+
+
+def _die_while_sending(db_module):
+    # Send half of a write to the writer process and die
+    db_module.set_parameter("version", "sent")
+    conn = db_module._writer_channel[0]
+    conn._send(b"\x00\x00\x10\x00partial")
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_writer_survives_a_process_killed_while_sending(fresh_db):
+    listener = fresh_db.create_writer_listener()
+    writer = multiprocessing.Process(target=fresh_db.run_writer, args=(listener,))
+    writer.start()
+    try:
+        fresh_db.start_writer(listener.address)
+        killed = multiprocessing.Process(target=_die_while_sending, args=(fresh_db,))
+        killed.start()
+        killed.join()
+
+        # The other processes still get their writes done
+        fresh_db.set_parameter("version", "after")
+        assert fresh_db.get_parameter("version") == "after"
+    finally:
+        fresh_db.start_writer(None)
+        writer.terminate()
+        writer.join()
+        listener.close()
@@ -0,0 +1,16 @@
+from item_index import SeenItemIndex
+
+
+def test_seen_item_index_keeps_the_highest_ids():
+    index = SeenItemIndex(range(100, 0, -1), max_ids=10)
+
+    assert len(index._ids) == 10
+    # The dropped ids are below the floor and may have been seen
+    assert all(index.might_contain(item_id) for item_id in range(1, 101))
+    assert not index.might_contain(101)
+
+    index.update([150, 120])
+    assert index.might_contain(150) and not index.might_contain(130)
+    # The ids below the floor are not added again
+    index.add(5)
+    assert len(index._ids) == 10
@@ -0,0 +1,30 @@
+from polling_scheduler import MIN_POLL_INTERVAL, PollingScheduler
+
+
+def test_catch_up_requests_are_charged_to_the_budget():
+    # 12 requests per minute, a burst of one request
+    scheduler = PollingScheduler(requests_per_minute=12, default_interval=60)
+    scheduler.sync({1: (None, None), 2: (None, None)}, now=0)
+    scheduler._tokens, scheduler._tokens_updated = 1, 0
+
+    assert scheduler.pop_due(now=0) == [1]
+    # The poll of query 1 caught up 4 more pages
+    scheduler.charge(4)
+    # A token every 5 seconds, the 4 extra requests delay query 2 by 20 seconds
+    assert scheduler.pop_due(now=20) == []
+    assert scheduler.pop_due(now=25) == [2]
+
+
+def test_failed_poll_keeps_the_arrival_rate():
+    scheduler = PollingScheduler(requests_per_minute=600, default_interval=60)
+    scheduler.sync({1: (60, 0.05)}, now=0)
+    scheduler.observe(1, 3, now=0)
+
+    # Failed polls are retried at the same interval, the rate isn't lowered
+    assert scheduler.observe(1, None, now=100) == 60
+    assert scheduler.get_state(1) == (60, 0.05)
+    # The next successful poll covers the 200 seconds since the last one
+    scheduler.observe(1, 20, now=200)
+    interval, rate = scheduler.get_state(1)
+    assert rate == 0.3 * 20 / 200 + 0.7 * 0.05
+    assert interval == max(MIN_POLL_INTERVAL, 1 / rate)
@@ -0,0 +1,118 @@
+import json
+import time
+
+import query_coalescing
+from query_coalescing import QueryGroup, plan_queries
+
+URL = "https://www.vinted.fr/catalog?search_text=shirt"
+
+
+def make_item(item_id, timestamp, **fields):
+    # pyVintedVN creates the requester when imported, it needs the database
+    from pyVintedVN.items.item import Item
+
+    return Item(
+        {
+            "id": item_id,
+            "title": f"Item {item_id}",
+            "brand_title": "Brand",
+            "price": {"amount": "10.0", "currency_code": "EUR"},
+            "photo": {"url": "", "high_resolution": {"timestamp": timestamp}},
+            "url": f"https://www.vinted.fr/items/{item_id}",
+            "user": {"id": 1},
+            **fields,
+        }
+    )
+
+
+def make_query(query_id, watermark, **params):
+    return (query_id, URL, watermark, f"query {query_id}", json.dumps(params))
+
+
+class _Queue(list):
+    put = list.append
+
+
+def test_route_only_drops_the_filter_whose_fields_are_missing(fresh_db, monkeypatch):
+    monkeypatch.setattr(query_coalescing, "_UNSUPPORTED_PARAMETERS", set())
+    group = QueryGroup(
+        [make_query(1, None), make_query(2, None)],
+        {},
+        {
+            1: {"brand_ids": {"10"}, "size_ids": {"20"}},
+            2: {"brand_ids": {"11"}, "size_ids": {"20"}},
+        },
+    )
+
+    # The item has a brand but no size
+    assert group.route([make_item(1, 0, brand_id=10)]) is None
+    assert query_coalescing._UNSUPPORTED_PARAMETERS == {"size_ids"}
+
+    # Queries filtering on brands are still coalesced, not those filtering on sizes
+    queries = [
+        make_query(1, None, brand_ids="10"),
+        make_query(2, None, brand_ids="11"),
+        make_query(3, None, size_ids="20"),
+        make_query(4, None, size_ids="21"),
+    ]
+    assert sorted(len(group.queries) for group in plan_queries(queries)) == [1, 1, 2]
+
+
+class _Items:
+    def __init__(self, page):
+        self.page = page
+        self.nbr_items = None
+
+    def search_changes(self, url, fingerprint, nbr_items, params):
+        self.nbr_items = nbr_items
+        return list(self.page), "fingerprint"
+
+
+class _Vinted:
+    def __init__(self, page):
+        self.items = _Items(page)
+
+
+def test_scrape_group_catches_up_to_the_oldest_watermark(fresh_db, monkeypatch):
+    import core
+
+    monkeypatch.setattr(core, "_RECENT_ITEMS", {})
+    monkeypatch.setattr(core, "_RESPONSE_FINGERPRINTS", {})
+    monkeypatch.setattr(core, "_NEW_ITEM_COUNTS", {1: 3, 2: 2})
+    now = int(time.time())
+    # Query 1 was polled a minute ago, query 2 an hour ago
+    queries = [
+        make_query(1, now - 60, brand_ids="10"),
+        make_query(2, now - 3600, brand_ids="11"),
+    ]
+    (group,) = plan_queries(queries)
+
+    # The first page is full of items newer than both watermarks
+    page = [make_item(100 + i, now - i, brand_id=10 + i % 2) for i in range(10)]
+    # The following pages reach the watermark of query 2
+    older = [
+        make_item(200, now - 1800, brand_id=11),
+        make_item(201, now - 1800, brand_id=10),
+    ]
+    catch_up = {}
+
+    def fetch_catchup_pages(
+        query, params, page_size, first_page, max_pages, watermark=None
+    ):
+        catch_up.update(page_size=page_size, watermark=watermark)
+        return older
+
+    monkeypatch.setattr(core, "fetch_catchup_pages", fetch_catchup_pages)
+    vinted = _Vinted(page)
+    queue = _Queue()
+    routed = core.scrape_group(vinted, group, 20, queue)
+
+    # The page size follows the new items of the last poll, twice their sum
+    assert vinted.items.nbr_items == 10
+    assert catch_up == {"page_size": 10, "watermark": now - 3600}
+    # Item 201 is older than the watermark of query 1, item 200 is new for query 2
+    sent = {query_id: {record[0] for record in records} for records, query_id in queue}
+    assert sent[1] == {100, 102, 104, 106, 108}
+    assert sent[2] == {101, 103, 105, 107, 109, 200}
+    assert len(routed[1]) == 6 and len(routed[2]) == 6
+    assert core._NEW_ITEM_COUNTS == {1: 5, 2: 6}
@@ -0,0 +1,105 @@
+import io
+import json
+import time
+
+import pytest
+import requests
+from requests.exceptions import HTTPError
+
+import proxies
+import rate_limiter
+
+
+def test_pick_proxy_rotates_over_pooled_sessions(fresh_db, monkeypatch):
+    from pyVintedVN.requester import SessionPool
+
+    proxy_list = [f"10.0.0.{i}:8080" for i in range(200)]
+    monkeypatch.setattr(proxies, "get_proxies", lambda: proxy_list)
+    pool = SessionPool()
+
+    picked = set()
+    for _ in range(1000):
+        proxy = pool.pick_proxy("www.vinted.fr")
+        pool.get("www.vinted.fr", proxy, warm=False)
+        picked.add(proxy)
+
+    # The requests stick to the sessions of the pool, none of them was evicted
+    assert len(picked) == SessionPool.PROXIES_PER_LOCALE
+    assert len(pool._sessions) == SessionPool.PROXIES_PER_LOCALE
+
+    # A discarded session makes room for another proxy
+    pool.discard("www.vinted.fr", proxy)
+    assert len(pool._sessions) == SessionPool.PROXIES_PER_LOCALE - 1
+    pool.close()
+
+
+def test_pick_proxy_prunes_proxies_no_longer_in_use(fresh_db, monkeypatch):
+    from pyVintedVN.requester import SessionPool
+
+    expires = time.time() + 3600
+    cookies = json.dumps([])
+    fresh_db.save_cookie_jar("www.vinted.fr", "old:8080", "UA", cookies, expires)
+    fresh_db.save_cookie_jar("www.vinted.fr", "kept:8080", "UA", cookies, expires)
+    fresh_db.save_cookie_jar("www.vinted.fr", None, "UA", cookies, expires)
+    fresh_db.save_cookie_jar("www.vinted.de", None, "UA", cookies, time.time() - 1)
+
+    monkeypatch.setattr(proxies, "get_proxies", lambda: ["old:8080", "kept:8080"])
+    pool = SessionPool()
+    pool.get("www.vinted.fr", pool.pick_proxy("www.vinted.fr"), warm=False)
+    pool.get("www.vinted.fr", "old:8080", warm=False)
+
+    # The proxies were checked again, old:8080 no longer works
+    monkeypatch.setattr(proxies, "get_proxies", lambda: ["kept:8080"])
+    assert pool.pick_proxy("www.vinted.fr") == "kept:8080"
+
+    assert ("www.vinted.fr", "old:8080") not in pool._sessions
+    assert fresh_db.get_cookie_jar("www.vinted.fr", "old:8080") is None
+    assert fresh_db.get_cookie_jar("www.vinted.fr", "kept:8080") is not None
+    assert fresh_db.get_cookie_jar("www.vinted.fr", None) is not None
+    # Expired cookies are deleted too
+    assert fresh_db.get_cookie_jar("www.vinted.de", None) is None
+    pool.close()
+
+
+class _RateLimitedSession:
+    # Answers every request with a 429 asking to retry in a minute
+    proxies = {}
+
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, params=None):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 429
+        response.headers["Retry-After"] = "60"
+        response.raw = io.BytesIO(b"")
+        return response
+
+
+def test_429_on_the_last_try_blocks_the_bucket(fresh_db, monkeypatch):
+    from pyVintedVN.requester import Requester, get_session_pool
+
+    monkeypatch.setattr(proxies, "get_proxies", lambda: [])
+    session = _RateLimitedSession()
+    requester = Requester()
+    monkeypatch.setattr(get_session_pool(), "get", lambda *args, **kwargs: session)
+    requester.MAX_RETRIES = 1
+    url = "https://www.vinted.test/api/v2/users/1"
+    rate_limited = rate_limiter.get_counters()["rate_limited"]
+
+    assert requester.get(url).status_code == 429
+    assert rate_limiter.get_counters()["rate_limited"] == rate_limited + 1
+    # The bucket waits for the delay asked by Vinted, a capped request gives up
+    assert rate_limiter.reserve(url, None, max_wait=1) is None
+    with pytest.raises(HTTPError):
+        requester.get(url, max_wait=1)
+    assert session.requests == 1
+
+
+def test_reserve_with_max_wait_keeps_the_token():
+    bucket = rate_limiter.TokenBucket(rate=1)
+    for _ in range(int(bucket.capacity)):
+        assert bucket.reserve() == 0
+    assert bucket.reserve(max_wait=0.5) is None
+    assert 0.9 < bucket.reserve(max_wait=1.5) <= 1
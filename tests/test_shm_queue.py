@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import pytest
+
+from shm_queue import SharedMemoryQueue, _COUNTER, _READER, _WRITER
+
+# The queue is inherited by the child processes, as in vinted_notifications.py
+context = multiprocessing.get_context("fork")
+
+
+@pytest.fixture
+def small_queue():
+    shm_queue = SharedMemoryQueue(slot_size=64, slot_count=16)
+    yield shm_queue
+    shm_queue.close()
+
+
+def test_records_wrap_around_the_buffer(small_queue):
+    for i in range(200):
+        record = ("x" * (i * 7 % 500), i)
+        small_queue.put(record)
+        assert small_queue.get(timeout=1) == record
+    assert small_queue.empty()
+
+
+def test_put_raises_full_and_get_raises_empty(small_queue):
+    with pytest.raises(queue.Empty):
+        small_queue.get(timeout=0.05)
+    for _ in range(8):
+        small_queue.put("y" * 100)
+    with pytest.raises(queue.Full):
+        small_queue.put("y" * 100, timeout=0.05)
+    with pytest.raises(ValueError):
+        small_queue.put("z" * 2000)
+
+
+def _put_forever(shm_queue):
+    shm_queue.put("y" * 100)
+
+
+def test_producer_killed_while_waiting_for_room(small_queue):
+    for _ in range(8):
+        small_queue.put("y" * 100)
+    producer = context.Process(target=_put_forever, args=(small_queue,))
+    producer.start()
+    time.sleep(0.3)
+    assert producer.is_alive()
+    os.kill(producer.pid, signal.SIGTERM)
+    producer.join()
+
+    # The killed producer held nothing, the queue still works for the others
+    for _ in range(8):
+        assert small_queue.get(timeout=1) == "y" * 100
+    small_queue.put("after", timeout=1)
+    assert small_queue.get(timeout=1) == "after"
+
+
+def _die_holding_the_lock(shm_queue):
+    shm_queue._put_lock.acquire()
+    _COUNTER.pack_into(shm_queue._shm.buf, _WRITER, os.getpid())
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_producer_killed_while_holding_the_lock(small_queue):
+    producer = context.Process(target=_die_holding_the_lock, args=(small_queue,))
+    producer.start()
+    producer.join()
+
+    small_queue.put("after", timeout=5)
+    assert small_queue.get(timeout=1) == "after"
+    small_queue.put("again", timeout=1)
+    assert small_queue.get(timeout=1) == "again"
+
+
+def test_wakeups_dont_pile_up_while_nobody_waits(small_queue):
+    for i in range(100):
+        small_queue.put(i)
+        assert small_queue.get(timeout=1) == i
+    # At most one pending wakeup, a blocked put or get waits instead of spinning
+    assert small_queue._ready.get_value() <= 1
+    assert small_queue._freed.get_value() <= 1
+    for _ in range(8):
+        small_queue.put("y" * 100)
+    start = time.monotonic()
+    with pytest.raises(queue.Full):
+        small_queue.put("y" * 100, timeout=0.3)
+    assert time.monotonic() - start >= 0.3
+
+
+def _die_holding_the_read_lock(shm_queue):
+    shm_queue._get_lock.acquire()
+    _COUNTER.pack_into(shm_queue._shm.buf, _READER, os.getpid())
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_consumer_killed_while_holding_the_lock(small_queue):
+    small_queue.put("before")
+    consumer = context.Process(target=_die_holding_the_read_lock, args=(small_queue,))
+    consumer.start()
+    consumer.join()
+
+    assert small_queue.get(timeout=5) == "before"
+    small_queue.put("after", timeout=1)
+    assert small_queue.get(timeout=1) == "after"
@@ -0,0 +1,94 @@
+import io
+import json
+
+import requests
+
+import proxies
+import rate_limiter
+
+
+class _ThrottledProfileSession:
+    # The user profiles answer with a 429 asking to retry in a minute,
+    # the items of a user answer with the given page or a 429 when it's None
+    proxies = {}
+
+    def __init__(self, items_page):
+        self.items_page = items_page
+        self.urls = []
+
+    def get(self, url, params=None):
+        self.urls.append(url)
+        response = requests.Response()
+        response.raw = io.BytesIO(b"")
+        if "/items" in url and self.items_page is not None:
+            response.status_code = 200
+            response._content = json.dumps({"items": self.items_page}).encode()
+        else:
+            response.status_code = 429
+            response.headers["Retry-After"] = "60"
+        return response
+
+
+class _Queue(list):
+    put = list.append
+
+
+def _throttle(monkeypatch, items_page):
+    from pyVintedVN.requester import get_session_pool
+
+    monkeypatch.setattr(proxies, "get_proxies", lambda: [])
+    monkeypatch.setattr(rate_limiter, "_BUCKETS", {})
+    session = _ThrottledProfileSession(items_page)
+    monkeypatch.setattr(get_session_pool(), "get", lambda *args, **kwargs: session)
+    return session
+
+
+def test_throttled_profile_falls_back_on_the_items_of_the_user(fresh_db, monkeypatch):
+    import core
+
+    session = _throttle(monkeypatch, [{"user": {"country_iso_code": "FR"}}])
+    monkeypatch.setattr(core.requester, "MAX_RETRIES", 1)
+
+    assert core.get_user_country(1) == "FR"
+    # The profiles back off for a minute, the items of the user are still asked
+    assert core.get_user_country(2) == "FR"
+    assert [url.split("/api/v2/")[1] for url in session.urls] == [
+        "users/1?localize=false",
+        "users/1/items?page=1&per_page=1",
+        "users/2/items?page=1&per_page=1",
+    ]
+
+
+def test_item_of_an_unknown_country_is_deferred_not_allowed(fresh_db, monkeypatch):
+    import core
+    from pyVintedVN.items.item import ItemRecord
+
+    _throttle(monkeypatch, None)
+    monkeypatch.setattr(core.requester, "MAX_RETRIES", 1)
+    monkeypatch.setattr(core, "_DEFERRED_ITEMS", {})
+    monkeypatch.setattr(core, "_DEFERRED_ITEMS_RETRY_AT", 0.0)
+    fresh_db.add_to_allowlist("FR")
+    fresh_db.add_query_to_db("https://www.vinted.fr/catalog?search_text=shirt", None)
+    item = ItemRecord(1, 1000, "Shirt", "10.0", "EUR", "Brand", None, "url", 7)
+
+    assert core.get_user_country(7) is None
+    queue = _Queue()
+    core.process_item_batch([item], 1, queue)
+
+    assert queue == []
+    assert core._DEFERRED_ITEMS == {1: {1: item}}
+    # The watermark stays at the deferred item, it isn't marked as seen
+    assert fresh_db.get_last_timestamp(1) == 1000
+    assert fresh_db.get_known_item_ids([1]) == set()
+
+    # Nothing is retried before USER_COUNTRY_RETRY_DELAY
+    core.retry_deferred_items(queue)
+    assert core._DEFERRED_ITEMS == {1: {1: item}}
+
+    # Once the profiles answer again, the item is notified
+    monkeypatch.setattr(core, "get_user_country", lambda user_id: "FR")
+    monkeypatch.setattr(core, "_DEFERRED_ITEMS_RETRY_AT", 0.0)
+    core.retry_deferred_items(queue)
+    assert len(queue) == 1
+    assert core._DEFERRED_ITEMS == {}
+    assert fresh_db.get_known_item_ids([1]) == {1}
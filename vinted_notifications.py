@@ -1,8 +1,10 @@
 import multiprocessing
+import signal
 import time
 import os
 import db
 from apscheduler.schedulers.background import BackgroundScheduler
+from shm_queue import create_queue
 from logger import get_logger
 
 # Get logger for this module
@@ -21,12 +23,26 @@ import core
 from rss_feed_plugin.rss_feed import rss_feed_process
 from web_ui_plugin.web_ui import web_ui_process
 
-
 # Global process references
+db_writer = None
 telegram_process = None
 rss_process = None
 scrape_process = None
 current_query_refresh_delay = None
+current_adaptive_polling = None
+
+
+def db_writer_process(writer_listener):
+    logger.info("Database writer process started")
+    # Ctrl+C reaches every process, but the main process still writes while shutting
+    # down, so the writer waits to be terminated by it instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        db.run_writer(writer_listener)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Database writer process stopped")
+    except Exception as e:
+        logger.error(f"Error in database writer process: {e}", exc_info=True)
 
 
 def scraper_process(items_queue):
@@ -36,6 +52,20 @@ def scraper_process(items_queue):
     current_query_refresh_delay = int(db.get_parameter("query_refresh_delay"))
     logger.info(f"Using query refresh delay of {current_query_refresh_delay} seconds")
 
+    if db.get_parameter("adaptive_polling") == "True":
+        # Each query is polled at its own interval, see core.process_due_items
+        logger.info("Using adaptive polling")
+        try:
+            while True:
+                try:
+                    core.process_due_items(items_queue)
+                except Exception as e:
+                    logger.error(f"Error in adaptive polling: {e}", exc_info=True)
+                time.sleep(1)
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("Scrape process stopped")
+        return
+
     scraper_scheduler = BackgroundScheduler()
     scraper_scheduler.add_job(
         core.process_items,
@@ -56,11 +86,22 @@ def scraper_process(items_queue):
 
 def item_extractor(items_queue, new_items_queue):
     logger.info("Item extractor process started")
+    loaded = False
     try:
         while True:
-            # Check if there's an item in the queue
-            core.clear_item_queue(items_queue, new_items_queue)
-            time.sleep(0.1)  # Small sleep to prevent high CPU usage
+            try:
+                if not loaded:
+                    # Build the index of seen items before the first batch arrives
+                    core.get_seen_items()
+                    # Load the allowlist too, it is used if it can't be read later on.
+                    # Until both are loaded, the items wait in the queue.
+                    db.get_allowlist_set()
+                    loaded = True
+                # Wait for the next batch of items, the call returns after a second without any
+                core.clear_item_queue(items_queue, new_items_queue, timeout=1)
+            except Exception as e:
+                logger.error(f"Error in item extractor: {e}", exc_info=True)
+                time.sleep(1)
     except (KeyboardInterrupt, SystemExit):
         logger.info("Consumer process stopped")
 
@@ -99,7 +140,7 @@ def telegram_bot_process(queue):
 
 def check_refresh_delay(items_queue):
     """Check if the query refresh delay has changed and update the scheduler if needed"""
-    global scrape_process, current_query_refresh_delay
+    global scrape_process, current_query_refresh_delay, current_adaptive_polling
 
     # Check if the scheduler is running
 
@@ -109,15 +150,21 @@ def check_refresh_delay(items_queue):
     # Get the current value from the database
     try:
         new_delay = int(db.get_parameter("query_refresh_delay"))
+        new_adaptive_polling = db.get_parameter("adaptive_polling")
 
-        # If the delay has changed, update the scheduler
-        if new_delay != current_query_refresh_delay:
+        # If the delay or the polling mode has changed, update the scheduler
+        if (
+            new_delay != current_query_refresh_delay
+            or new_adaptive_polling != current_adaptive_polling
+        ):
             logger.info(
-                f"Query refresh delay changed from {current_query_refresh_delay} to {new_delay} seconds"
+                f"Query refresh delay changed from {current_query_refresh_delay} to {new_delay} seconds, "
+                f"adaptive polling: {new_adaptive_polling}"
             )
 
-            # Update the global variable
+            # Update the global variables
             current_query_refresh_delay = new_delay
+            current_adaptive_polling = new_adaptive_polling
 
             # Remove the existing job and add a new one with the updated interval
             scrape_process.terminate()
@@ -201,32 +248,57 @@ if __name__ == "__main__":
     # Run db migrations
     current_version = db.get_parameter("version")
     # Check if there is a file that starts with the current version in the migrations folder. We keep comparing until
-    # we find no migration files that start with the current version.
+    # we find no migration files that start with the current version. The "_" separator is part of the prefix so
+    # that e.g. version 1.0.5 doesn't pick the migration of version 1.0.5.1.
     migration_files = [f for f in os.listdir("migrations")]
     while True:
         migration_file = next(
-            (f for f in migration_files if f.startswith(current_version)), None
+            (f for f in migration_files if f.startswith(current_version + "_")),
+            None,
         )
         if migration_file:
             logger.info(f"Running migration: {migration_file}")
             db.create_or_update_sqlite_db("./migrations/" + migration_file)
             # Increment the version
+            previous_version = current_version
             current_version = db.get_parameter("version")
+            if current_version == previous_version:
+                logger.error(
+                    f"Migration {migration_file} failed, the database stays at version {current_version}"
+                )
+                break
         else:
             break
 
+    # 0. Optionally start the database writer process
+    # All the processes started afterwards send their writes to it
+    if db.get_parameter("db_writer_process") == "True":
+        # Each process connects to the writer on its own, so a process terminated
+        # while sending a write doesn't block the others
+        writer_listener = db.create_writer_listener()
+        db_writer = multiprocessing.Process(
+            target=db_writer_process, args=(writer_listener,)
+        )
+        db_writer.start()
+        db.start_writer(writer_listener.address)
+
+    # Compute the fingerprints of the queries added before they existed
+    core.update_query_fingerprints()
+
     # Plugin checker
     plugin_checker()
 
-    # Create a shared queue
-    items_queue = multiprocessing.Queue()
-    new_items_queue = multiprocessing.Queue()
-    rss_queue = multiprocessing.Queue()
-    telegram_queue = multiprocessing.Queue()
+    # Create the queues between the processes, in shared memory for the selected hops
+    shared_memory_queues = db.get_parameter("shared_memory_queues")
+    items_queue = create_queue("items", shared_memory_queues)
+    new_items_queue = create_queue("new_items", shared_memory_queues)
+    rss_queue = create_queue("rss", shared_memory_queues)
+    telegram_queue = create_queue("telegram", shared_memory_queues)
 
     # 1. Create and start the scrape process
     # This process will scrape items and put them in the items_queue
     current_query_refresh_delay = int(db.get_parameter("query_refresh_delay"))
+    current_adaptive_polling = db.get_parameter("adaptive_polling")
     scrape_process = multiprocessing.Process(
         target=scraper_process, args=(items_queue,)
     )
@@ -261,6 +333,13 @@ if __name__ == "__main__":
         args=[items_queue, telegram_queue, rss_queue],
         name="process_monitor",
     )
+    # Remove old items according to the retention policy
+    monitor_scheduler.add_job(
+        core.prune_old_items,
+        "interval",
+        hours=1,
+        name="item_retention",
+    )
     monitor_scheduler.start()
 
     # 5. Create and start the Web UI process
@@ -317,4 +396,12 @@ if __name__ == "__main__":
         if rss_process:
             rss_process.join()
 
+        # The writer goes last, the other processes may still be writing
+        if db_writer:
+            db_writer.terminate()
+            db_writer.join()
+
+        for process_queue in (items_queue, new_items_queue, rss_queue, telegram_queue):
+            process_queue.close()
+
         logger.info("All processes terminated")
@@ -22,6 +22,25 @@ app = Flask(
 # Secret key for session management
 app.secret_key = os.urandom(24)
 
+# Maximum number of items served per page
+ITEMS_PAGE_MAX = 100
+
+
+def get_query_display_name(query):
+    """
+    Get the name to display for a query: its name, its search text, or its URL.
+
+    Args:
+        query (tuple): A query row as returned by db.get_queries()
+
+    Returns:
+        str: The display name of the query
+    """
+    if query[3] is not None:
+        return query[3]
+    search_text = parse_qs(urlparse(query[1]).query).get("search_text", [None])[0]
+    return search_text if search_text else query[1]
+
 
 @app.context_processor
 def inject_version_info():
@@ -46,6 +65,8 @@ def index():
 
     # Get queries
     queries = db.get_queries()
+    # Maintained by triggers, so the items table isn't counted for each query
+    item_counts = db.get_query_item_counts()
     formatted_queries = []
     for i, query in enumerate(queries):
         parsed_query = urlparse(query[1])
@@ -73,6 +94,7 @@ def index():
                 "query": query[1],
                 "display": query_name if query_name else query[1],
                 "last_found_item": last_found_item,
+                "item_count": item_counts.get(query[0], 0),
             }
         )
 
@@ -99,10 +121,11 @@ def index():
     rss_running = db.get_parameter("rss_process_running") == "True"
 
     # Get statistics for the dashboard
+    item_stats = db.get_stats()
     stats = {
-        "total_items": db.get_total_items_count(),
+        "total_items": item_stats["total_items"],
         "total_queries": db.get_total_queries_count(),
-        "items_per_day": db.get_items_per_day(),
+        "items_per_day": db.get_items_per_day(item_stats),
     }
 
     # Get the last found item
@@ -137,6 +160,8 @@ def index():
 def queries():
     # Get queries
     all_queries = db.get_queries()
+    # Maintained by triggers, so the items table isn't counted for each query
+    item_counts = db.get_query_item_counts()
     formatted_queries = []
     for i, query in enumerate(all_queries):
         parsed_query = urlparse(query[1])
@@ -164,6 +189,7 @@ def queries():
                 "query": query[1],
                 "display": query_name if query_name else query[1],
                 "last_found_item": last_found_item,
+                "item_count": item_counts.get(query[0], 0),
             }
         )
 
@@ -232,51 +258,14 @@ def update_query(query_id):
 @app.route("/items")
 def items():
     query_id = request.args.get("query", "")  # Default to empty string instead of None
-    limit = int(request.args.get("limit", 50))
-
-    # Get items
-    query_string = None
-    if query_id:
-        # Get the actual query string for the given ID
-        queries = db.get_queries()
-        for q in queries:
-            if str(q[0]) == query_id:
-                query_string = q[1]
-                break
-
-    items_data = db.get_items(limit=limit, query=query_string)
-    formatted_items = []
-
-    for item in items_data:
-        formatted_items.append(
-            {
-                "title": item[1],
-                "price": item[2],
-                "currency": item[3],
-                "timestamp": datetime.fromtimestamp(item[4]).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-                "query": (
-                    parse_qs(urlparse(item[5]).query).get("search_text", [None])[0]
-                    if parse_qs(urlparse(item[5]).query).get("search_text", [None])[0]
-                    else item[5]
-                ),
-                "url": f"https://www.vinted.fr/items/{item[0]}",
-                "photo_url": item[6],
-            }
-        )
+    limit = min(max(request.args.get("limit", 50, type=int), 1), ITEMS_PAGE_MAX)
 
     # Get queries for filter dropdown
     queries = db.get_queries()
     formatted_queries = []
     selected_query_display = None
     for i, q in enumerate(queries):
-        parsed_query = urlparse(q[1])
-        query_params = parse_qs(parsed_query.query)
-        query_name = (
-            q[3] if q[3] is not None else query_params.get("search_text", [None])[0]
-        )
-        display_name = query_name if query_name else q[0]
+        display_name = get_query_display_name(q)
         # Store display name for selected query
         if query_id == str(q[0]):
             selected_query_display = display_name
@@ -284,9 +273,9 @@ def items():
             {"id": i + 1, "query_id": q[0], "query": q[1], "display": display_name}
         )
 
+    # Items are loaded page by page from /api/items
     return render_template(
         "items.html",
-        items=formatted_items,
         queries=formatted_queries,
         selected_query=query_id,
         selected_query_display=selected_query_display,
@@ -294,6 +283,48 @@ def items():
     )
 
 
+@app.route("/api/items")
+def api_items():
+    query_id = request.args.get("query", type=int)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), ITEMS_PAGE_MAX)
+
+    # The cursor is the "timestamp:item" of the last item of the previous page
+    before = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            timestamp, item_id = cursor.split(":")
+            before = (int(timestamp), int(item_id))
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    items_data = db.get_items(limit=limit, query_id=query_id, before=before)
+
+    # Display names are computed once per query instead of once per item
+    query_names = {q[1]: get_query_display_name(q) for q in db.get_queries()}
+    formatted_items = []
+    for item in items_data:
+        formatted_items.append(
+            {
+                "title": item[1],
+                "price": item[2],
+                "currency": item[3],
+                "timestamp": datetime.fromtimestamp(item[4]).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                "query": query_names.get(item[5], item[5]),
+                "url": f"https://www.vinted.fr/items/{item[0]}",
+                "photo_url": item[6],
+            }
+        )
+
+    next_cursor = None
+    if len(items_data) == limit:
+        next_cursor = f"{items_data[-1][4]}:{items_data[-1][0]}"
+
+    return jsonify({"items": formatted_items, "next_cursor": next_cursor})
+
+
 @app.route("/config")
 def config():
     params = db.get_all_parameters()
@@ -316,10 +347,35 @@ def update_config():
 
     # Update System parameters
     db.set_parameter("items_per_query", request.form.get("items_per_query", "20"))
+    db.set_parameter("catchup_max_pages", request.form.get("catchup_max_pages", "5"))
     db.set_parameter(
         "query_refresh_delay", request.form.get("query_refresh_delay", "60")
     )
     db.set_parameter("banwords", request.form.get("banwords", ""))
+    db.set_parameter(
+        "item_retention_days", request.form.get("item_retention_days", "0")
+    )
+    db.set_parameter("query_concurrency", request.form.get("query_concurrency", "1"))
+    db.set_parameter(
+        "query_concurrency_per_domain",
+        request.form.get("query_concurrency_per_domain", "4"),
+    )
+    db.set_parameter(
+        "query_concurrency_per_proxy",
+        request.form.get("query_concurrency_per_proxy", "2"),
+    )
+    adaptive_polling = "adaptive_polling" in request.form
+    db.set_parameter("adaptive_polling", str(adaptive_polling))
+    db.set_parameter(
+        "polling_requests_per_minute",
+        request.form.get("polling_requests_per_minute", "60"),
+    )
+    db.set_parameter(
+        "rate_limit_catalog", request.form.get("rate_limit_catalog", "120")
+    )
+    db.set_parameter("rate_limit_users", request.form.get("rate_limit_users", "60"))
+    query_coalescing = "query_coalescing" in request.form
+    db.set_parameter("query_coalescing", str(query_coalescing))
 
     # Update Proxy parameters
     check_proxies = "check_proxies" in request.form
@@ -331,6 +387,11 @@ def update_config():
     db.set_parameter("message_template", request.form.get("message_template", ""))
     db.set_parameter("user_agents", request.form.get("user_agents", "[]"))
     db.set_parameter("default_headers", request.form.get("default_headers", "{}"))
+    db_writer_process = "db_writer_process" in request.form
+    db.set_parameter("db_writer_process", str(db_writer_process))
+    db.set_parameter(
+        "shared_memory_queues", request.form.get("shared_memory_queues", "")
+    )
 
     # Reset proxy cache to force refresh on next use
     db.set_parameter("last_proxy_check_time", "1")